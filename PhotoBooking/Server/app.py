@@ -1,7 +1,11 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+from dao.operations import transaction_manager
+from transactions.Tracing import configure_logging
 from services.scheduler import Scheduler
-from transactions.TransactionManager import TransactionManager
+from routes import (
+    DEADLOCK_SWEEP_INTERVAL, PROMETHEUS_CONTENT_TYPE, listing_body, page_args, request_deadline, stream_parts
+)
 import logging
 import threading
 import time
@@ -11,14 +15,30 @@ app = Flask(__name__)
 CORS(app)
 scheduler = Scheduler()
 
-# Initialize TransactionManager
-transaction_manager = TransactionManager()
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging, through a background thread (level set by PHOTOBOOKING_LOG_LEVEL)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 
+def listing_response(name, key, rows, limit):
+    return jsonify(listing_body(name, key, rows, limit)), 200
+
+
+def streaming_response(name, rows):
+    """
+    Stream a listing as it is read from the database, rather than building it in memory
+    (see routes.stream_parts).
+    """
+    mimetype, start, end, write = stream_parts(request, name)
+
+    def generate():
+        yield start
+        for i, row in enumerate(rows):
+            yield write(row, not i)
+        yield end
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "Server is running"}), 200
@@ -33,13 +53,34 @@ def create_booking():
             return jsonify({"error": "Missing required field: 'TransactionID'"}), 400
 
         logger.info(f"Received booking creation request: {booking_data}")
-        result = scheduler.schedule_booking(transaction_id, booking_data)
+        result = scheduler.schedule_booking(transaction_id, booking_data, request_deadline(request))
         return jsonify({"message": f"Booking created successfully with ID {result}"}), 201
     except Exception as e:
         logger.error(f"Error creating booking: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/bookings/batch', methods=['POST'])
+def create_bookings_batch():
+    """
+    Book several timeslots for a client in one transaction.
+    Expects JSON payload with 'TransactionID', 'TimeslotIDs' (list), 'ClientID' and 'Location'.
+    """
+    try:
+        batch_data = request.json
+        transaction_id = batch_data.get("TransactionID")
+        timeslot_ids = batch_data.get("TimeslotIDs")
+        if not transaction_id or not isinstance(timeslot_ids, list) or not timeslot_ids:
+            return jsonify({"error": "Missing required fields: 'TransactionID', 'TimeslotIDs'"}), 400
+
+        logger.info(f"Received batch booking request: {batch_data}")
+        booking_ids = scheduler.schedule_bookings_batch(transaction_id, batch_data, request_deadline(request))
+        return jsonify({"message": f"{len(booking_ids)} bookings created successfully", "BookingIDs": booking_ids}), 201
+    except Exception as e:
+        logger.error(f"Error creating bookings: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/bookings/<int:booking_id>', methods=['DELETE'])
 def cancel_booking(booking_id):
     try:
@@ -48,7 +89,7 @@ def cancel_booking(booking_id):
             return jsonify({"error": "Missing required parameter 'TransactionID'"}), 400
 
         logger.info(f"Received request to cancel booking with ID {booking_id}")
-        result = scheduler.cancel_booking(transaction_id, booking_id)
+        result = scheduler.cancel_booking(transaction_id, booking_id, request_deadline(request))
         return jsonify({"message": result}), 200
     except Exception as e:
         logger.error(f"Error canceling booking: {e}")
@@ -59,7 +100,10 @@ def cancel_booking(booking_id):
 def create_availability():
     """
     Create availability slots for a photographer.
-    Expects JSON payload with availability details.
+    Expects JSON payload with availability details: 'AvailableDate', 'StartTime' and 'EndTime'
+    for a single slot, a list of such 'Slots', or a 'Recurrence' rule such as
+    {"StartDate": "2025-03-03", "Months": 3, "Weekdays": [0, 1, 2, 3, 4],
+     "DayStart": "09:00", "DayEnd": "17:00", "SlotMinutes": 60}.
     """
     try:
         availability_data = request.json
@@ -70,7 +114,9 @@ def create_availability():
             return jsonify({"error": "Missing required fields: 'TransactionID', 'PhotographerID'"}), 400
 
         logger.info(f"Creating availability for photographer {photographer_id}")
-        result = scheduler.create_availability(transaction_id, photographer_id, availability_data)
+        result = scheduler.create_availability(
+            transaction_id, photographer_id, availability_data, request_deadline(request)
+        )
         return jsonify({"message": result}), 201
     except Exception as e:
         logger.error(f"Error creating availability: {e}")
@@ -89,7 +135,7 @@ def get_available_photographers():
             return jsonify({"error": "Missing required parameter 'date'"}), 400
 
         logger.info(f"Fetching availability for date: {date}")
-        available_photographers = scheduler.get_available_photographers(date)
+        available_photographers = scheduler.get_available_photographers(date, request_deadline(request))
         return jsonify({"available_photographers": available_photographers}), 200
     except Exception as e:
         logger.error(f"Error fetching photographer availability: {e}")
@@ -110,7 +156,7 @@ def update_booking(booking_id):
             return jsonify({"error": "Missing required field: 'TransactionID'"}), 400
 
         logger.info(f"Received update request for booking {booking_id}: {booking_data}")
-        result = scheduler.update_booking(transaction_id, booking_id, booking_data)
+        result = scheduler.update_booking(transaction_id, booking_id, booking_data, request_deadline(request))
         return jsonify({"message": result}), 200
     except Exception as e:
         logger.error(f"Error updating booking: {e}")
@@ -120,13 +166,17 @@ def update_booking(booking_id):
 @app.route('/clients/<int:client_id>/bookings', methods=['GET'])
 def list_bookings_for_client(client_id):
     """
-    Retrieve all bookings made by a specific client.
+    Retrieve the bookings made by a specific client.
     Path Params: client_id (int)
+    Query Params: after, limit (keyset pagination, see routes.page_args) or stream (json/ndjson)
     """
     try:
         logger.info(f"Fetching bookings for client {client_id}")
-        bookings = scheduler.list_bookings_for_client(client_id)
-        return jsonify({"bookings": bookings}), 200
+        if request.args.get("stream"):
+            return streaming_response("bookings", scheduler.stream_bookings_for_client(client_id))
+        after, limit = page_args(request)
+        bookings = scheduler.list_bookings_for_client(client_id, after, limit)
+        return listing_response("bookings", "BookingID", bookings, limit)
     except Exception as e:
         logger.error(f"Error fetching bookings for client: {e}")
         return jsonify({"error": str(e)}), 500
@@ -135,12 +185,16 @@ def list_bookings_for_client(client_id):
 @app.route('/clients', methods=['GET'])
 def get_all_clients():
     """
-    Retrieve all clients.
+    Retrieve the clients.
+    Query Params: after, limit (keyset pagination, see routes.page_args) or stream (json/ndjson)
     """
     try:
         logger.info("Fetching all clients.")
-        clients = scheduler.get_all_clients()
-        return jsonify({"clients": clients}), 200
+        if request.args.get("stream"):
+            return streaming_response("clients", scheduler.stream_clients())
+        after, limit = page_args(request)
+        clients = scheduler.get_all_clients(after, limit)
+        return listing_response("clients", "ClientID", clients, limit)
     except Exception as e:
         logger.error(f"Error fetching clients: {e}")
         return jsonify({"error": str(e)}), 500
@@ -149,12 +203,16 @@ def get_all_clients():
 @app.route('/photographers', methods=['GET'])
 def get_all_photographers():
     """
-    Retrieve all photographers.
+    Retrieve the photographers.
+    Query Params: after, limit (keyset pagination, see routes.page_args) or stream (json/ndjson)
     """
     try:
         logger.info("Fetching all photographers.")
-        photographers = scheduler.get_all_photographers()
-        return jsonify({"photographers": photographers}), 200
+        if request.args.get("stream"):
+            return streaming_response("photographers", scheduler.stream_photographers())
+        after, limit = page_args(request)
+        photographers = scheduler.get_all_photographers(after, limit)
+        return listing_response("photographers", "PhotographerID", photographers, limit)
     except Exception as e:
         logger.error(f"Error fetching photographers: {e}")
         return jsonify({"error": str(e)}), 500
@@ -182,7 +240,7 @@ def get_timeslot_details(timeslot_id):
     """
     try:
         logger.info(f"Fetching details for timeslot {timeslot_id}")
-        timeslot = scheduler.get_timeslot_details(timeslot_id)
+        timeslot = scheduler.get_timeslot_details(timeslot_id, request_deadline(request))
         if not timeslot:
             return jsonify({"error": "Timeslot not found"}), 404
 
@@ -192,17 +250,158 @@ def get_timeslot_details(timeslot_id):
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/reports/schedule', methods=['GET'])
+def get_schedule_report():
+    """
+    Report the timeslots of a date with their photographers and bookings, read from both
+    databases as of one snapshot, without holding up bookings.
+    Query Params: date (YYYY-MM-DD)
+    """
+    try:
+        date = request.args.get('date')
+        if not date:
+            return jsonify({"error": "Missing required parameter 'date'"}), 400
+
+        logger.info(f"Building schedule report for date: {date}")
+        return jsonify(scheduler.get_schedule_report(date, request_deadline(request))), 200
+    except Exception as e:
+        logger.error(f"Error building schedule report: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/pools', methods=['GET'])
+def get_pool_stats():
+    """
+    Retrieve the connection pool state and checkout wait times of both databases.
+    """
+    try:
+        return jsonify(scheduler.get_pool_stats()), 200
+    except Exception as e:
+        logger.error(f"Error fetching pool statistics: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Retrieve the counters and latency histograms in the Prometheus text format.
+    """
+    try:
+        return Response(scheduler.get_metrics(), content_type=PROMETHEUS_CONTENT_TYPE), 200
+    except Exception as e:
+        logger.error(f"Error fetching metrics: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/cache', methods=['GET'])
+def get_cache_stats():
+    """
+    Retrieve the hit, miss and eviction counters of the read cache.
+    """
+    try:
+        return jsonify(scheduler.get_cache_stats()), 200
+    except Exception as e:
+        logger.error(f"Error fetching cache statistics: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/availability-index/verify', methods=['GET'])
+def verify_availability_index():
+    """
+    Compare the in-memory availability index with the tables.
+    Query Params: repair (true/false) - rebuild the index if it differs
+    """
+    try:
+        repair = request.args.get('repair', 'false').lower() == 'true'
+        result = scheduler.verify_availability_index(repair)
+        if not result["consistent"]:
+            logger.warning(f"Availability index inconsistent: {result}")
+        return jsonify(result), 200
+    except Exception as e:
+        logger.error(f"Error verifying availability index: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/locks', methods=['GET'])
+def get_locks():
+    """
+    Retrieve the lock table: the holders of every locked resource with their mode and the queued requests,
+    with how long each has been waiting.
+    """
+    return concurrency_state_response("locks")
+
+
+@app.route('/admin/transactions', methods=['GET'])
+def get_transactions():
+    """
+    Retrieve the unfinished transactions with their status and age, oldest first.
+    """
+    return concurrency_state_response("transactions")
+
+
+@app.route('/admin/transactions/history', methods=['GET'])
+def get_transaction_history():
+    """
+    Retrieve the most recently finished transactions with their outcome and duration, latest first.
+    """
+    return concurrency_state_response("history")
+
+
+@app.route('/admin/conflicts', methods=['GET'])
+def get_conflict_stats():
+    """
+    Retrieve the conflict policy of the lock manager with its lock wait, abort (by reason)
+    and restart counts.
+    """
+    return concurrency_state_response("conflicts")
+
+
+@app.route('/admin/wait-for', methods=['GET'])
+def get_wait_for_edges():
+    """
+    Retrieve the edges of the wait-for graph.
+    """
+    return concurrency_state_response("wait_for")
+
+
+@app.route('/admin/contention', methods=['GET'])
+def get_contended_resources():
+    """
+    Retrieve the most contended resources, by total time spent waiting for their locks.
+    Query Params: top (default 10)
+    """
+    return concurrency_state_response("contended")
+
+
+def concurrency_state_response(part):
+    try:
+        top = request.args.get('top', default=10, type=int)
+        return jsonify({part: scheduler.get_concurrency_state(part, top)}), 200
+    except Exception as e:
+        logger.error(f"Error fetching concurrency state: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 def deadlock_checker():
     while True:
-        time.sleep(5)
-        transaction_to_abort = transaction_manager.check_deadlock()
-        if transaction_to_abort:
-            # logger.info(f"Current Wait-for Graph: {transaction_manager.wait_for_graph}")
-            logger.warning(f"Deadlock detected. Aborted transaction: {transaction_to_abort}")
+        time.sleep(DEADLOCK_SWEEP_INTERVAL)
+        victims = transaction_manager.check_deadlock()
+        if victims:
+            logger.warning(f"Deadlock detected. Aborted transactions: {victims}")
 
 
 if __name__ == '__main__':
-    # Start the deadlock checker thread
-    threading.Thread(target=deadlock_checker, daemon=True).start()
+    # Roll back the transactions interrupted by a crash before serving requests
+    recovered = scheduler.recover()
+    if recovered:
+        logger.warning(f"Recovery rolled back transactions: {recovered}")
+
+    # Serve availability queries from memory
+    indexed = scheduler.build_availability_index()
+    logger.info(f"Availability index built with {indexed} timeslots.")
+
+    # Start the fallback deadlock checker thread
+    if DEADLOCK_SWEEP_INTERVAL > 0:
+        threading.Thread(target=deadlock_checker, daemon=True).start()
 
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,420 @@
+"""
+Asyncio entry point of the booking API: the routes of app.py served by Quart on a single
+event loop, with asyncio database engines and lock waits. Open requests waiting on a
+database or a lock hold no thread. Run with:
+
+    python asgi_app.py
+    hypercorn asgi_app:app --bind 0.0.0.0:5000
+"""
+import asyncio
+import logging
+
+from quart import Quart, Response, request, jsonify
+from quart_cors import cors
+
+from dao.operations import transaction_manager
+from routes import (
+    DEADLOCK_SWEEP_INTERVAL, PROMETHEUS_CONTENT_TYPE, listing_body, page_args, request_deadline, stream_parts
+)
+from transactions.Tracing import configure_logging
+from services.async_scheduler import AsyncScheduler
+
+# Initialize Quart app and AsyncScheduler service
+app = cors(Quart(__name__))
+scheduler = AsyncScheduler()
+
+# Configure logging, through a background thread (level set by PHOTOBOOKING_LOG_LEVEL)
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+def listing_response(name, key, rows, limit):
+    return jsonify(listing_body(name, key, rows, limit)), 200
+
+
+def streaming_response(name, rows):
+    """
+    Stream a listing as it is read from the database (see routes.stream_parts).
+    """
+    mimetype, start, end, write = stream_parts(request, name)
+
+    async def generate():
+        yield start
+        first = True
+        async for row in rows:
+            yield write(row, first)
+            first = False
+        yield end
+    return Response(generate(), mimetype=mimetype)
+
+
+@app.before_serving
+async def startup():
+    # Roll back the transactions interrupted by a crash before serving requests
+    recovered = await scheduler.recover()
+    if recovered:
+        logger.warning(f"Recovery rolled back transactions: {recovered}")
+
+    # Serve availability queries from memory
+    indexed = await scheduler.build_availability_index()
+    logger.info(f"Availability index built with {indexed} timeslots.")
+
+    # Start the fallback deadlock checker task
+    if DEADLOCK_SWEEP_INTERVAL > 0:
+        app.add_background_task(deadlock_checker)
+
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    return jsonify({"status": "Server is running"}), 200
+
+
+@app.route('/bookings', methods=['POST'])
+async def create_booking():
+    try:
+        booking_data = await request.get_json()
+        transaction_id = booking_data.get("TransactionID")
+        if not transaction_id:
+            return jsonify({"error": "Missing required field: 'TransactionID'"}), 400
+
+        logger.info(f"Received booking creation request: {booking_data}")
+        result = await scheduler.schedule_booking(transaction_id, booking_data, request_deadline(request))
+        return jsonify({"message": f"Booking created successfully with ID {result}"}), 201
+    except Exception as e:
+        logger.error(f"Error creating booking: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/bookings/batch', methods=['POST'])
+async def create_bookings_batch():
+    """
+    Book several timeslots for a client in one transaction.
+    Expects JSON payload with 'TransactionID', 'TimeslotIDs' (list), 'ClientID' and 'Location'.
+    """
+    try:
+        batch_data = await request.get_json()
+        transaction_id = batch_data.get("TransactionID")
+        timeslot_ids = batch_data.get("TimeslotIDs")
+        if not transaction_id or not isinstance(timeslot_ids, list) or not timeslot_ids:
+            return jsonify({"error": "Missing required fields: 'TransactionID', 'TimeslotIDs'"}), 400
+
+        logger.info(f"Received batch booking request: {batch_data}")
+        booking_ids = await scheduler.schedule_bookings_batch(transaction_id, batch_data, request_deadline(request))
+        return jsonify({"message": f"{len(booking_ids)} bookings created successfully", "BookingIDs": booking_ids}), 201
+    except Exception as e:
+        logger.error(f"Error creating bookings: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/bookings/<int:booking_id>', methods=['DELETE'])
+async def cancel_booking(booking_id):
+    try:
+        transaction_id = request.args.get("TransactionID")
+        if not transaction_id:
+            return jsonify({"error": "Missing required parameter 'TransactionID'"}), 400
+
+        logger.info(f"Received request to cancel booking with ID {booking_id}")
+        result = await scheduler.cancel_booking(transaction_id, booking_id, request_deadline(request))
+        return jsonify({"message": result}), 200
+    except Exception as e:
+        logger.error(f"Error canceling booking: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/availability', methods=['POST'])
+async def create_availability():
+    """
+    Create availability slots for a photographer: a single slot, a list of 'Slots'
+    or a 'Recurrence' rule, as in app.py.
+    """
+    try:
+        availability_data = await request.get_json()
+        transaction_id = availability_data.get("TransactionID")
+        photographer_id = availability_data.get("PhotographerID")
+
+        if not transaction_id or not photographer_id:
+            return jsonify({"error": "Missing required fields: 'TransactionID', 'PhotographerID'"}), 400
+
+        logger.info(f"Creating availability for photographer {photographer_id}")
+        result = await scheduler.create_availability(
+            transaction_id, photographer_id, availability_data, request_deadline(request)
+        )
+        return jsonify({"message": result}), 201
+    except Exception as e:
+        logger.error(f"Error creating availability: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/photographers/availability', methods=['GET'])
+async def get_available_photographers():
+    """
+    List available photographers for a given date.
+    Query Params: date (YYYY-MM-DD)
+    """
+    try:
+        date = request.args.get('date')
+        if not date:
+            return jsonify({"error": "Missing required parameter 'date'"}), 400
+
+        logger.info(f"Fetching availability for date: {date}")
+        available_photographers = await scheduler.get_available_photographers(date, request_deadline(request))
+        return jsonify({"available_photographers": available_photographers}), 200
+    except Exception as e:
+        logger.error(f"Error fetching photographer availability: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/bookings/<int:booking_id>', methods=['PUT'])
+async def update_booking(booking_id):
+    """
+    Update booking details.
+    Path Params: booking_id (int)
+    Expects JSON payload with updated booking details.
+    """
+    try:
+        booking_data = await request.get_json()
+        transaction_id = booking_data.get("TransactionID")
+        if not transaction_id:
+            return jsonify({"error": "Missing required field: 'TransactionID'"}), 400
+
+        logger.info(f"Received update request for booking {booking_id}: {booking_data}")
+        result = await scheduler.update_booking(transaction_id, booking_id, booking_data, request_deadline(request))
+        return jsonify({"message": result}), 200
+    except Exception as e:
+        logger.error(f"Error updating booking: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/clients/<int:client_id>/bookings', methods=['GET'])
+async def list_bookings_for_client(client_id):
+    """
+    Retrieve the bookings made by a specific client.
+    Query Params: after, limit (keyset pagination) or stream (json/ndjson)
+    """
+    try:
+        logger.info(f"Fetching bookings for client {client_id}")
+        if request.args.get("stream"):
+            return streaming_response("bookings", scheduler.stream_bookings_for_client(client_id))
+        after, limit = page_args(request)
+        bookings = await scheduler.list_bookings_for_client(client_id, after, limit)
+        return listing_response("bookings", "BookingID", bookings, limit)
+    except Exception as e:
+        logger.error(f"Error fetching bookings for client: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/clients', methods=['GET'])
+async def get_all_clients():
+    """
+    Retrieve the clients.
+    Query Params: after, limit (keyset pagination) or stream (json/ndjson)
+    """
+    try:
+        logger.info("Fetching all clients.")
+        if request.args.get("stream"):
+            return streaming_response("clients", scheduler.stream_clients())
+        after, limit = page_args(request)
+        clients = await scheduler.get_all_clients(after, limit)
+        return listing_response("clients", "ClientID", clients, limit)
+    except Exception as e:
+        logger.error(f"Error fetching clients: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/photographers', methods=['GET'])
+async def get_all_photographers():
+    """
+    Retrieve the photographers.
+    Query Params: after, limit (keyset pagination) or stream (json/ndjson)
+    """
+    try:
+        logger.info("Fetching all photographers.")
+        if request.args.get("stream"):
+            return streaming_response("photographers", scheduler.stream_photographers())
+        after, limit = page_args(request)
+        photographers = await scheduler.get_all_photographers(after, limit)
+        return listing_response("photographers", "PhotographerID", photographers, limit)
+    except Exception as e:
+        logger.error(f"Error fetching photographers: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/photographers/<int:photographer_id>/available-timeslots', methods=['GET'])
+async def get_available_timeslots_for_photographer(photographer_id):
+    """
+    Retrieve available timeslots for a specific photographer.
+    Path Params: photographer_id (int)
+    """
+    try:
+        logger.info(f"Fetching available timeslots for photographer {photographer_id}.")
+        timeslots = await scheduler.get_available_timeslots_for_photographer(photographer_id)
+        return jsonify({"available_timeslots": timeslots}), 200
+    except Exception as e:
+        logger.error(f"Error fetching available timeslots for photographer: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/timeslots/<int:timeslot_id>', methods=['GET'])
+async def get_timeslot_details(timeslot_id):
+    """
+    Retrieve details for a specific timeslot.
+    """
+    try:
+        logger.info(f"Fetching details for timeslot {timeslot_id}")
+        timeslot = await scheduler.get_timeslot_details(timeslot_id, request_deadline(request))
+        if not timeslot:
+            return jsonify({"error": "Timeslot not found"}), 404
+
+        return jsonify(timeslot), 200
+    except Exception as e:
+        logger.error(f"Error fetching timeslot details: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/reports/schedule', methods=['GET'])
+async def get_schedule_report():
+    """
+    Report the timeslots of a date with their photographers and bookings, read from both
+    databases as of one snapshot, without holding up bookings.
+    Query Params: date (YYYY-MM-DD)
+    """
+    try:
+        date = request.args.get('date')
+        if not date:
+            return jsonify({"error": "Missing required parameter 'date'"}), 400
+
+        logger.info(f"Building schedule report for date: {date}")
+        return jsonify(await scheduler.get_schedule_report(date, request_deadline(request))), 200
+    except Exception as e:
+        logger.error(f"Error building schedule report: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/pools', methods=['GET'])
+async def get_pool_stats():
+    """
+    Retrieve the connection pool state and checkout wait times of both databases.
+    """
+    try:
+        return jsonify(await scheduler.get_pool_stats()), 200
+    except Exception as e:
+        logger.error(f"Error fetching pool statistics: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    """
+    Retrieve the counters and latency histograms in the Prometheus text format.
+    """
+    try:
+        return Response(await scheduler.get_metrics(), content_type=PROMETHEUS_CONTENT_TYPE), 200
+    except Exception as e:
+        logger.error(f"Error fetching metrics: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/cache', methods=['GET'])
+async def get_cache_stats():
+    """
+    Retrieve the hit, miss and eviction counters of the read cache.
+    """
+    try:
+        return jsonify(await scheduler.get_cache_stats()), 200
+    except Exception as e:
+        logger.error(f"Error fetching cache statistics: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/availability-index/verify', methods=['GET'])
+async def verify_availability_index():
+    """
+    Compare the in-memory availability index with the tables.
+    Query Params: repair (true/false) - rebuild the index if it differs
+    """
+    try:
+        repair = request.args.get('repair', 'false').lower() == 'true'
+        result = await scheduler.verify_availability_index(repair)
+        if not result["consistent"]:
+            logger.warning(f"Availability index inconsistent: {result}")
+        return jsonify(result), 200
+    except Exception as e:
+        logger.error(f"Error verifying availability index: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/locks', methods=['GET'])
+async def get_locks():
+    """
+    Retrieve the lock table: the holders of every locked resource with their mode and the queued requests,
+    with how long each has been waiting.
+    """
+    return await concurrency_state_response("locks")
+
+
+@app.route('/admin/transactions', methods=['GET'])
+async def get_transactions():
+    """
+    Retrieve the unfinished transactions with their status and age, oldest first.
+    """
+    return await concurrency_state_response("transactions")
+
+
+@app.route('/admin/transactions/history', methods=['GET'])
+async def get_transaction_history():
+    """
+    Retrieve the most recently finished transactions with their outcome and duration, latest first.
+    """
+    return await concurrency_state_response("history")
+
+
+@app.route('/admin/conflicts', methods=['GET'])
+async def get_conflict_stats():
+    """
+    Retrieve the conflict policy of the lock manager with its lock wait, abort (by reason)
+    and restart counts.
+    """
+    return await concurrency_state_response("conflicts")
+
+
+@app.route('/admin/wait-for', methods=['GET'])
+async def get_wait_for_edges():
+    """
+    Retrieve the edges of the wait-for graph.
+    """
+    return await concurrency_state_response("wait_for")
+
+
+@app.route('/admin/contention', methods=['GET'])
+async def get_contended_resources():
+    """
+    Retrieve the most contended resources, by total time spent waiting for their locks.
+    Query Params: top (default 10)
+    """
+    return await concurrency_state_response("contended")
+
+
+async def concurrency_state_response(part):
+    try:
+        top = request.args.get('top', default=10, type=int)
+        return jsonify({part: await scheduler.get_concurrency_state(part, top)}), 200
+    except Exception as e:
+        logger.error(f"Error fetching concurrency state: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+async def deadlock_checker():
+    while True:
+        await asyncio.sleep(DEADLOCK_SWEEP_INTERVAL)
+        victims = transaction_manager.check_deadlock()
+        if victims:
+            logger.warning(f"Deadlock detected. Aborted transactions: {victims}")
+
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = ["0.0.0.0:5000"]
+    asyncio.run(serve(app, config))
@@ -0,0 +1,405 @@
+"""
+Load generator for the booking API. A number of concurrent clients run a weighted mix of
+operations for a fixed duration, choosing timeslots with a Zipfian skew so that a few hot
+timeslots concentrate the lock contention. It reports the throughput, the latency
+percentiles and the lock failure, abort and deadlock rates, and can save them as JSON.
+
+Against a running server:
+
+    python -m bench.loadgen --url http://127.0.0.1:5000 --timeslots 200 --clients 32 --duration 60
+
+Against the app in-process, on SQLite files seeded with --photographers, --timeslots
+and --customers (no server or database needed). SQLite locks a whole database for writing,
+so concurrent transactions writing both databases in different orders can wait on each other
+outside the lock manager until the busy timeout; these are reported as "database_busy":
+
+    python -m bench.loadgen --sqlite --clients 16 --duration 30 --skew 1.2 --output run.json
+"""
+import argparse
+import bisect
+import datetime
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from threading import Thread
+
+OPERATIONS = ("book", "cancel", "update", "search", "availability")
+DEFAULT_MIX = "book=40,cancel=15,update=15,search=25,availability=5"
+START_DATE = datetime.date(2030, 1, 7)
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def request(self, method, path, json=None, params=None):
+        response = self.session.request(method, self.base_url + path, json=json, params=params, timeout=120)
+        return response.status_code, response.text
+
+
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, json=None, params=None):
+        response = self.client.open(path, method=method, json=json, query_string=params)
+        return response.status_code, response.get_data(as_text=True)
+
+
+class ZipfChooser:
+    def __init__(self, items, skew):
+        """
+        Choose items with probability proportional to 1 / rank ** skew, the first item being
+        the most popular. A skew of 0 chooses uniformly.
+        """
+        self.items = list(items)
+        self.cum_weights = list(itertools.accumulate(1.0 / rank ** skew for rank in range(1, len(self.items) + 1)))
+
+    def choose(self, rng):
+        return self.items[bisect.bisect_left(self.cum_weights, rng.random() * self.cum_weights[-1])]
+
+
+def parse_mix(mix):
+    """
+    Parse an operation mix such as 'book=40,search=60' into a {operation: weight} dict.
+    """
+    weights = {}
+    for part in mix.split(","):
+        operation, _, weight = part.partition("=")
+        operation = operation.strip()
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{operation}', expected one of {', '.join(OPERATIONS)}.")
+        weights[operation] = float(weight or 1)
+    return weights
+
+
+def classify(status, body):
+    """
+    Classify the outcome of an operation from its response.
+    """
+    if 200 <= status < 300:
+        return "ok"
+    if "Lock acquisition failed" in body:
+        return "lock_failure"
+    if "was aborted" in body:
+        return "aborted"
+    if "database is locked" in body:
+        return "database_busy"
+    if "not available" in body or "not found" in body.lower():
+        return "conflict"
+    return "error"
+
+
+def percentiles(latencies):
+    """
+    Return the p50, p95, p99 and maximum of a list of latencies, in milliseconds.
+    """
+    if not latencies:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(latencies)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {"p50": rank(0.50), "p95": rank(0.95), "p99": rank(0.99), "max": ordered[-1] * 1000}
+
+
+class Worker:
+    transaction_ids = itertools.count(int(time.time() * 1000) * 1000)
+
+    def __init__(self, client, config, timeslots, seed):
+        """
+        One client of the load: it runs operations back to back and keeps its own results,
+        which are merged once the run is over.
+        """
+        self.client = client
+        self.config = config
+        self.timeslots = timeslots
+        self.rng = random.Random(seed)
+        self.operations = list(config["mix"])
+        self.cum_weights = list(itertools.accumulate(config["mix"].values()))
+        self.bookings = []  # IDs of the bookings made by this client and not cancelled
+        self.results = {operation: {"latencies": [], "outcomes": {}} for operation in OPERATIONS}
+
+    def run(self, until):
+        while time.monotonic() < until:
+            operation = self.rng.choices(self.operations, cum_weights=self.cum_weights)[0]
+            if operation in ("cancel", "update") and not self.bookings:
+                operation = "book"
+            start = time.perf_counter()
+            status, body = getattr(self, operation)()
+            elapsed = time.perf_counter() - start
+            result = self.results[operation]
+            result["latencies"].append(elapsed)
+            outcome = classify(status, body)
+            result["outcomes"][outcome] = result["outcomes"].get(outcome, 0) + 1
+
+    def random_date(self):
+        return (START_DATE + datetime.timedelta(days=self.rng.randrange(self.config["days"]))).isoformat()
+
+    def book(self):
+        status, body = self.client.request("POST", "/bookings", json={
+            "TransactionID": next(self.transaction_ids),
+            "TimeslotID": self.timeslots.choose(self.rng),
+            "ClientID": self.rng.randint(1, self.config["customers"]),
+            "Location": "Load test",
+        })
+        match = re.search(r"ID (\d+)", body) if status == 201 else None
+        if match:
+            self.bookings.append(int(match.group(1)))
+        return status, body
+
+    def cancel(self):
+        booking_id = self.bookings.pop(self.rng.randrange(len(self.bookings)))
+        return self.client.request("DELETE", f"/bookings/{booking_id}",
+                                   params={"TransactionID": next(self.transaction_ids)})
+
+    def update(self):
+        booking_id = self.rng.choice(self.bookings)
+        return self.client.request("PUT", f"/bookings/{booking_id}", json={
+            "TransactionID": next(self.transaction_ids),
+            "Location": f"Location {self.rng.randrange(100)}",
+        })
+
+    def search(self):
+        return self.client.request("GET", "/photographers/availability", params={"date": self.random_date()})
+
+    def availability(self):
+        hour = self.rng.randrange(8, 20)
+        return self.client.request("POST", "/availability", json={
+            "TransactionID": next(self.transaction_ids),
+            "PhotographerID": self.rng.randint(1, self.config["photographers"]),
+            "AvailableDate": self.random_date(),
+            "StartTime": f"{hour:02d}:00",
+            "EndTime": f"{hour + 1:02d}:00",
+        })
+
+
+def read_counters(client):
+    """
+    Read the unlabelled counters and the failed lock requests from the server's /metrics.
+    :return: A {name: value} dict, empty if the server does not expose metrics.
+    """
+    try:
+        status, body = client.request("GET", "/metrics")
+    except Exception:
+        return {}
+    if status != 200:
+        return {}
+    counters = {}
+    for line in body.splitlines():
+        if line.startswith("#") or not line.strip():
+            continue
+        name, _, value = line.rpartition(" ")
+        if name.startswith("photobooking_lock_requests_total") and 'result="failed"' in name:
+            name = "photobooking_lock_requests_failed"
+        elif "{" in name:
+            continue
+        counters[name] = counters.get(name, 0) + float(value)
+    return counters
+
+
+def seed_database(photographers, timeslots, customers, days):
+    """
+    Fill freshly created SQLite databases with photographers, clients and available timeslots
+    spread over the given number of days. Databases already holding photographers are kept as is.
+    """
+    from dao.db import Session1, Session2
+    from dao.models import Client, Photographer, Timeslot
+
+    session1, session2 = Session1(), Session2()
+    try:
+        if session1.query(Photographer).count():
+            return
+        session1.add_all([Photographer(Name=f"Photographer {i}", Specialty="Wedding")
+                          for i in range(1, photographers + 1)])
+        session1.flush()
+        slots = []
+        for i in range(timeslots):
+            day, photographer = divmod(i, photographers)
+            hour = 8 + (day // days) % 12
+            slots.append(Timeslot(
+                PhotographerID=1 + photographer,
+                AvailableDate=START_DATE + datetime.timedelta(days=day % days),
+                StartTime=datetime.time(hour),
+                EndTime=datetime.time(hour + 1),
+                Status="Available",
+            ))
+        session1.add_all(slots)
+        session2.add_all([Client(Name=f"Client {i}", Email=f"client{i}@example.com", Phone="000")
+                          for i in range(1, customers + 1)])
+        session1.commit()
+        session2.commit()
+    finally:
+        session1.close()
+        session2.close()
+
+
+def in_process_app(config):
+    """
+    Point the app at new SQLite databases and a new log in a temporary directory, seed them
+    and import the app.
+    """
+    directory = config["sqlite_dir"] or tempfile.mkdtemp(prefix="photobooking-load-")
+    os.environ["PHOTOBOOKING_DB1_URL"] = f"sqlite:///{os.path.join(directory, 'db1.sqlite')}"
+    os.environ["PHOTOBOOKING_DB2_URL"] = f"sqlite:///{os.path.join(directory, 'db2.sqlite')}"
+    os.environ["PHOTOBOOKING_LOG_DIR"] = os.path.join(directory, "logs")
+    os.environ.setdefault("PHOTOBOOKING_LOG_LEVEL", "CRITICAL")
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+    seed_database(config["photographers"], config["timeslots"], config["customers"], config["days"])
+    import app
+
+    app.scheduler.build_availability_index()
+    return app.app
+
+
+def run(config):
+    """
+    Run the load described by config and return the report.
+    """
+    if config["url"]:
+        def make_client():
+            return HttpClient(config["url"])
+    else:
+        flask_app = in_process_app(config)
+
+        def make_client():
+            return InProcessClient(flask_app)
+
+    rng = random.Random(config["seed"])
+    timeslots = ZipfChooser(range(1, config["timeslots"] + 1), config["skew"])
+    workers = [Worker(make_client(), config, timeslots, rng.random()) for _ in range(config["clients"])]
+
+    counters_before = read_counters(workers[0].client)
+    start = time.monotonic()
+    threads = [Thread(target=worker.run, args=(start + config["duration"],)) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    counters_after = read_counters(workers[0].client)
+
+    return report(config, workers, elapsed, counters_before, counters_after)
+
+
+def report(config, workers, elapsed, counters_before, counters_after):
+    by_operation = {}
+    all_latencies = []
+    totals = {}
+    for operation in OPERATIONS:
+        latencies = [latency for worker in workers for latency in worker.results[operation]["latencies"]]
+        if not latencies:
+            continue
+        outcomes = {}
+        for worker in workers:
+            for outcome, count in worker.results[operation]["outcomes"].items():
+                outcomes[outcome] = outcomes.get(outcome, 0) + count
+                totals[outcome] = totals.get(outcome, 0) + count
+        all_latencies.extend(latencies)
+        by_operation[operation] = {
+            "count": len(latencies),
+            "throughput_per_second": len(latencies) / elapsed,
+            "outcomes": outcomes,
+            "latency_ms": percentiles(latencies),
+        }
+
+    count = len(all_latencies)
+    server = {
+        name.replace("photobooking_", ""): counters_after[name] - counters_before.get(name, 0)
+        for name in counters_after
+        if name.startswith("photobooking_") and name.endswith(("_total", "_failed"))
+    }
+    started = server.get("transactions_started_total")
+    rates = {
+        "lock_failure": totals.get("lock_failure", 0) / count if count else 0.0,
+        "abort": server["transactions_aborted_total"] / started if started else None,
+        "deadlock": server["deadlock_victims_total"] / started if started else None,
+        "conflict": totals.get("conflict", 0) / count if count else 0.0,
+        "database_busy": totals.get("database_busy", 0) / count if count else 0.0,
+        "error": totals.get("error", 0) / count if count else 0.0,
+    }
+    return {
+        "config": {key: value for key, value in config.items() if key != "sqlite_dir"},
+        "duration_seconds": elapsed,
+        "operations": count,
+        "throughput_per_second": count / elapsed,
+        "latency_ms": percentiles(all_latencies),
+        "outcomes": totals,
+        "rates": rates,
+        "by_operation": by_operation,
+        "server_counters": server,
+    }
+
+
+def print_report(result):
+    print(f"{result['operations']} operations in {result['duration_seconds']:.1f}s: "
+          f"{result['throughput_per_second']:.1f} ops/s")
+    print(f"{'operation':<14}{'count':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  outcomes")
+    rows = list(result["by_operation"].items()) + [("all", dict(
+        count=result["operations"], throughput_per_second=result["throughput_per_second"],
+        latency_ms=result["latency_ms"], outcomes=result["outcomes"],
+    ))]
+    for operation, stats in rows:
+        latency = stats["latency_ms"]
+        outcomes = ", ".join(f"{name}={value}" for name, value in sorted(stats["outcomes"].items()))
+        print(f"{operation:<14}{stats['count']:>8}{stats['throughput_per_second']:>10.1f}"
+              f"{latency['p50']:>10.2f}{latency['p95']:>10.2f}{latency['p99']:>10.2f}  {outcomes}")
+    rates = ", ".join(
+        f"{name}={'n/a' if value is None else f'{value:.2%}'}" for name, value in result["rates"].items()
+    )
+    print(f"rates: {rates}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent booking load generator.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Base URL of a running server.")
+    target.add_argument("--sqlite", action="store_true", help="Run the app in-process on seeded SQLite files.")
+    parser.add_argument("--sqlite-dir", help="Directory of the SQLite files (a new temporary one by default).")
+    parser.add_argument("--clients", type=int, default=16, help="Number of concurrent clients.")
+    parser.add_argument("--duration", type=float, default=30.0, help="Duration of the run, in seconds.")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Weighted operation mix (default {DEFAULT_MIX}).")
+    parser.add_argument("--skew", type=float, default=1.0,
+                        help="Zipf exponent of the timeslot choice, 0 for uniform (default 1.0).")
+    parser.add_argument("--timeslots", type=int, default=200,
+                        help="Timeslot IDs 1..N the bookings choose from (seeded in SQLite mode).")
+    parser.add_argument("--photographers", type=int, default=10)
+    parser.add_argument("--customers", type=int, default=100, help="Client IDs 1..N making the bookings.")
+    parser.add_argument("--days", type=int, default=5, help="Days the timeslots and searches are spread over.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    config = {
+        "url": args.url,
+        "sqlite_dir": args.sqlite_dir,
+        "clients": args.clients,
+        "duration": args.duration,
+        "mix": parse_mix(args.mix),
+        "skew": args.skew,
+        "timeslots": args.timeslots,
+        "photographers": args.photographers,
+        "customers": args.customers,
+        "days": args.days,
+        "seed": args.seed,
+    }
+    result = run(config)
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+if __name__ == "__main__":
+    main()
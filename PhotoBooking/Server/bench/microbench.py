@@ -0,0 +1,283 @@
+"""
+Microbenchmarks of the transaction primitives, run without a database: lock acquire/release
+throughput at 1, 8 and 64 threads, wait-for graph deadlock search as the graph grows to
+10k transactions, transaction registry throughput and log append latency as the log grows.
+
+    python -m bench.microbench --output bench-results.json
+    python -m bench.microbench --baseline bench-results.json --threshold 0.25
+
+With --baseline, every result is compared with the same benchmark of the baseline file and
+the run fails (exit status 1) if one of them is worse by more than the threshold, a fraction
+of the baseline value. Baselines are only comparable on the same machine.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from threading import Barrier, Thread
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from transactions.LockManager import LockManager
+from transactions.Locks import Locks
+from transactions.LogManager import LogManager
+from transactions.ResourceKey import ResourceKey
+from transactions.Transactions import Transactions
+from transactions.WaitForGraph import WaitForGraph
+
+THREAD_COUNTS = (1, 8, 64)
+GRAPH_SIZES = (1000, 5000, 10000)
+LOG_SIZES = (0, 2000, 10000)
+
+
+def result(value, unit, higher_is_better):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def run_threads(thread_count, seconds, operation):
+    """
+    Run operation(thread_index, iteration) in a loop on thread_count threads started together,
+    for the given number of seconds.
+    :return: The number of operations per second, over all threads.
+    """
+    barrier = Barrier(thread_count + 1)
+    counts = [0] * thread_count
+    stop = []
+
+    def loop(index):
+        barrier.wait()
+        iteration = 0
+        while not stop:
+            operation(index, iteration)
+            iteration += 1
+        counts[index] = iteration
+
+    threads = [Thread(target=loop, args=(index,)) for index in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    time.sleep(seconds)
+    stop.append(True)
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def percentile(latencies, p):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def bench_locks(seconds):
+    """
+    Acquire and release throughput, each operation taking one lock and releasing it: write locks
+    on resources private to each thread, and read locks shared by all threads on 16 resources.
+    The hierarchical writes go through the lock manager, which also takes the intention locks
+    on the table and photographer of each timeslot, the table shared by all threads.
+    """
+    results = {}
+    for thread_count in THREAD_COUNTS:
+        locks = Locks()
+        lock_manager = LockManager()
+
+        def private_write(index, iteration):
+            transaction_id = (index, iteration)
+            resource = ResourceKey.timeslot(index * 1000 + iteration % 1000, index)
+            locks.acquire_lock(transaction_id, resource, "write", 1.0)
+            locks.release_locks(transaction_id)
+
+        def shared_read(index, iteration):
+            transaction_id = (index, iteration)
+            locks.acquire_lock(transaction_id, ResourceKey.timeslot(iteration % 16, 0), "read", 1.0)
+            locks.release_locks(transaction_id)
+
+        def hierarchical_write(index, iteration):
+            transaction_id = (index, iteration)
+            resource = ResourceKey.timeslot(index * 1000 + iteration % 1000, index)
+            lock_manager.acquire_lock(transaction_id, resource, "write", 1.0)
+            lock_manager.release_locks(transaction_id)
+
+        results[f"locks.private_write.{thread_count}_threads"] = result(
+            run_threads(thread_count, seconds, private_write), "ops/s", True
+        )
+        results[f"locks.shared_read.{thread_count}_threads"] = result(
+            run_threads(thread_count, seconds, shared_read), "ops/s", True
+        )
+        results[f"locks.hierarchical_write.{thread_count}_threads"] = result(
+            run_threads(thread_count, seconds, hierarchical_write), "ops/s", True
+        )
+    return results
+
+
+def build_graph(size, rng):
+    """
+    Build an acyclic wait-for graph of size transactions, each waiting for up to two older ones.
+    """
+    graph = WaitForGraph()
+    for transaction_id in range(1, size):
+        for waited_for in {rng.randrange(transaction_id), rng.randrange(transaction_id)}:
+            graph.add_edge(transaction_id, waited_for)
+    return graph
+
+
+def bench_wait_for_graph(seconds):
+    """
+    Time of a full deadlock search and of adding an edge (which searches for the cycle it may
+    close) as the wait-for graph grows.
+    """
+    results = {}
+    rng = random.Random(1)
+    for size in GRAPH_SIZES:
+        graph = build_graph(size, rng)
+
+        timings = []
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline or len(timings) < 3:
+            start = time.perf_counter()
+            graph.find_deadlocks()
+            timings.append(time.perf_counter() - start)
+        results[f"wait_for_graph.find_deadlocks.{size}_nodes"] = result(percentile(timings, 0.5) * 1000, "ms", False)
+
+        timings = []
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline or len(timings) < 3:
+            # An edge from an old transaction to a young one, searched back through the graph
+            from_transaction, to_transaction = rng.randrange(size // 10), rng.randrange(size - size // 10, size)
+            start = time.perf_counter()
+            graph.add_edge(from_transaction, to_transaction)
+            timings.append(time.perf_counter() - start)
+            graph.remove_edge(from_transaction, to_transaction)
+        results[f"wait_for_graph.add_edge.{size}_nodes"] = result(percentile(timings, 0.5) * 1e6, "us", False)
+    return results
+
+
+def bench_transactions(seconds):
+    """
+    Throughput of the transaction registry: start, status update to committed, status lookup.
+    """
+    results = {}
+    for thread_count in THREAD_COUNTS:
+        transactions = Transactions()
+
+        def lifecycle(index, iteration):
+            transaction_id = (index, iteration)
+            transactions.add_transaction(transaction_id)
+            transactions.get_transaction(transaction_id)
+            transactions.update_status(transaction_id, "committed")
+
+        results[f"transactions.lifecycle.{thread_count}_threads"] = result(
+            run_threads(thread_count, seconds, lifecycle), "ops/s", True
+        )
+    return results
+
+
+def bench_log_manager(seconds):
+    """
+    Latency of a durable log append as the log grows, and group commit throughput of 8
+    threads appending concurrently.
+    """
+    results = {}
+    log_dir = tempfile.mkdtemp(prefix="photobooking-bench-log-")
+    try:
+        log_manager = LogManager(log_dir)
+        data = {"Status": "Available", "Location": "Benchmark"}
+        written = 0
+        for size in LOG_SIZES:
+            # Grow the log to size records with transactions left open, as under load
+            while written < size:
+                log_manager.create_log(f"fill-{written}")
+                for offset in range(9):
+                    log_manager.append_log(f"fill-{written}", "Timeslots", offset, data)
+                written += 10
+
+            log_manager.create_log(f"bench-{size}")
+            timings = []
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline or len(timings) < 10:
+                start = time.perf_counter()
+                log_manager.append_log(f"bench-{size}", "Timeslots", len(timings), data)
+                timings.append(time.perf_counter() - start)
+            log_manager.commit_log(f"bench-{size}")
+            results[f"log_manager.append_p50.{size}_records"] = result(percentile(timings, 0.5) * 1000, "ms", False)
+            results[f"log_manager.append_p99.{size}_records"] = result(percentile(timings, 0.99) * 1000, "ms", False)
+
+        def append(index, iteration):
+            log_manager.append_log(f"group-{index}", "Timeslots", iteration, data)
+
+        for index in range(8):
+            log_manager.create_log(f"group-{index}")
+        results["log_manager.group_commit.8_threads"] = result(run_threads(8, seconds, append), "ops/s", True)
+        log_manager.close()
+    finally:
+        shutil.rmtree(log_dir, ignore_errors=True)
+    return results
+
+
+BENCHMARKS = {
+    "locks": bench_locks,
+    "wait_for_graph": bench_wait_for_graph,
+    "transactions": bench_transactions,
+    "log_manager": bench_log_manager,
+}
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with a baseline.
+    :return: The descriptions of the regressions beyond the threshold.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous or not previous["value"]:
+            continue
+        if current["higher_is_better"]:
+            change = (previous["value"] - current["value"]) / previous["value"]
+        else:
+            change = (current["value"] - previous["value"]) / previous["value"]
+        if change > threshold:
+            regressions.append(f"{name}: {current['value']:.4g} {current['unit']} "
+                               f"vs {previous['value']:.4g} in the baseline ({change:.0%} worse)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the transaction primitives.")
+    parser.add_argument("--only", action="append", choices=sorted(BENCHMARKS),
+                        help="Run only this group of benchmarks (repeatable).")
+    parser.add_argument("--seconds", type=float, default=1.0, help="Duration of each measurement.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", help="Results of a previous run to compare with.")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Largest accepted slowdown against the baseline, as a fraction (default 0.25).")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        for benchmark, value in BENCHMARKS[name](args.seconds).items():
+            results[benchmark] = value
+            print(f"{benchmark:<48}{value['value']:>14.4g} {value['unit']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"benchmarks": results, "seconds": args.seconds}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["benchmarks"]
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regression beyond {args.threshold:.0%} of the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
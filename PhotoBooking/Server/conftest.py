@@ -0,0 +1,40 @@
+import datetime
+import os
+import tempfile
+
+import pytest
+
+# The data access layer opens its databases and its log when it is first imported: the
+# tests run it on SQLite databases and a log of their own
+DATA_DIR = tempfile.mkdtemp(prefix="photobooking-test-")
+os.environ.setdefault("PHOTOBOOKING_DB1_URL", f"sqlite:///{DATA_DIR}/db1.sqlite")
+os.environ.setdefault("PHOTOBOOKING_DB2_URL", f"sqlite:///{DATA_DIR}/db2.sqlite")
+os.environ.setdefault("PHOTOBOOKING_LOG_DIR", f"{DATA_DIR}/logs")
+
+
+@pytest.fixture
+def timeslot():
+    """
+    A photographer with an available timeslot, and a client.
+    :return: The IDs of the timeslot, of its photographer and of the client.
+    """
+    from dao.db import Session1, Session2
+    from dao.models import Client, Photographer, Timeslot
+
+    session1, session2 = Session1(), Session2()
+    try:
+        photographer = Photographer(Name="Ada", Specialty="Wedding")
+        session1.add(photographer)
+        session1.flush()
+        slot = Timeslot(PhotographerID=photographer.PhotographerID, AvailableDate=datetime.date(2025, 1, 6),
+                        StartTime=datetime.time(9), EndTime=datetime.time(10), Status="Available")
+        session1.add(slot)
+        session1.flush()
+        client = Client(Name="Bob", Email=f"bob{slot.TimeslotID}@example.com", Phone="1")
+        session2.add(client)
+        session1.commit()
+        session2.commit()
+        return slot.TimeslotID, photographer.PhotographerID, client.ClientID
+    finally:
+        session1.close()
+        session2.close()
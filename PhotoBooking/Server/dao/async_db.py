@@ -0,0 +1,68 @@
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from dao.db import DATABASE_URL_1, DATABASE_URL_2, TimedAsyncQueuePool, instrument_engine, load_settings
+
+# Asyncio driver replacing the blocking driver of a database URL
+ASYNC_DRIVERS = {
+    "mssql+pyodbc": "mssql+aioodbc",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def async_url(settings):
+    """
+    Return the URL the asyncio server opens a database with: the 'async_url' setting if
+    given, otherwise the blocking URL with its driver swapped for the asyncio one.
+    """
+    if settings["async_url"]:
+        return settings["async_url"]
+    scheme, separator, rest = settings["url"].partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
+
+
+def create_configured_async_engine(settings):
+    """
+    Create an asyncio engine from database settings, with the same pool sizing as the
+    blocking engine. The asyncio server shares the data, the locks and the log with the
+    blocking code paths (recovery, compensation and the bulk operations), so an in-memory
+    SQLite database, private to one engine, is refused.
+    """
+    url = async_url(settings)
+    is_sqlite = url.startswith("sqlite")
+    if is_sqlite and url.partition("://")[2] in ("", "/:memory:", ":memory:"):
+        raise ValueError("The asyncio server needs a database file, not an in-memory SQLite database.")
+
+    engine = create_async_engine(
+        url,
+        poolclass=TimedAsyncQueuePool,
+        pool_size=settings["pool_size"],
+        max_overflow=settings["max_overflow"],
+        pool_timeout=settings["pool_timeout"],
+        pool_recycle=settings["pool_recycle"],
+        pool_pre_ping=settings["pool_pre_ping"],
+    )
+
+    if is_sqlite:
+        @event.listens_for(engine.sync_engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA busy_timeout=5000")
+            cursor.close()
+
+    return engine
+
+
+# Create asyncio engines. The tables are created by the blocking engines of dao.db.
+async_engine1 = create_configured_async_engine(load_settings("db1", DATABASE_URL_1))
+async_engine2 = create_configured_async_engine(load_settings("db2", DATABASE_URL_2))
+instrument_engine(async_engine1.sync_engine, "db1")
+instrument_engine(async_engine2.sync_engine, "db2")
+
+# Create session factories for both engines. Attributes stay loaded after a commit, as an
+# asyncio session cannot lazily reload them.
+AsyncSession1 = async_sessionmaker(bind=async_engine1, expire_on_commit=False)
+AsyncSession2 = async_sessionmaker(bind=async_engine2, expire_on_commit=False)
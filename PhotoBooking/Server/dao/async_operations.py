@@ -0,0 +1,146 @@
+import logging
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from dao.async_db import AsyncSession1, AsyncSession2
+from dao.models import Booking, Photographer, Client
+from dao.operations import DaoOperations, read_cache, transaction_manager
+from dao.steps import AsyncIo, run_async
+
+logger = logging.getLogger(__name__)
+
+# Asyncio I/O of the operation steps run by AsyncDaoOperations
+async_io = AsyncIo(transaction_manager, read_cache, AsyncSession1, AsyncSession2)
+
+
+class AsyncDaoOperations:
+    """
+    Asyncio versions of the DaoOperations used by the request handlers. They run the same
+    steps, under the same locks, log, read cache and availability index, but wait on the
+    databases and on locks without holding a thread.
+    """
+
+    @staticmethod
+    async def schedule_booking(transaction_id, booking_data, deadline=None):
+        """
+        Schedule a booking for a client (see DaoOperations.schedule_booking).
+        """
+        return await run_async(DaoOperations.schedule_booking_steps(async_io, transaction_id, booking_data, deadline))
+
+    @staticmethod
+    async def schedule_bookings_batch(transaction_id, batch_data, deadline=None):
+        """
+        Book several timeslots for a client in one transaction (see DaoOperations.schedule_bookings_batch).
+        """
+        return await run_async(DaoOperations.schedule_bookings_batch_steps(
+            async_io, transaction_id, batch_data, deadline
+        ))
+
+    @staticmethod
+    async def cancel_booking(transaction_id, booking_id, deadline=None):
+        """
+        Cancel a booking and mark the corresponding timeslot as available.
+        """
+        return await run_async(DaoOperations.cancel_booking_steps(async_io, transaction_id, booking_id, deadline))
+
+    @staticmethod
+    async def create_availability(transaction_id, photographer_id, availability_data, deadline=None):
+        """
+        Create a timeslot for a photographer, under the locks of DaoOperations.create_availability.
+        """
+        return await run_async(DaoOperations.create_availability_steps(
+            async_io, transaction_id, photographer_id, availability_data, deadline
+        ))
+
+    @staticmethod
+    async def create_availability_bulk(transaction_id, photographer_id, availability_data, deadline=None):
+        """
+        Create many timeslots for a photographer in one transaction (see DaoOperations.create_availability_bulk).
+        """
+        return await run_async(DaoOperations.create_availability_bulk_steps(
+            async_io, transaction_id, photographer_id, availability_data, deadline
+        ))
+
+    @staticmethod
+    async def update_booking(transaction_id, booking_id, updates, deadline=None):
+        return await run_async(DaoOperations.update_booking_steps(
+            async_io, transaction_id, booking_id, updates, deadline
+        ))
+
+    @staticmethod
+    async def list_available_photographers(date, deadline=None):
+        """
+        List photographers available for a given date, from the availability index once it
+        is built, through the read cache otherwise.
+        """
+        return await run_async(DaoOperations.list_available_photographers_steps(async_io, date, deadline))
+
+    @staticmethod
+    async def stream_query(session_factory, query, serialize, batch_size=1000):
+        """
+        Generate the serialized rows of a query, fetched batch_size at a time from a server-side
+        cursor, so memory stays flat whatever the size of the result.
+        """
+        async with session_factory() as session:
+            try:
+                result = await session.stream_scalars(query.execution_options(yield_per=batch_size))
+                async for record in result:
+                    yield serialize(record)
+            except SQLAlchemyError as e:
+                raise Exception(f"Error streaming rows: {e}")
+
+    @staticmethod
+    async def list_bookings_for_client(client_id, after=None, limit=None):
+        """
+        Retrieve the bookings made by a specific client, in BookingID order,
+        optionally one page at a time.
+        """
+        return await run_async(DaoOperations.list_bookings_for_client_steps(async_io, client_id, after, limit))
+
+    @staticmethod
+    def stream_bookings_for_client(client_id):
+        return AsyncDaoOperations.stream_query(
+            AsyncSession2, select(Booking).filter_by(ClientID=client_id).order_by(Booking.BookingID),
+            DaoOperations.booking_dict
+        )
+
+    @staticmethod
+    async def get_all_clients(after=None, limit=None):
+        """
+        Retrieve the clients in ClientID order, optionally one page at a time.
+        """
+        return await run_async(DaoOperations.get_all_clients_steps(async_io, after, limit))
+
+    @staticmethod
+    def stream_clients():
+        return AsyncDaoOperations.stream_query(
+            AsyncSession2, select(Client).order_by(Client.ClientID), DaoOperations.client_dict
+        )
+
+    @staticmethod
+    async def get_all_photographers(after=None, limit=None):
+        """
+        Retrieve all photographers, through the read cache, or one page of them.
+        """
+        return await run_async(DaoOperations.get_all_photographers_steps(async_io, after, limit))
+
+    @staticmethod
+    def stream_photographers():
+        return AsyncDaoOperations.stream_query(
+            AsyncSession1, select(Photographer).order_by(Photographer.PhotographerID), DaoOperations.photographer_dict
+        )
+
+    @staticmethod
+    async def get_available_timeslots_for_photographer(photographer_id):
+        """
+        Retrieve the available timeslots of a photographer, from the availability index once it is built.
+        """
+        return await run_async(DaoOperations.get_available_timeslots_for_photographer_steps(async_io, photographer_id))
+
+    @staticmethod
+    async def get_timeslot_details(timeslot_id, deadline=None):
+        """
+        Retrieve details for a specific timeslot, through the read cache.
+        """
+        return await run_async(DaoOperations.get_timeslot_details_steps(async_io, timeslot_id, deadline))
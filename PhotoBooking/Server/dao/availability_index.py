@@ -0,0 +1,131 @@
+from threading import Lock
+
+
+class AvailabilityIndex:
+    def __init__(self, enabled=True):
+        """
+        In-memory index of the available timeslots, keyed by date and by photographer.
+        It is built from the tables at startup and kept up to date by the commit hooks of
+        the transactions booking, canceling or creating timeslots, so availability queries
+        are answered without touching the database. Until it is built, ready is False.
+        A disabled index is never built, so the queries always go to the database.
+        """
+        self.enabled = enabled
+        self.slots = {}  # TimeslotID -> timeslot row, including the photographer's name and specialty
+        self.by_date = {}  # AvailableDate -> set of TimeslotIDs
+        self.by_photographer = {}  # PhotographerID -> set of TimeslotIDs
+        self.updates = 0  # Number of incremental updates applied, used to detect races with a rebuild
+        self.ready = False
+        self.lock = Lock()
+
+    def _add(self, row):
+        """
+        Index an available timeslot. Must be called with the lock held.
+        """
+        self._remove(row["TimeslotID"])
+        self.slots[row["TimeslotID"]] = row
+        self.by_date.setdefault(row["AvailableDate"], set()).add(row["TimeslotID"])
+        self.by_photographer.setdefault(row["PhotographerID"], set()).add(row["TimeslotID"])
+
+    def _remove(self, timeslot_id):
+        """
+        Drop a timeslot from the index. Must be called with the lock held.
+        """
+        row = self.slots.pop(timeslot_id, None)
+        if row is None:
+            return
+        for index, key in ((self.by_date, row["AvailableDate"]), (self.by_photographer, row["PhotographerID"])):
+            timeslot_ids = index[key]
+            timeslot_ids.discard(timeslot_id)
+            if not timeslot_ids:
+                del index[key]
+
+    def update_count(self):
+        with self.lock:
+            return self.updates
+
+    def load(self, rows, expected_updates=None):
+        """
+        Replace the content of the index with the given rows and mark it ready.
+        :param expected_updates: The update count read before the rows were queried. If an
+                                 incremental update happened since, the rows may be stale,
+                                 nothing is loaded and False is returned.
+        """
+        with self.lock:
+            if expected_updates is not None and expected_updates != self.updates:
+                return False
+            self.slots, self.by_date, self.by_photographer = {}, {}, {}
+            for row in rows:
+                self._add(row)
+            self.ready = True
+            return True
+
+    def add(self, row):
+        """
+        Index a timeslot that became available.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self._add(row)
+            self.updates += 1
+
+    def remove(self, timeslot_id):
+        """
+        Drop a timeslot that is no longer available.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self._remove(timeslot_id)
+            self.updates += 1
+
+    def available_on(self, date):
+        """
+        Return the available timeslots of a date, with their photographer's details.
+        """
+        with self.lock:
+            rows = [self.slots[timeslot_id] for timeslot_id in self.by_date.get(date, ())]
+        return [
+            {
+                "TimeslotID": row["TimeslotID"],
+                "PhotographerID": row["PhotographerID"],
+                "StartTime": row["StartTime"],
+                "EndTime": row["EndTime"],
+                "Name": row["Name"],
+                "Specialty": row["Specialty"],
+            }
+            for row in sorted(rows, key=lambda row: (row["StartTime"], row["TimeslotID"]))
+        ]
+
+    def available_for_photographer(self, photographer_id):
+        """
+        Return the available timeslots of a photographer.
+        """
+        with self.lock:
+            rows = [self.slots[timeslot_id] for timeslot_id in self.by_photographer.get(photographer_id, ())]
+        return [
+            {
+                "TimeslotID": row["TimeslotID"],
+                "AvailableDate": row["AvailableDate"],
+                "StartTime": row["StartTime"],
+                "EndTime": row["EndTime"],
+                "Status": "Available"
+            }
+            for row in sorted(rows, key=lambda row: (row["AvailableDate"], row["StartTime"], row["TimeslotID"]))
+        ]
+
+    def compare(self, rows):
+        """
+        Compare the index with the available timeslots read from the tables.
+        :return: The IDs of the timeslots missing from the index, indexed but not available,
+                 and indexed with different details.
+        """
+        expected = {row["TimeslotID"]: row for row in rows}
+        with self.lock:
+            indexed = dict(self.slots)
+        return {
+            "missing": sorted(set(expected) - set(indexed)),
+            "unexpected": sorted(set(indexed) - set(expected)),
+            "mismatched": sorted(tid for tid in set(expected) & set(indexed) if expected[tid] != indexed[tid]),
+        }
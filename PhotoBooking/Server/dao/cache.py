@@ -0,0 +1,149 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class ReadCache:
+    def __init__(self, max_entries=10000, ttl=300.0, enabled=True):
+        """
+        In-process read-through cache with LRU eviction and a time-to-live.
+        Every entry carries tags naming the data it was read from, e.g. ("timeslot", 4).
+        Writers invalidate tags when they commit, which drops the tagged entries and bumps
+        the versions of the tags being read at that moment, so a read that started before
+        the invalidation cannot store its now stale result.
+        A disabled cache calls the loader on every read and stores nothing.
+        """
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # Key -> (value, expires_at, tags)
+        self.tag_keys = {}  # Tag -> set of keys
+        self.loading = {}  # Tag -> number of reads of the tag in progress
+        self.tag_versions = {}  # Tag -> invalidations seen by the reads in progress
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_load(self, key, tags, loader):
+        """
+        Return the cached value of a key, or call loader() to read it and cache the result.
+        """
+        if not self.enabled:
+            return loader()
+        hit, value = self._lookup(key, tags)
+        if hit:
+            return value
+        versions = value
+        try:
+            value = loader()
+        except Exception:
+            with self.lock:
+                self._done_loading(tags)
+            raise
+        return self._store(key, tags, versions, value)
+
+    async def get_or_load_async(self, key, tags, loader):
+        """
+        Asyncio version of get_or_load, where loader() returns an awaitable.
+        """
+        if not self.enabled:
+            return await loader()
+        hit, value = self._lookup(key, tags)
+        if hit:
+            return value
+        versions = value
+        try:
+            value = await loader()
+        except BaseException:
+            with self.lock:
+                self._done_loading(tags)
+            raise
+        return self._store(key, tags, versions, value)
+
+    def _lookup(self, key, tags):
+        """
+        Look a key up. On a miss, register a read of the tags, which the caller must end with
+        _store or _done_loading.
+        :return: (True, value) on a hit, (False, versions of the tags) on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[0]
+            self.misses += 1
+            for tag in tags:
+                self.loading[tag] = self.loading.get(tag, 0) + 1
+            return False, [self.tag_versions.get(tag, 0) for tag in tags]
+
+    def _store(self, key, tags, versions, value):
+        """
+        End the read of the tags and cache its value, unless one of them was invalidated meanwhile.
+        """
+        with self.lock:
+            stale = versions != [self.tag_versions.get(tag, 0) for tag in tags]
+            self._done_loading(tags)
+            if stale:
+                # Invalidated while loading, the value may already be stale
+                return value
+            self._remove(key)
+            self.entries[key] = (value, time.monotonic() + self.ttl, tags)
+            for tag in tags:
+                self.tag_keys.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return value
+
+    def _done_loading(self, tags):
+        """
+        Unregister a finished read of the tags. Must be called with the lock held.
+        """
+        for tag in tags:
+            self.loading[tag] -= 1
+            if not self.loading[tag]:
+                del self.loading[tag]
+                self.tag_versions.pop(tag, None)
+
+    def _remove(self, key):
+        """
+        Remove an entry and its tag references. Must be called with the lock held.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self.tag_keys.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tag_keys[tag]
+
+    def invalidate(self, tags):
+        """
+        Drop every entry carrying one of the tags.
+        """
+        with self.lock:
+            for tag in tags:
+                if tag in self.loading:
+                    self.tag_versions[tag] = self.tag_versions.get(tag, 0) + 1
+                for key in list(self.tag_keys.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def stats(self):
+        """
+        Return the hit, miss, eviction and invalidation counters and the current size.
+        """
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "size": len(self.entries),
+            }
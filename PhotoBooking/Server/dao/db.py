@@ -1,5 +1,15 @@
-from sqlalchemy import create_engine, MetaData
+import json
+import os
+import time
+from threading import Lock
+
+from sqlalchemy import create_engine, event, MetaData
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
+
+from dao.models import Base1, Base2
+from transactions.Metrics import metrics
+from transactions.Tracing import tracer
 
 server = "LAPTOP-FEJLOP6E\\SQLEXPRESS"
 database1 = "MFCC_db1"
@@ -7,9 +17,208 @@ database2 = "MFCC_db2"
 DATABASE_URL_1 = f"mssql+pyodbc://{server}/{database1}?driver=ODBC+Driver+17+for+SQL+Server"
 DATABASE_URL_2 = f"mssql+pyodbc://{server}/{database2}?driver=ODBC+Driver+17+for+SQL+Server"
 
+# Default settings of each database. They can be overridden by a JSON file named in
+# PHOTOBOOKING_DB_CONFIG ({"db1": {...}, "db2": {...}}), then by environment variables
+# such as PHOTOBOOKING_DB1_URL or PHOTOBOOKING_DB2_POOL_SIZE.
+DEFAULT_SETTINGS = {
+    "url": None,
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30,
+    "pool_recycle": -1,
+    "pool_pre_ping": False,
+    "create_schema": None,  # Create the tables if missing, defaults to True on SQLite
+    "async_url": None,  # URL used by the asyncio server, derived from url by default (see dao.async_db)
+}
+
+
+QUERY_SECONDS = metrics.histogram(
+    "photobooking_db_query_seconds", "Duration of the SQL statements, by database.", ("engine",)
+)
+POOL_CHECKOUT_SECONDS = metrics.histogram(
+    "photobooking_db_pool_checkout_seconds", "Time spent waiting for a pooled connection, by database.", ("engine",)
+)
+
+
+class PoolStats:
+    def __init__(self):
+        """
+        Accumulates the time threads spend waiting to check a connection out of a pool.
+        """
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.histogram = None  # Checkout latency histogram of the database, set by instrument_engine
+        self.lock = Lock()
+
+    def record(self, wait):
+        if self.histogram is not None:
+            self.histogram.observe(wait)
+        with self.lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "total_wait_seconds": self.total_wait,
+                "avg_wait_seconds": self.total_wait / self.checkouts if self.checkouts else 0.0,
+                "max_wait_seconds": self.max_wait,
+            }
+
+
+class TimedPool:
+    """
+    Pool mixin measuring how long each checkout waits for a free connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.stats = PoolStats()
+        super().__init__(*args, **kwargs)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.stats.record(time.perf_counter() - start)
+
+
+class TimedQueuePool(TimedPool, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def load_settings(name, default_url):
+    """
+    Build the settings of a database ("db1" or "db2") from the defaults, the optional
+    JSON config file and the environment, in increasing order of precedence.
+    """
+    settings = dict(DEFAULT_SETTINGS, url=default_url)
+
+    config_file = os.environ.get("PHOTOBOOKING_DB_CONFIG")
+    if config_file:
+        with open(config_file) as f:
+            settings.update(json.load(f).get(name, {}))
+
+    prefix = f"PHOTOBOOKING_{name.upper()}_"
+    for key, default in DEFAULT_SETTINGS.items():
+        value = os.environ.get(prefix + key.upper())
+        if value is None:
+            continue
+        if key in ("url", "async_url"):
+            settings[key] = value
+        elif key in ("pool_pre_ping", "create_schema"):
+            settings[key] = value.lower() in ("1", "true", "yes")
+        else:
+            settings[key] = int(value)
+    return settings
+
+
+def create_configured_engine(settings, metadata=None):
+    """
+    Create an engine from database settings.
+    Server databases use a TimedQueuePool sized by the settings. SQLite files are opened in
+    WAL journal mode so readers do not block the writer; an in-memory SQLite database
+    ("sqlite://") is a single connection shared by all threads. On SQLite the tables of the
+    given metadata are created unless create_schema is disabled.
+    """
+    url = settings["url"]
+    is_sqlite = url.startswith("sqlite")
+
+    if is_sqlite and url.rstrip("/") in ("sqlite:", "sqlite:/:memory:", "sqlite://:memory:"):
+        engine = create_engine(url, poolclass=StaticPool, connect_args={"check_same_thread": False})
+    else:
+        connect_args = {"check_same_thread": False} if is_sqlite else {}
+        engine = create_engine(
+            url,
+            poolclass=TimedQueuePool,
+            pool_size=settings["pool_size"],
+            max_overflow=settings["max_overflow"],
+            pool_timeout=settings["pool_timeout"],
+            pool_recycle=settings["pool_recycle"],
+            pool_pre_ping=settings["pool_pre_ping"],
+            connect_args=connect_args,
+        )
+
+    if is_sqlite:
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA busy_timeout=5000")
+            cursor.close()
+
+    create_schema = settings["create_schema"]
+    if metadata is not None and (create_schema or (create_schema is None and is_sqlite)):
+        metadata.create_all(engine)
+    return engine
+
+
+def instrument_engine(engine, name):
+    """
+    Record the duration of every statement run by an engine and the checkout wait of its
+    pool in the metrics of the database called name. For an asyncio engine, pass its sync_engine.
+    The statements of a sampled transaction are also recorded in its trace, as "<name>_read"
+    or "<name>_write" spans.
+    """
+    query_seconds = QUERY_SECONDS.labels(name)
+    read_span, write_span = f"{name}_read", f"{name}_write"
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        context.query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+        end = time.perf_counter()
+        query_seconds.observe(end - context.query_start)
+        span = read_span if statement.lstrip()[:6].upper() == "SELECT" else write_span
+        tracer.record_current(span, context.query_start, end, statement=statement[:200])
+
+    if isinstance(engine.pool, TimedPool):
+        engine.pool.stats.histogram = POOL_CHECKOUT_SECONDS.labels(name)
+
+
+def pool_capacity():
+    """
+    Return the number of connections the pools of both databases can hand out at once.
+    """
+    return sum(settings["pool_size"] + settings["max_overflow"] for settings in (settings1, settings2))
+
+
+def pool_stats():
+    """
+    Return the checkout wait times and current state of the pool of each database.
+    """
+    stats = {}
+    for name, engine in (("db1", engine1), ("db2", engine2)):
+        pool = engine.pool
+        stats[name] = dict(
+            pool.stats.snapshot() if isinstance(pool, TimedPool) else {},
+            status=pool.status(),
+        )
+    return stats
+
+
 # Create SQLAlchemy engines
-engine1 = create_engine(DATABASE_URL_1)
-engine2 = create_engine(DATABASE_URL_2)
+settings1 = load_settings("db1", DATABASE_URL_1)
+settings2 = load_settings("db2", DATABASE_URL_2)
+engine1 = create_configured_engine(settings1, Base1.metadata)
+engine2 = create_configured_engine(settings2, Base2.metadata)
+instrument_engine(engine1, "db1")
+instrument_engine(engine2, "db2")
 
 # Create session factories for both engines
 Session1 = sessionmaker(bind=engine1)
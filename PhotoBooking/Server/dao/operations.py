@@ -1,56 +1,128 @@
-from dao.db import Session1, Session2
+import calendar
+import logging
+import uuid
+from asyncio import CancelledError
+from datetime import date as Date, datetime as DateTime, time as Time, timedelta
+
+from dao.availability_index import AvailabilityIndex
+from dao.cache import ReadCache
+from dao.db import Session1, Session2, pool_capacity, pool_stats
+from dao.steps import BlockingIo, run
+from sqlalchemy import select, update
 from sqlalchemy.exc import SQLAlchemyError
 from dao.models import Timeslot, Booking, Photographer, Client
+from transactions.Metrics import metrics, render_family
+from transactions.ResourceKey import BOOKINGS_TABLE, TIMESLOTS_TABLE, ResourceKey
 from transactions.TransactionManager import TransactionManager
 
-transaction_manager = TransactionManager()
+logger = logging.getLogger(__name__)
+
+# A commit thread only ever waits on a checked out connection, so there is no use for more
+# of them than the pools have connections
+transaction_manager = TransactionManager(commit_threads=pool_capacity())
+
+# With a lock server, several worker processes commit transactions, while the commit hooks
+# keeping the cache and the index up to date only run in the committing process. Both are
+# per-process, so they are disabled instead of serving other workers' stale availability.
+in_process_locks = transaction_manager.lock_server is None
+
+# Cache of catalog and timeslot reads, invalidated by the transactions changing them
+read_cache = ReadCache(enabled=in_process_locks)
+
+# Available timeslots by date and photographer, maintained by the transactions' commit hooks
+availability_index = AvailabilityIndex(enabled=in_process_locks)
+
+# Blocking I/O of the operation steps run by DaoOperations
+blocking_io = BlockingIo(transaction_manager, read_cache, Session1, Session2)
+
+
+def parse_date(value):
+    """
+    Convert an ISO date string (YYYY-MM-DD) from a request into a date, as required by
+    drivers such as SQLite.
+    """
+    return Date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def parse_time(value):
+    """
+    Convert an ISO time string (HH:MM or HH:MM:SS) from a request into a time.
+    """
+    return Time.fromisoformat(value) if isinstance(value, str) else value
+
+
+def add_months(day, months):
+    """
+    Return the same day of the month the given number of months later, clamped to the
+    length of the target month.
+    """
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
 
 
 class DaoOperations:
+    """
+    The transactions of the booking API on blocking sessions. The operations also served by
+    AsyncDaoOperations are written once as steps (see dao.steps), e.g. schedule_booking_steps,
+    which both run with their own io.
+    """
+
     @staticmethod
-    def schedule_booking(transaction_id, booking_data):
+    def schedule_booking(transaction_id, booking_data, deadline=None):
         """
         Schedule a booking for a client.
         Checks the availability of the timeslot and creates a booking if available.
         """
-        print(f"Transaction {transaction_id}: Scheduling booking with data {booking_data}.")
-        session1 = Session1()  # Connection to MFCC_db1
-        session2 = Session2()  # Connection to MFCC_db2
+        return run(DaoOperations.schedule_booking_steps(blocking_io, transaction_id, booking_data, deadline))
+
+    @staticmethod
+    def schedule_booking_steps(io, transaction_id, booking_data, deadline=None):
+        logger.debug("Transaction %s: Scheduling booking with data %s.", transaction_id, booking_data)
+        session1 = io.Session1()  # Connection to MFCC_db1
+        session2 = io.Session2()  # Connection to MFCC_db2
 
         try:
             # Start the transaction
             transaction_manager.start_transaction(transaction_id)
 
             # Acquire lock for the timeslot
-            resource = f"Timeslot_{booking_data['TimeslotID']}"
-            if not transaction_manager.acquire_lock(transaction_id, resource, "write"):
-                print(f"Transaction {transaction_id}: Waiting for lock on {resource}.")
-                raise Exception("Lock acquisition failed. Transaction is waiting.")
+            resources = yield from DaoOperations.timeslot_resources(session1, [booking_data["TimeslotID"]])
+            resource = resources.get(int(booking_data["TimeslotID"]))
+            if resource is None:
+                raise ValueError("Timeslot is not available or does not exist.")
+            if not (yield io.acquire_lock(transaction_id, resource, "write", deadline)):
+                raise Exception(f"Lock acquisition failed. Timed out waiting for {resource}.")
 
-            print(f"Transaction {transaction_id}: Lock acquired on {resource}.")
+            logger.debug("Transaction %s: Lock acquired on %s.", transaction_id, resource)
 
             # Check if the timeslot exists and is available
-            timeslot = session1.query(Timeslot).filter_by(
+            timeslot = (yield session1.execute(select(Timeslot).filter_by(
                 TimeslotID=booking_data["TimeslotID"],
                 Status="Available"
-            ).first()
+            ))).scalars().first()
 
             if not timeslot:
                 raise ValueError("Timeslot is not available or does not exist.")
+            DaoOperations.invalidate_on_commit(transaction_id, DaoOperations.timeslot_tags(timeslot))
+            booked_timeslot_id = timeslot.TimeslotID
+            transaction_manager.on_commit(transaction_id, lambda: availability_index.remove(booked_timeslot_id))
 
-            # Log timeslot status change
-            transaction_manager.log_manager.append_log(
+            # Log timeslot status change and keep the current version of the timeslot
+            yield io.append_log(
                 transaction_id,
                 "Timeslots",
                 timeslot.TimeslotID,
                 {"Status": timeslot.Status}
             )
+            transaction_manager.record_version(
+                transaction_id, "Timeslots", timeslot.TimeslotID, DaoOperations.timeslot_row(timeslot)
+            )
 
             # Update timeslot status to "Booked"
             timeslot.Status = "Booked"
-            session1.commit()
 
-            print(f"Transaction {transaction_id}: Timeslot {timeslot.TimeslotID} booked.")
+            logger.debug("Transaction %s: Timeslot %s booked.", transaction_id, timeslot.TimeslotID)
 
             # Create a new booking
             new_booking = Booking(
@@ -60,280 +132,913 @@ class DaoOperations:
                 Status="Scheduled"
             )
 
-            # Log the booking creation
-            transaction_manager.log_manager.append_log(
+            # Insert booking into the database, flushing to get its ID
+            session2.add(new_booking)
+            yield session2.flush()
+
+            # Log the booking creation before committing it
+            yield io.append_log(
                 transaction_id,
                 "Bookings",
-                None,
+                new_booking.BookingID,
                 {
                     "TimeslotID": timeslot.TimeslotID,
                     "ClientID": booking_data["ClientID"],
                     "Location": booking_data["Location"],
                     "Status": "Scheduled"
-                }
+                },
+                operation="insert"
             )
+            transaction_manager.record_version(transaction_id, "Bookings", new_booking.BookingID, None)
+            booking_id = new_booking.BookingID
 
-            # Insert booking into the database
-            session2.add(new_booking)
-            session2.commit()
-
-            # Commit the transaction and release locks
-            transaction_manager.commit_transaction(transaction_id)
-            print(f"Transaction {transaction_id}: Committed successfully.")
-            return new_booking.BookingID
+            # Commit both databases and release locks
+            yield io.commit_transaction(transaction_id, [session1, session2])
+            logger.debug("Transaction %s: Committed successfully.", transaction_id)
+            return booking_id
         except Exception as e:
             # Rollback the transaction on failure
-            print(f"Transaction {transaction_id}: ERROR - {e}. Rolling back.")
-            session1.rollback()
-            session2.rollback()
-            DaoOperations.rollback(transaction_id)
+            logger.warning("Transaction %s: ERROR - %s. Rolling back.", transaction_id, e)
+            yield io.abort_transaction(transaction_id, [session1, session2])
             raise Exception(f"Error scheduling booking: {e}")
+        except CancelledError:
+            # Rollback the transaction when the request is cancelled, e.g. on a client disconnect
+            yield io.abort_transaction(transaction_id, [session1, session2])
+            raise
         finally:
-            session1.close()
-            session2.close()
+            yield session1.close()
+            yield session2.close()
+
+    @staticmethod
+    def schedule_bookings_batch(transaction_id, batch_data, deadline=None):
+        """
+        Book several timeslots for a client in one distributed transaction.
+        Locks are taken in ascending timeslot order, so concurrent batches cannot deadlock
+        each other. The timeslots are validated with a single query, marked as booked with a
+        single update and the bookings are written with a bulk insert, with one log entry
+        per table for the whole batch.
+        :return: The IDs of the new bookings, in the order of the sorted timeslot IDs.
+        """
+        return run(DaoOperations.schedule_bookings_batch_steps(blocking_io, transaction_id, batch_data, deadline))
+
+    @staticmethod
+    def schedule_bookings_batch_steps(io, transaction_id, batch_data, deadline=None):
+        timeslot_ids = sorted({int(timeslot_id) for timeslot_id in batch_data["TimeslotIDs"]})
+        logger.debug("Transaction %s: Booking timeslots %s in one batch.", transaction_id, timeslot_ids)
+        session1 = io.Session1()  # Connection to MFCC_db1
+        session2 = io.Session2()  # Connection to MFCC_db2
+
+        try:
+            if not timeslot_ids:
+                raise ValueError("No timeslots to book.")
+
+            # Start the transaction
+            transaction_manager.start_transaction(transaction_id)
+
+            # Acquire locks for the timeslots in canonical order. Past the escalation threshold,
+            # the locks on the timeslots of a photographer are replaced by one lock on the photographer.
+            resources = yield from DaoOperations.timeslot_resources(session1, timeslot_ids)
+            missing = [timeslot_id for timeslot_id in timeslot_ids if timeslot_id not in resources]
+            if missing:
+                raise ValueError(f"Timeslots {missing} are not available or do not exist.")
+            for timeslot_id in timeslot_ids:
+                resource = resources[timeslot_id]
+                if not (yield io.acquire_lock(transaction_id, resource, "write", deadline)):
+                    raise Exception(f"Lock acquisition failed. Timed out waiting for {resource}.")
+
+            # Check that every timeslot exists and is available
+            timeslots = (yield session1.execute(
+                select(Timeslot).filter(Timeslot.TimeslotID.in_(timeslot_ids))
+            )).scalars().all()
+            available = {t.TimeslotID for t in timeslots if t.Status == "Available"}
+            unavailable = [timeslot_id for timeslot_id in timeslot_ids if timeslot_id not in available]
+            if unavailable:
+                raise ValueError(f"Timeslots {unavailable} are not available or do not exist.")
+
+            for timeslot in timeslots:
+                DaoOperations.invalidate_on_commit(transaction_id, DaoOperations.timeslot_tags(timeslot))
+            transaction_manager.on_commit(
+                transaction_id, lambda: [availability_index.remove(timeslot_id) for timeslot_id in timeslot_ids]
+            )
+
+            # Log the timeslot status changes and keep the current versions, then book all timeslots at once
+            yield io.append_log(transaction_id, "Timeslots", timeslot_ids, {"Status": "Available"})
+            for timeslot in timeslots:
+                transaction_manager.record_version(
+                    transaction_id, "Timeslots", timeslot.TimeslotID, DaoOperations.timeslot_row(timeslot)
+                )
+            yield session1.execute(
+                update(Timeslot).where(Timeslot.TimeslotID.in_(timeslot_ids)).values(Status="Booked")
+                .execution_options(synchronize_session=False)
+            )
+
+            # Insert all bookings with one bulk insert, flushing to get their IDs
+            new_bookings = [
+                Booking(
+                    TimeslotID=timeslot_id,
+                    ClientID=batch_data["ClientID"],
+                    Location=batch_data["Location"],
+                    Status="Scheduled"
+                )
+                for timeslot_id in timeslot_ids
+            ]
+            session2.add_all(new_bookings)
+            yield session2.flush()
+            booking_ids = [booking.BookingID for booking in new_bookings]
+
+            # Log the booking creations before committing them
+            yield io.append_log(transaction_id, "Bookings", booking_ids, {
+                "ClientID": batch_data["ClientID"],
+                "Location": batch_data["Location"],
+                "Status": "Scheduled"
+            }, operation="insert")
+            for booking_id in booking_ids:
+                transaction_manager.record_version(transaction_id, "Bookings", booking_id, None)
+
+            # Commit both databases and release locks
+            yield io.commit_transaction(transaction_id, [session1, session2])
+            logger.debug("Transaction %s: Committed %d bookings.", transaction_id, len(booking_ids))
+            return booking_ids
+        except Exception as e:
+            # Rollback the transaction on failure
+            logger.warning("Transaction %s: ERROR - %s. Rolling back.", transaction_id, e)
+            yield io.abort_transaction(transaction_id, [session1, session2])
+            raise Exception(f"Error scheduling bookings: {e}")
+        except CancelledError:
+            # Rollback the transaction when the request is cancelled, e.g. on a client disconnect
+            yield io.abort_transaction(transaction_id, [session1, session2])
+            raise
+        finally:
+            yield session1.close()
+            yield session2.close()
 
     @staticmethod
-    def cancel_booking(transaction_id, booking_id):
+    def cancel_booking(transaction_id, booking_id, deadline=None):
         """
         Cancel a booking and mark the corresponding timeslot as available.
         """
-        print(f"Transaction {transaction_id}: Canceling booking with ID {booking_id}.")
-        session1 = Session1()  # Connection to MFCC_db1
-        session2 = Session2()  # Connection to MFCC_db2
+        return run(DaoOperations.cancel_booking_steps(blocking_io, transaction_id, booking_id, deadline))
+
+    @staticmethod
+    def cancel_booking_steps(io, transaction_id, booking_id, deadline=None):
+        logger.debug("Transaction %s: Canceling booking with ID %s.", transaction_id, booking_id)
+        session1 = io.Session1()  # Connection to MFCC_db1
+        session2 = io.Session2()  # Connection to MFCC_db2
 
         try:
             # Start the transaction
             transaction_manager.start_transaction(transaction_id)
 
             # Acquire lock for the booking
-            resource = f"Booking_{booking_id}"
-            if not transaction_manager.acquire_lock(transaction_id, resource, "write"):
-                raise Exception("Lock acquisition failed. Transaction is waiting.")
+            resource = yield from DaoOperations.booking_resource(session2, booking_id)
+            if resource is None:
+                raise ValueError("Booking not found.")
+            if not (yield io.acquire_lock(transaction_id, resource, "write", deadline)):
+                raise Exception(f"Lock acquisition failed. Timed out waiting for {resource}.")
 
             # Fetch the booking record
-            booking_record = session2.query(Booking).filter_by(BookingID=booking_id).first()
+            booking_record = yield session2.get(Booking, booking_id)
             if not booking_record:
                 raise ValueError("Booking not found.")
+            DaoOperations.check_booking_resource(booking_record, resource)
 
-            # Log the booking deletion
-            transaction_manager.log_manager.append_log(transaction_id, "Bookings", booking_record.BookingID, {
+            # Log the booking deletion and keep the current version of the booking
+            yield io.append_log(transaction_id, "Bookings", booking_record.BookingID, {
                 "TimeslotID": booking_record.TimeslotID,
                 "ClientID": booking_record.ClientID,
                 "Location": booking_record.Location,
                 "Status": booking_record.Status
-            })
+            }, operation="delete")
+            transaction_manager.record_version(
+                transaction_id, "Bookings", booking_record.BookingID, DaoOperations.booking_dict(booking_record)
+            )
 
             # Delete the booking
-            session2.delete(booking_record)
-            session2.commit()
+            yield session2.delete(booking_record)
 
-            # Update the corresponding timeslot to "Available"
-            timeslot = session1.query(Timeslot).filter_by(TimeslotID=booking_record.TimeslotID).first()
+            # Lock the corresponding timeslot and update it to "Available"
+            resources = yield from DaoOperations.timeslot_resources(session1, [booking_record.TimeslotID])
+            timeslot_resource = resources.get(booking_record.TimeslotID)
+            if timeslot_resource is not None and not (
+                yield io.acquire_lock(transaction_id, timeslot_resource, "write", deadline)
+            ):
+                raise Exception(f"Lock acquisition failed. Timed out waiting for {timeslot_resource}.")
+            timeslot = yield session1.get(Timeslot, booking_record.TimeslotID)
             if timeslot:
-                transaction_manager.log_manager.append_log(transaction_id, "Timeslots", timeslot.TimeslotID, {
+                DaoOperations.invalidate_on_commit(transaction_id, DaoOperations.timeslot_tags(timeslot))
+                photographer = yield session1.get(Photographer, timeslot.PhotographerID)
+                row = DaoOperations.availability_row(timeslot, photographer)
+                transaction_manager.on_commit(transaction_id, lambda: availability_index.add(row))
+                yield io.append_log(transaction_id, "Timeslots", timeslot.TimeslotID, {
                     "Status": timeslot.Status
                 })
+                transaction_manager.record_version(
+                    transaction_id, "Timeslots", timeslot.TimeslotID, DaoOperations.timeslot_row(timeslot)
+                )
                 timeslot.Status = "Available"
-                session1.commit()
 
-            # Commit the transaction and release locks
-            transaction_manager.commit_transaction(transaction_id)
+            # Commit both databases and release locks
+            yield io.commit_transaction(transaction_id, [session1, session2])
             return "Booking canceled successfully."
         except Exception as e:
             # Rollback the transaction on failure
-            session1.rollback()
-            session2.rollback()
-            DaoOperations.rollback(transaction_id)
+            yield io.abort_transaction(transaction_id, [session1, session2])
             raise Exception(f"Error canceling booking: {e}")
+        except CancelledError:
+            # Rollback the transaction when the request is cancelled, e.g. on a client disconnect
+            yield io.abort_transaction(transaction_id, [session1, session2])
+            raise
         finally:
-            session1.close()
-            session2.close()
+            yield session1.close()
+            yield session2.close()
 
     @staticmethod
-    def create_availability(transaction_id, photographer_id, availability_data):
-        session = Session1()
+    def create_availability(transaction_id, photographer_id, availability_data, deadline=None):
+        """
+        Create a timeslot for a photographer. The photographer is locked in intention exclusive
+        mode, so the creation waits for bulk creations of the photographer but not for
+        bookings of its other timeslots, then the new timeslot is locked once it has an ID.
+        """
+        return run(DaoOperations.create_availability_steps(
+            blocking_io, transaction_id, photographer_id, availability_data, deadline
+        ))
+
+    @staticmethod
+    def create_availability_steps(io, transaction_id, photographer_id, availability_data, deadline=None):
+        session = io.Session1()
         try:
             # Start the transaction
             transaction_manager.start_transaction(transaction_id)
 
-            # Acquire lock for the resource
-            resource = f"Timeslot_{photographer_id}"
-            if not transaction_manager.acquire_lock(transaction_id, resource, "write"):
-                raise Exception("Lock acquisition failed. Transaction is waiting.")
+            # Acquire the intention lock on the photographer
+            resource = ResourceKey.photographer(photographer_id)
+            if not (yield io.acquire_lock(transaction_id, resource, "IX", deadline)):
+                raise Exception(f"Lock acquisition failed. Timed out waiting for {resource}.")
 
             # Create a new timeslot entry
             new_timeslot = Timeslot(
                 PhotographerID=photographer_id,
-                AvailableDate=availability_data["AvailableDate"],
-                StartTime=availability_data["StartTime"],
-                EndTime=availability_data["EndTime"],
+                AvailableDate=parse_date(availability_data["AvailableDate"]),
+                StartTime=parse_time(availability_data["StartTime"]),
+                EndTime=parse_time(availability_data["EndTime"]),
                 Status="Available"
             )
 
-            # Log the creation
-            transaction_manager.log_manager.append_log(transaction_id, "Timeslots", None, {
+            # Add to database, flushing to get the timeslot ID, and lock the new timeslot
+            session.add(new_timeslot)
+            yield session.flush()
+            resource = ResourceKey.timeslot(new_timeslot.TimeslotID, photographer_id)
+            if not (yield io.acquire_lock(transaction_id, resource, "write", deadline)):
+                raise Exception(f"Lock acquisition failed. Timed out waiting for {resource}.")
+
+            # Log the creation before committing it
+            yield io.append_log(transaction_id, "Timeslots", new_timeslot.TimeslotID, {
                 "PhotographerID": photographer_id,
                 "AvailableDate": availability_data["AvailableDate"],
                 "StartTime": availability_data["StartTime"],
                 "EndTime": availability_data["EndTime"],
                 "Status": "Available"
-            })
-
-            # Add to database
-            session.add(new_timeslot)
-            session.commit()
+            }, operation="insert")
+            transaction_manager.record_version(transaction_id, "Timeslots", new_timeslot.TimeslotID, None)
+            timeslot_id = new_timeslot.TimeslotID
+            DaoOperations.invalidate_on_commit(transaction_id, DaoOperations.timeslot_tags(new_timeslot))
+            row = DaoOperations.availability_row(new_timeslot, (yield session.get(Photographer, photographer_id)))
+            transaction_manager.on_commit(transaction_id, lambda: availability_index.add(row))
 
             # Commit the transaction
-            transaction_manager.commit_transaction(transaction_id)
-            return new_timeslot.TimeslotID
+            yield io.commit_transaction(transaction_id, [session])
+            return timeslot_id
         except Exception as e:
             # Rollback the transaction on failure
-            session.rollback()
-            DaoOperations.rollback(transaction_id)
+            yield io.abort_transaction(transaction_id, [session])
             raise Exception(f"Error creating timeslot: {e}")
+        except CancelledError:
+            # Rollback the transaction when the request is cancelled, e.g. on a client disconnect
+            yield io.abort_transaction(transaction_id, [session])
+            raise
         finally:
-            session.close()
+            yield session.close()
 
     @staticmethod
-    def update_booking(transaction_id, booking_id, updates):
-        session = Session2()
+    def expand_recurrence(rule):
+        """
+        Expand a recurrence rule into (date, start, end) slots. The rule holds 'StartDate',
+        either 'EndDate' (inclusive) or 'Months', 'Weekdays' (0 = Monday, defaults to Monday
+        to Friday), 'DayStart', 'DayEnd' and 'SlotMinutes'. For example, weekdays 09:00-17:00
+        in 1h slots for 3 months:
+        {"StartDate": "2025-03-03", "Months": 3, "DayStart": "09:00", "DayEnd": "17:00", "SlotMinutes": 60}
+        """
+        start_date = parse_date(rule["StartDate"])
+        if "EndDate" in rule:
+            end_date = parse_date(rule["EndDate"])
+        else:
+            end_date = add_months(start_date, int(rule["Months"])) - timedelta(days=1)
+        weekdays = set(rule.get("Weekdays", [0, 1, 2, 3, 4]))
+        day_start, day_end = parse_time(rule["DayStart"]), parse_time(rule["DayEnd"])
+        slot_length = timedelta(minutes=int(rule["SlotMinutes"]))
+        if slot_length <= timedelta(0):
+            raise ValueError("SlotMinutes must be positive.")
+
+        slots = []
+        day = start_date
+        while day <= end_date:
+            if day.weekday() in weekdays:
+                start = DateTime.combine(day, day_start)
+                while start + slot_length <= DateTime.combine(day, day_end):
+                    slots.append((day, start.time(), (start + slot_length).time()))
+                    start += slot_length
+            day += timedelta(days=1)
+        return slots
+
+    @staticmethod
+    def find_overlaps(existing, new_slots):
+        """
+        Find, in memory, the new slots overlapping an existing slot or another new slot.
+        Slots are (date, start, end) tuples; touching slots do not overlap.
+        """
+        overlaps = []
+        tagged = sorted([(slot, False) for slot in existing] + [(slot, True) for slot in new_slots])
+        latest = {}  # Date -> (slot, is_new) of the slot ending last so far
+        for slot, is_new in tagged:
+            previous = latest.get(slot[0])
+            if previous and slot[1] < previous[0][2] and (is_new or previous[1]):
+                day, start, end = slot if is_new else previous[0]
+                overlaps.append({"AvailableDate": str(day), "StartTime": str(start), "EndTime": str(end)})
+            if not previous or slot[2] > previous[0][2]:
+                latest[slot[0]] = (slot, is_new)
+        return overlaps
+
+    @staticmethod
+    def create_availability_bulk(transaction_id, photographer_id, availability_data, deadline=None, chunk_size=500):
+        """
+        Create many timeslots for a photographer in one transaction, from a list of 'Slots'
+        or a 'Recurrence' rule (see expand_recurrence).
+        Overlaps with the photographer's existing timeslots, or between the new ones, are
+        detected in memory with a single query before anything is written. The timeslots are
+        then inserted with bulk inserts of chunk_size rows, with one undo log entry per chunk.
+        :return: The IDs of the new timeslots.
+        """
+        return run(DaoOperations.create_availability_bulk_steps(
+            blocking_io, transaction_id, photographer_id, availability_data, deadline, chunk_size
+        ))
+
+    @staticmethod
+    def create_availability_bulk_steps(io, transaction_id, photographer_id, availability_data, deadline=None,
+                                       chunk_size=500):
+        if "Recurrence" in availability_data:
+            slots = DaoOperations.expand_recurrence(availability_data["Recurrence"])
+        else:
+            slots = [
+                (parse_date(slot["AvailableDate"]), parse_time(slot["StartTime"]), parse_time(slot["EndTime"]))
+                for slot in availability_data["Slots"]
+            ]
+
+        session = io.Session1()
         try:
+            if not slots:
+                raise ValueError("No timeslots to create.")
+            invalid = [slot for slot in slots if slot[1] >= slot[2]]
+            if invalid:
+                raise ValueError(f"{len(invalid)} slots do not end after they start.")
+
             # Start the transaction
             transaction_manager.start_transaction(transaction_id)
 
-            # Acquire lock for the booking
-            resource = f"Booking_{booking_id}"
-            if not transaction_manager.acquire_lock(transaction_id, resource, "write"):
-                raise Exception("Lock acquisition failed. Transaction is waiting.")
+            # Acquire a single write lock on the photographer, covering all its timeslots, which
+            # serializes the overlap checks of a photographer
+            resource = ResourceKey.photographer(photographer_id)
+            if not (yield io.acquire_lock(transaction_id, resource, "write", deadline)):
+                raise Exception(f"Lock acquisition failed. Timed out waiting for {resource}.")
+
+            # Detect overlaps with the existing timeslots in the covered dates
+            existing = (yield session.execute(
+                select(Timeslot.AvailableDate, Timeslot.StartTime, Timeslot.EndTime).filter(
+                    Timeslot.PhotographerID == photographer_id,
+                    Timeslot.AvailableDate >= min(slot[0] for slot in slots),
+                    Timeslot.AvailableDate <= max(slot[0] for slot in slots)
+                )
+            )).all()
+            overlaps = DaoOperations.find_overlaps([tuple(row) for row in existing], slots)
+            if overlaps:
+                raise ValueError(f"{len(overlaps)} slots overlap existing or requested slots, e.g. {overlaps[:3]}.")
+
+            photographer = yield session.get(Photographer, photographer_id)
+            timeslot_ids, rows, tags = [], [], set()
+            for start in range(0, len(slots), chunk_size):
+                # Insert the chunk with one bulk insert, flushing to get the IDs
+                chunk = [
+                    Timeslot(PhotographerID=photographer_id, AvailableDate=day, StartTime=start_time,
+                             EndTime=end_time, Status="Available")
+                    for day, start_time, end_time in slots[start:start + chunk_size]
+                ]
+                session.add_all(chunk)
+                yield session.flush()
+                chunk_ids = [timeslot.TimeslotID for timeslot in chunk]
+
+                # Log the chunk before committing it
+                yield io.append_log(transaction_id, "Timeslots", chunk_ids, {
+                    "PhotographerID": photographer_id,
+                    "Status": "Available"
+                }, operation="insert")
+                for timeslot_id in chunk_ids:
+                    transaction_manager.record_version(transaction_id, "Timeslots", timeslot_id, None)
+
+                timeslot_ids.extend(chunk_ids)
+                for timeslot in chunk:
+                    rows.append(DaoOperations.availability_row(timeslot, photographer))
+                    tags.update(DaoOperations.timeslot_tags(timeslot))
+
+            DaoOperations.invalidate_on_commit(transaction_id, list(tags))
+            transaction_manager.on_commit(transaction_id, lambda: [availability_index.add(row) for row in rows])
+
+            # Commit the transaction
+            yield io.commit_transaction(transaction_id, [session])
+            return timeslot_ids
+        except Exception as e:
+            # Rollback the transaction on failure
+            yield io.abort_transaction(transaction_id, [session])
+            raise Exception(f"Error creating timeslots: {e}")
+        except CancelledError:
+            # Rollback the transaction when the request is cancelled, e.g. on a client disconnect
+            yield io.abort_transaction(transaction_id, [session])
+            raise
+        finally:
+            yield session.close()
+
+    @staticmethod
+    def update_booking(transaction_id, booking_id, updates, deadline=None):
+        return run(DaoOperations.update_booking_steps(blocking_io, transaction_id, booking_id, updates, deadline))
+
+    @staticmethod
+    def update_booking_steps(io, transaction_id, booking_id, updates, deadline=None):
+        session = io.Session2()
+        try:
+            # Start the transaction
+            transaction_manager.start_transaction(transaction_id)
+
+            # Acquire lock for the booking, also under its new client if it moves to another one
+            resource = yield from DaoOperations.booking_resource(session, booking_id)
+            if resource is None:
+                raise ValueError("Booking not found.")
+            resources = [resource]
+            if "ClientID" in updates:
+                resources.append(ResourceKey.booking(booking_id, updates["ClientID"]))
+            for resource in resources:
+                if not (yield io.acquire_lock(transaction_id, resource, "write", deadline)):
+                    raise Exception(f"Lock acquisition failed. Timed out waiting for {resource}.")
 
             # Fetch the booking
-            booking_record = session.query(Booking).filter_by(BookingID=booking_id).first()
+            booking_record = yield session.get(Booking, booking_id)
             if not booking_record:
                 raise ValueError("Booking not found.")
+            DaoOperations.check_booking_resource(booking_record, resources[0])
 
-            # Log the current state
-            transaction_manager.log_manager.append_log(transaction_id, "Bookings", booking_record.BookingID, {
+            # Log the current state and keep it as the current version of the booking
+            yield io.append_log(transaction_id, "Bookings", booking_record.BookingID, {
                 "TimeslotID": booking_record.TimeslotID,
                 "ClientID": booking_record.ClientID,
                 "Location": booking_record.Location,
                 "Status": booking_record.Status
             })
+            transaction_manager.record_version(
+                transaction_id, "Bookings", booking_record.BookingID, DaoOperations.booking_dict(booking_record)
+            )
 
             # Apply updates
+            previous_timeslot_id = booking_record.TimeslotID
             for key, value in updates.items():
                 setattr(booking_record, key, value)
-            session.commit()
+            DaoOperations.invalidate_on_commit(transaction_id, [
+                ("timeslot", int(previous_timeslot_id)),
+                ("timeslot", int(booking_record.TimeslotID)),
+            ])
 
             # Commit the transaction
-            transaction_manager.commit_transaction(transaction_id)
+            yield io.commit_transaction(transaction_id, [session])
             return "Booking updated successfully."
         except Exception as e:
             # Rollback the transaction on failure
-            session.rollback()
-            DaoOperations.rollback(transaction_id)
+            yield io.abort_transaction(transaction_id, [session])
             raise Exception(f"Error updating booking: {e}")
+        except CancelledError:
+            # Rollback the transaction when the request is cancelled, e.g. on a client disconnect
+            yield io.abort_transaction(transaction_id, [session])
+            raise
         finally:
-            session.close()
+            yield session.close()
 
-    def list_available_photographers(date):
+    @staticmethod
+    def timeslot_resources(session, timeslot_ids):
         """
-        List photographers available for a given date, including their details.
+        Steps returning the resource keys of the existing timeslots among timeslot_ids, by
+        timeslot ID. The key of a timeslot holds its photographer, which never changes, so it
+        is read before the timeslot is locked.
         """
-        session = Session1()
+        rows = (yield session.execute(select(Timeslot.TimeslotID, Timeslot.PhotographerID).filter(
+            Timeslot.TimeslotID.in_([int(timeslot_id) for timeslot_id in timeslot_ids])
+        ))).all()
+        return {row.TimeslotID: ResourceKey.timeslot(row.TimeslotID, row.PhotographerID) for row in rows}
+
+    @staticmethod
+    def booking_resource(session, booking_id):
+        """
+        Steps returning the resource key of a booking, or None if it does not exist. The key
+        holds the client of the booking, read before the booking is locked; see check_booking_resource.
+        """
+        client_id = (yield session.execute(select(Booking.ClientID).filter_by(BookingID=booking_id))).scalar()
+        return None if client_id is None else ResourceKey.booking(booking_id, client_id)
+
+    @staticmethod
+    def check_booking_resource(booking_record, resource):
+        """
+        Check that a booking locked under its client has not been moved to another client by
+        a transaction that committed in the meantime, in which case it was locked under the
+        wrong key.
+        """
+        if ResourceKey.booking(booking_record.BookingID, booking_record.ClientID) != resource:
+            raise Exception(f"Booking {booking_record.BookingID} was moved to another client concurrently.")
+
+    @staticmethod
+    def timeslot_tags(timeslot):
+        """
+        Cache tags of the reads depending on a timeslot: its details and its date's availability.
+        """
+        return [("timeslot", timeslot.TimeslotID), ("date", str(timeslot.AvailableDate))]
+
+    @staticmethod
+    def invalidate_on_commit(transaction_id, tags):
+        """
+        Invalidate the cached reads carrying the tags once the transaction commits.
+        """
+        transaction_manager.on_commit(transaction_id, lambda: read_cache.invalidate(tags))
+
+    @staticmethod
+    def get_cache_stats():
+        """
+        Retrieve the read cache counters.
+        """
+        return read_cache.stats()
+
+    @staticmethod
+    def list_available_photographers(date, deadline=None):
+        """
+        List photographers available for a given date, from the availability index once it
+        is built, through the read cache otherwise.
+        """
+        return run(DaoOperations.list_available_photographers_steps(blocking_io, date, deadline))
+
+    @staticmethod
+    def list_available_photographers_steps(io, date, deadline=None):
+        date = str(parse_date(date))
+        if availability_index.ready:
+            return availability_index.available_on(date)
+        return (yield io.get_or_load(
+            ("available", date), [("date", date)],
+            lambda: DaoOperations.read_available_photographers_steps(io, date, deadline)
+        ))
+
+    @staticmethod
+    def read_available_photographers_steps(io, date, deadline=None):
+        """
+        Steps listing photographers available for a given date, including their details.
+        The timeslots are read as of a snapshot, without locks, so the listing never holds a
+        booking up. Without a version store, the Timeslots table is read-locked before it is
+        read instead, so concurrent readers share the lock and the transactions writing
+        timeslots wait until the listing ends.
+        """
+        transaction_id = f"read_{uuid.uuid4().hex}"
+        session = io.Session1()
         try:
-            results = (
-                session.query(
-                    Timeslot.TimeslotID,
-                    Timeslot.PhotographerID,
-                    Timeslot.StartTime,
-                    Timeslot.EndTime,
-                    Photographer.Name,
-                    Photographer.Specialty
-                )
-                .join(Photographer, Photographer.PhotographerID == Timeslot.PhotographerID)
-                .filter(
-                    Timeslot.AvailableDate == date,
-                    Timeslot.Status == "Available"
-                )
-                .all()
-            )
+            snapshot = transaction_manager.start_transaction(transaction_id, read_only=True, snapshot=True)
+
+            # Without a snapshot, acquire a read lock on the table before reading it
+            if snapshot is None:
+                resource = ResourceKey.table_of(TIMESLOTS_TABLE)
+                if not (yield io.acquire_lock(transaction_id, resource, "read", deadline)):
+                    raise Exception(f"Lock acquisition failed. Timed out waiting for {resource}.")
+
+            timeslots = yield from DaoOperations.read_timeslots(session, snapshot, parse_date(date), "Available")
+            photographers = yield from DaoOperations.read_photographers(session, timeslots.values())
             return [
                 {
-                    "TimeslotID": result.TimeslotID,
-                    "PhotographerID": result.PhotographerID,
-                    "StartTime": str(result.StartTime),
-                    "EndTime": str(result.EndTime),
-                    "Name": result.Name,
-                    "Specialty": result.Specialty,
+                    "TimeslotID": timeslot["TimeslotID"],
+                    "PhotographerID": timeslot["PhotographerID"],
+                    "StartTime": str(timeslot["StartTime"]),
+                    "EndTime": str(timeslot["EndTime"]),
+                    "Name": photographers[timeslot["PhotographerID"]].Name,
+                    "Specialty": photographers[timeslot["PhotographerID"]].Specialty,
                 }
-                for result in results
+                for timeslot in timeslots.values()
+                if timeslot["PhotographerID"] in photographers
             ]
         except SQLAlchemyError as e:
             raise Exception(f"Error listing available photographers: {e}")
         finally:
-            session.close()
+            # Read-only transaction: committing only ends the snapshot or releases the read locks
+            yield io.commit_transaction(transaction_id)
+            yield session.close()
+
+    @staticmethod
+    def timeslot_row(timeslot):
+        """
+        Return the columns of a timeslot, as kept in the version store.
+        """
+        return {
+            "TimeslotID": timeslot.TimeslotID,
+            "PhotographerID": timeslot.PhotographerID,
+            "AvailableDate": timeslot.AvailableDate,
+            "StartTime": timeslot.StartTime,
+            "EndTime": timeslot.EndTime,
+            "Status": timeslot.Status
+        }
+
+    @staticmethod
+    def read_timeslots(session, snapshot, date, status=None):
+        """
+        Steps reading the timeslots of a date, optionally only those with the given status, as
+        of a snapshot timestamp, or as they are in the database when snapshot is None.
+        :return: TimeslotID -> timeslot columns (see timeslot_row), in TimeslotID order.
+        """
+        query = select(Timeslot).filter(Timeslot.AvailableDate == date)
+        if status is not None:
+            query = query.filter(Timeslot.Status == status)
+        timeslots = (yield session.execute(query)).scalars()
+        rows = {timeslot.TimeslotID: DaoOperations.timeslot_row(timeslot) for timeslot in timeslots}
+        return DaoOperations.filter_timeslots(rows, snapshot, date, status)
+
+    @staticmethod
+    def filter_timeslots(rows, snapshot, date, status=None):
+        """
+        Apply a snapshot to the timeslots of a date read from the database, then filter again
+        the versioned timeslots the snapshot brought in.
+        """
+        if snapshot is not None:
+            rows = transaction_manager.read_snapshot(snapshot, "Timeslots", rows)
+        return {
+            timeslot_id: row for timeslot_id, row in sorted(rows.items())
+            if row["AvailableDate"] == date and (status is None or row["Status"] == status)
+        }
 
     @staticmethod
-    def list_bookings_for_client(client_id):
+    def read_photographers(session, timeslots):
         """
-        Retrieve all bookings made by a specific client.
+        Steps reading the photographers of the given timeslot rows.
+        :return: PhotographerID -> Photographer.
         """
-        session = Session2()
+        photographer_ids = {timeslot["PhotographerID"] for timeslot in timeslots}
+        if not photographer_ids:
+            return {}
+        photographers = (yield session.execute(
+            select(Photographer).filter(Photographer.PhotographerID.in_(photographer_ids))
+        )).scalars()
+        return {photographer.PhotographerID: photographer for photographer in photographers}
+
+    @staticmethod
+    def get_schedule_report(date, deadline=None):
+        """
+        Report the schedule of a date across both databases: every timeslot of the date with
+        its photographer and its bookings, and totals. The report reads MFCC_db1 and MFCC_db2
+        as of the same snapshot, without locks, so it sees every transaction either entirely
+        or not at all and never holds a writer up, however long it takes. Without a version
+        store, both tables are read-locked instead, which holds the writers up until it ends.
+        "inconsistent" counts the timeslots whose status does not match their bookings.
+        """
+        date = parse_date(date)
+        transaction_id = f"report_{uuid.uuid4().hex}"
+        session1 = Session1()  # Connection to MFCC_db1
+        session2 = Session2()  # Connection to MFCC_db2
         try:
-            results = session.query(Booking).filter_by(ClientID=client_id).all()
-            return [
-                {
-                    "BookingID": record.BookingID,
-                    "TimeslotID": record.TimeslotID,
-                    "ClientID": record.ClientID,
-                    "Location": record.Location,
-                    "Status": record.Status
-                }
-                for record in results
-            ]
+            snapshot = transaction_manager.start_transaction(transaction_id, read_only=True, snapshot=True)
+
+            # Without a snapshot, acquire read locks on both tables
+            if snapshot is None:
+                for resource in (ResourceKey.table_of(TIMESLOTS_TABLE), ResourceKey.table_of(BOOKINGS_TABLE)):
+                    if not transaction_manager.acquire_lock(transaction_id, resource, "read", deadline):
+                        raise Exception(f"Lock acquisition failed. Timed out waiting for {resource}.")
+
+            timeslots = run(DaoOperations.read_timeslots(session1, snapshot, date))
+            photographers = run(DaoOperations.read_photographers(session1, timeslots.values()))
+
+            # Bookings of the timeslots, including those deleted since the snapshot
+            bookings = {
+                booking.BookingID: DaoOperations.booking_dict(booking)
+                for booking in session2.query(Booking).filter(Booking.TimeslotID.in_(list(timeslots)))
+            }
+            if snapshot is not None:
+                bookings = transaction_manager.read_snapshot(snapshot, "Bookings", bookings)
+            return DaoOperations.schedule_report(date, snapshot, timeslots, photographers, bookings)
         except SQLAlchemyError as e:
-            raise Exception(f"Error listing bookings for client: {e}")
+            raise Exception(f"Error building the schedule report: {e}")
+        finally:
+            # Read-only transaction: committing only ends the snapshot or releases the read locks
+            transaction_manager.commit_transaction(transaction_id)
+            session1.close()
+            session2.close()
+
+    @staticmethod
+    def schedule_report(date, snapshot, timeslots, photographers, bookings):
+        """
+        Build the schedule report of get_schedule_report from the rows it read.
+        """
+        booked = {}  # TimeslotID -> bookings
+        for booking_id, booking in sorted(bookings.items()):
+            if booking["TimeslotID"] in timeslots:
+                booked.setdefault(booking["TimeslotID"], []).append(booking)
+
+        rows, inconsistent = [], 0
+        for timeslot in sorted(timeslots.values(), key=lambda row: (row["StartTime"], row["TimeslotID"])):
+            photographer = photographers.get(timeslot["PhotographerID"])
+            timeslot_bookings = booked.get(timeslot["TimeslotID"], [])
+            if (timeslot["Status"] == "Booked") != bool(timeslot_bookings):
+                inconsistent += 1
+            rows.append({
+                "TimeslotID": timeslot["TimeslotID"],
+                "PhotographerID": timeslot["PhotographerID"],
+                "PhotographerName": photographer.Name if photographer else None,
+                "StartTime": str(timeslot["StartTime"]),
+                "EndTime": str(timeslot["EndTime"]),
+                "Status": timeslot["Status"],
+                "Bookings": timeslot_bookings,
+            })
+        return {
+            "date": str(date),
+            "snapshot": snapshot,
+            "timeslots": rows,
+            "summary": {
+                "timeslots": len(rows),
+                "available": sum(1 for row in rows if row["Status"] == "Available"),
+                "booked": sum(1 for row in rows if row["Status"] == "Booked"),
+                "bookings": sum(len(row["Bookings"]) for row in rows),
+                "inconsistent": inconsistent,
+            },
+        }
+
+    @staticmethod
+    def booking_dict(record):
+        return {
+            "BookingID": record.BookingID,
+            "TimeslotID": record.TimeslotID,
+            "ClientID": record.ClientID,
+            "Location": record.Location,
+            "Status": record.Status
+        }
+
+    @staticmethod
+    def client_dict(c):
+        return {
+            "ClientID": c.ClientID,
+            "Name": c.Name,
+            "Email": c.Email,
+            "Phone": c.Phone
+        }
+
+    @staticmethod
+    def photographer_dict(p):
+        return {"PhotographerID": p.PhotographerID, "Name": p.Name, "Specialty": p.Specialty}
+
+    @staticmethod
+    def keyset_query(query, key, after=None, limit=None):
+        """
+        Restrict a query to one page in key order: the rows with a key greater than 'after',
+        at most 'limit' of them. The index on the key serves the page directly, however
+        deep it is.
+        """
+        if after is not None:
+            query = query.filter(key > after)
+        query = query.order_by(key)
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    @staticmethod
+    def read_page(session_factory, query, key, serialize, after=None, limit=None):
+        """
+        Steps reading the serialized rows of a query, optionally one page at a time (see keyset_query).
+        """
+        session = session_factory()
+        try:
+            records = (yield session.execute(DaoOperations.keyset_query(query, key, after, limit))).scalars()
+            return [serialize(record) for record in records]
+        finally:
+            yield session.close()
+
+    @staticmethod
+    def stream_query(session_factory, query, serialize, batch_size=1000):
+        """
+        Generate the serialized rows of a query, fetched batch_size at a time with yield_per,
+        so memory stays flat whatever the size of the result. The session lives as long as the generator.
+        """
+        session = session_factory()
+        try:
+            for record in session.execute(query.execution_options(yield_per=batch_size)).scalars():
+                yield serialize(record)
+        except SQLAlchemyError as e:
+            raise Exception(f"Error streaming rows: {e}")
         finally:
             session.close()
 
     @staticmethod
-    def get_all_clients():
-        session = Session2()
+    def list_bookings_for_client(client_id, after=None, limit=None):
+        """
+        Retrieve the bookings made by a specific client, in BookingID order,
+        optionally one page at a time (see keyset_query).
+        """
+        return run(DaoOperations.list_bookings_for_client_steps(blocking_io, client_id, after, limit))
+
+    @staticmethod
+    def list_bookings_for_client_steps(io, client_id, after=None, limit=None):
         try:
-            clients = session.query(Client).all()
-            if not clients:
-                return []
-            return [
-                {
-                    "ClientID": c.ClientID,
-                    "Name": c.Name,
-                    "Email": c.Email,
-                    "Phone": c.Phone
-                }
-                for c in clients
-            ]
+            return (yield from DaoOperations.read_page(
+                io.Session2, select(Booking).filter_by(ClientID=client_id), Booking.BookingID,
+                DaoOperations.booking_dict, after, limit
+            ))
+        except SQLAlchemyError as e:
+            raise Exception(f"Error listing bookings for client: {e}")
+
+    @staticmethod
+    def stream_bookings_for_client(client_id):
+        """
+        Generate all bookings of a client without loading them all in memory.
+        """
+        return DaoOperations.stream_query(
+            Session2, select(Booking).filter_by(ClientID=client_id).order_by(Booking.BookingID),
+            DaoOperations.booking_dict
+        )
+
+    @staticmethod
+    def get_all_clients(after=None, limit=None):
+        """
+        Retrieve the clients in ClientID order, optionally one page at a time (see keyset_query).
+        """
+        return run(DaoOperations.get_all_clients_steps(blocking_io, after, limit))
+
+    @staticmethod
+    def get_all_clients_steps(io, after=None, limit=None):
+        try:
+            return (yield from DaoOperations.read_page(
+                io.Session2, select(Client), Client.ClientID, DaoOperations.client_dict, after, limit
+            ))
         except Exception as e:
-            print(f"Error fetching clients: {e}")
+            logger.error("Error fetching clients: %s", e)
             raise Exception(f"Error fetching clients: {e}")
-        finally:
-            session.close()
 
     @staticmethod
-    def get_all_photographers():
-        session = Session1()
+    def stream_clients():
+        """
+        Generate all clients without loading them all in memory.
+        """
+        return DaoOperations.stream_query(Session2, select(Client).order_by(Client.ClientID), DaoOperations.client_dict)
+
+    @staticmethod
+    def get_all_photographers(after=None, limit=None):
+        """
+        Retrieve all photographers, through the read cache, or one page of them (see keyset_query).
+        """
+        return run(DaoOperations.get_all_photographers_steps(blocking_io, after, limit))
+
+    @staticmethod
+    def get_all_photographers_steps(io, after=None, limit=None):
+        if after is not None or limit is not None:
+            return (yield from DaoOperations.read_all_photographers_steps(io, after, limit))
+        return (yield io.get_or_load(
+            ("photographers",), [("photographers",)], lambda: DaoOperations.read_all_photographers_steps(io)
+        ))
+
+    @staticmethod
+    def read_all_photographers_steps(io, after=None, limit=None):
         try:
-            photographers = session.query(Photographer).all()
-            return [{"PhotographerID": p.PhotographerID, "Name": p.Name, "Specialty": p.Specialty} for p in
-                    photographers]
+            return (yield from DaoOperations.read_page(
+                io.Session1, select(Photographer), Photographer.PhotographerID,
+                DaoOperations.photographer_dict, after, limit
+            ))
         except Exception as e:
             raise Exception(f"Error fetching photographers: {e}")
-        finally:
-            session.close()
+
+    @staticmethod
+    def stream_photographers():
+        """
+        Generate all photographers without loading them all in memory.
+        """
+        return DaoOperations.stream_query(
+            Session1, select(Photographer).order_by(Photographer.PhotographerID), DaoOperations.photographer_dict
+        )
+
     @staticmethod
     def get_available_timeslots_for_photographer(photographer_id):
-        session = Session1()
+        """
+        Retrieve the available timeslots of a photographer, from the availability index once it is built.
+        """
+        return run(DaoOperations.get_available_timeslots_for_photographer_steps(blocking_io, photographer_id))
+
+    @staticmethod
+    def get_available_timeslots_for_photographer_steps(io, photographer_id):
+        if availability_index.ready:
+            return availability_index.available_for_photographer(int(photographer_id))
+        session = io.Session1()
         try:
-            timeslots = session.query(Timeslot).filter_by(PhotographerID=photographer_id, Status="Available").all()
+            timeslots = (yield session.execute(
+                select(Timeslot).filter_by(PhotographerID=photographer_id, Status="Available")
+            )).scalars()
             return [
                 {
                     "TimeslotID": t.TimeslotID,
@@ -346,9 +1051,194 @@ class DaoOperations:
             ]
         except Exception as e:
             raise Exception(f"Error fetching available timeslots for photographer: {e}")
+        finally:
+            yield session.close()
+
+    @staticmethod
+    def availability_row(timeslot, photographer):
+        """
+        Build the availability index row of a timeslot.
+        """
+        return {
+            "TimeslotID": timeslot.TimeslotID,
+            "PhotographerID": timeslot.PhotographerID,
+            "AvailableDate": str(timeslot.AvailableDate),
+            "StartTime": str(timeslot.StartTime),
+            "EndTime": str(timeslot.EndTime),
+            "Name": photographer.Name if photographer else None,
+            "Specialty": photographer.Specialty if photographer else None,
+        }
+
+    @staticmethod
+    def read_availability_rows():
+        """
+        Read the availability index rows of all available timeslots from MFCC_db1.
+        """
+        session = Session1()
+        try:
+            results = (
+                session.query(Timeslot, Photographer)
+                .join(Photographer, Photographer.PhotographerID == Timeslot.PhotographerID)
+                .filter(Timeslot.Status == "Available")
+                .all()
+            )
+            return [DaoOperations.availability_row(timeslot, photographer) for timeslot, photographer in results]
+        except SQLAlchemyError as e:
+            raise Exception(f"Error reading available timeslots: {e}")
         finally:
             session.close()
 
+    @staticmethod
+    def build_availability_index(attempts=3):
+        """
+        Build the availability index from the tables. A build racing with a committing
+        transaction is retried, so it cannot overwrite the index with stale rows.
+        :return: The number of indexed timeslots, 0 if the index is disabled.
+        """
+        if not availability_index.enabled:
+            return 0
+        for _ in range(attempts):
+            updates = availability_index.update_count()
+            rows = DaoOperations.read_availability_rows()
+            if availability_index.load(rows, updates):
+                return len(rows)
+        raise Exception("Availability index kept changing while being built.")
+
+    @staticmethod
+    def verify_availability_index(repair=False):
+        """
+        Consistency check: compare the availability index with the tables and optionally
+        rebuild it when they differ.
+        """
+        if not availability_index.enabled:
+            return {"enabled": False, "consistent": True, "repaired": False}
+        differences = availability_index.compare(DaoOperations.read_availability_rows())
+        consistent = not any(differences.values())
+        if repair and not consistent:
+            DaoOperations.build_availability_index()
+        return dict(differences, consistent=consistent, repaired=repair and not consistent)
+
+    @staticmethod
+    def get_pool_stats():
+        """
+        Retrieve the connection pool state and checkout wait times of both databases.
+        """
+        return pool_stats()
+
+    @staticmethod
+    def get_metrics():
+        """
+        Retrieve the counters and latency histograms of the transaction layer, the log and
+        the databases, the conflict policy accounting of the lock manager and the size of the
+        version store, in the Prometheus text format.
+        """
+        conflicts = transaction_manager.snapshot(("conflicts",))["conflicts"]
+        policy = (("policy", conflicts["policy"]),)
+        return metrics.render() + DaoOperations.render_version_store() + render_family(
+            "photobooking_conflict_waits_total", "Lock requests that had to wait, by conflict policy.", "counter",
+            [(policy, conflicts["waits"])],
+        ) + render_family(
+            "photobooking_conflict_aborts_total", "Transactions aborted by the conflict policy, by reason.", "counter",
+            [(policy + (("reason", reason),), count) for reason, count in conflicts["aborts"].items()],
+        ) + render_family(
+            "photobooking_conflict_restarts_total", "Aborted transactions started again under the same ID.", "counter",
+            [(policy, conflicts["restarts"])],
+        ) + render_family(
+            "photobooking_lock_escalations_total", "Locks of a transaction replaced by one lock on their ancestor.",
+            "counter", [((), conflicts["escalations"])],
+        )
+
+    @staticmethod
+    def render_version_store():
+        """
+        Render the size of the version store and the age of its oldest snapshot, if there is one.
+        """
+        if transaction_manager.version_store is None:
+            return ""
+        stats = transaction_manager.version_store.stats()
+        return render_family(
+            "photobooking_mvcc_versions", "Old row versions kept for the snapshots.", "gauge",
+            [((), stats["versions"])],
+        ) + render_family(
+            "photobooking_mvcc_snapshots", "Open snapshots of read-only transactions.", "gauge",
+            [((), stats["snapshots"])],
+        ) + render_family(
+            "photobooking_mvcc_oldest_snapshot_seconds", "Age of the oldest open snapshot.", "gauge",
+            [((), stats["oldest_snapshot_seconds"])],
+        )
+
+    @staticmethod
+    def get_concurrency_state(part, top=10):
+        """
+        Retrieve one part of the concurrency control state, ready to be serialized:
+        "locks" (the lock table), "transactions" (the unfinished ones, oldest first),
+        "wait_for" (the edges of the wait-for graph), "contended" (the top most
+        contended resources), "history" (the most recently finished transactions, latest first)
+        or "conflicts" (the conflict policy, its wait, abort and restart counts and the lock escalations).
+        """
+        state = transaction_manager.snapshot((part,), top)[part]
+        if part == "locks":
+            locks = [dict(lock, resource=str(resource)) for resource, lock in state.items()]
+            return sorted(locks, key=lambda lock: lock["resource"])
+        if part == "transactions":
+            transactions = [
+                dict(transaction, transaction_id=transaction_id)
+                for transaction_id, transaction in state.items()
+                if transaction["status"] not in ("committed", "aborted")
+            ]
+            return sorted(transactions, key=lambda transaction: -transaction["age_seconds"])
+        if part == "wait_for":
+            return [{"waiting": waiting, "waiting_for": waited_for} for waiting, waited_for in state]
+        if part in ("history", "conflicts"):
+            return state
+        return [dict(entry, resource=str(entry["resource"])) for entry in state]
+
+    @staticmethod
+    def undo(session1, session2, log_entries):
+        """
+        Apply the undo of the given log entries, in reverse order, to both sessions:
+        delete inserted records, restore the previous state of updated records and
+        re-insert deleted ones. An entry of a bulk operation holds a list of record IDs
+        sharing the same data and is undone with a single statement.
+        The caller commits the sessions.
+        """
+        for log_entry in reversed(log_entries):  # Reverse to undo operations in reverse order
+            table = log_entry["table"]
+            record_id = log_entry["record_id"]
+            data = log_entry["data"]
+            operation = log_entry.get("operation", "update")
+
+            if table == "Timeslots":
+                session, model, key = session1, Timeslot, "TimeslotID"
+            elif table == "Bookings":
+                session, model, key = session2, Booking, "BookingID"
+            else:
+                continue
+
+            if isinstance(record_id, list):
+                records = session.query(model).filter(getattr(model, key).in_(record_id))
+                if operation == "insert":
+                    records.delete(synchronize_session=False)
+                else:
+                    records.update(data, synchronize_session=False)
+                continue
+
+            record = None
+            if record_id is not None:
+                record = session.query(model).filter_by(**{key: record_id}).first()
+
+            if operation == "insert":
+                # Remove the record created by the transaction
+                if record:
+                    session.delete(record)
+            elif record:
+                # Restore the state of the record
+                for column, value in data.items():
+                    setattr(record, column, value)
+            else:
+                # If the record was deleted, reinsert it
+                session.add(model(**data))
+
     @staticmethod
     def rollback(transaction_id):
         """
@@ -358,34 +1248,9 @@ class DaoOperations:
         session1 = Session1()  # For MFCC_db1
         session2 = Session2()  # For MFCC_db2
         try:
-            # Fetch the log data for the transaction
+            # Fetch the log data for the transaction and undo it
             log_data = transaction_manager.log_manager.get_log(transaction_id)
-            for log_entry in reversed(log_data["logs"]):  # Reverse to undo operations in reverse order
-                table = log_entry["table"]
-                record_id = log_entry["record_id"]
-                data = log_entry["data"]
-
-                if table == "Timeslots":
-                    record = session1.query(Timeslot).filter_by(TimeslotID=record_id).first()
-                    if record:
-                        # Restore the state of the record
-                        for key, value in data.items():
-                            setattr(record, key, value)
-                    else:
-                        # If the record was deleted, reinsert it
-                        restored_record = Timeslot(**data)
-                        session1.add(restored_record)
-
-                elif table == "Bookings":
-                    record = session2.query(Booking).filter_by(BookingID=record_id).first()
-                    if record:
-                        # Restore the state of the record
-                        for key, value in data.items():
-                            setattr(record, key, value)
-                    else:
-                        # If the record was deleted, reinsert it
-                        restored_record = Booking(**data)
-                        session2.add(restored_record)
+            DaoOperations.undo(session1, session2, log_data["logs"])
 
             # Commit changes to both databases
             session1.commit()
@@ -404,35 +1269,109 @@ class DaoOperations:
             session2.close()
 
     @staticmethod
-    def get_timeslot_details(timeslot_id):
+    def recover(batch_size=100):
         """
-        Retrieve details for a specific timeslot.
+        Crash recovery, run at server startup before any request is served.
+        Transactions found in the log with a commit decision but no commit record, which may
+        have committed on some participants, are undone in batches, with one commit per
+        database for each batch, and their logs are ended. The log of the transactions that
+        never reached their decision is only ended (see LogManager.recover).
+        A checkpoint then truncates the log, so restart time and disk usage stay bounded.
+        :return: The IDs of the transactions that were rolled back.
         """
-        session = Session1()
+        in_flight = transaction_manager.log_manager.recover()
+        transaction_ids = list(in_flight)
+        for start in range(0, len(transaction_ids), batch_size):
+            batch = transaction_ids[start:start + batch_size]
+            session1 = Session1()  # For MFCC_db1
+            session2 = Session2()  # For MFCC_db2
+            try:
+                # Undo the most recent transactions first
+                for transaction_id in reversed(batch):
+                    DaoOperations.undo(session1, session2, in_flight[transaction_id])
+                session1.commit()
+                session2.commit()
+            except Exception as e:
+                session1.rollback()
+                session2.rollback()
+                raise Exception(f"Error during recovery: {e}")
+            finally:
+                session1.close()
+                session2.close()
+
+            for transaction_id in batch:
+                transaction_manager.log_manager.delete_log(transaction_id)
+            logger.warning("Recovery: rolled back transactions %s.", batch)
+
+        transaction_manager.log_manager.checkpoint()
+        return transaction_ids
+
+    @staticmethod
+    def get_timeslot_details(timeslot_id, deadline=None):
+        """
+        Retrieve details for a specific timeslot, through the read cache.
+        """
+        return run(DaoOperations.get_timeslot_details_steps(blocking_io, timeslot_id, deadline))
+
+    @staticmethod
+    def get_timeslot_details_steps(io, timeslot_id, deadline=None):
+        timeslot_id = int(timeslot_id)
+        return (yield io.get_or_load(
+            ("timeslot", timeslot_id), [("timeslot", timeslot_id)],
+            lambda: DaoOperations.read_timeslot_details_steps(io, timeslot_id, deadline)
+        ))
+
+    @staticmethod
+    def read_timeslot_details_steps(io, timeslot_id, deadline=None):
+        """
+        Steps retrieving details for a specific timeslot as of a snapshot, or under a read lock
+        without a version store.
+        """
+        transaction_id = f"read_{uuid.uuid4().hex}"
+        session = io.Session1()
         try:
-            timeslot = (
-                session.query(Timeslot, Photographer.Name, Photographer.Specialty)
-                .join(Photographer, Photographer.PhotographerID == Timeslot.PhotographerID)
-                .filter(Timeslot.TimeslotID == timeslot_id)
-                .first()
-            )
-            if timeslot:
-                timeslot_data, photographer_name, photographer_specialty = timeslot
-                return {
-                    "TimeslotID": timeslot_data.TimeslotID,
-                    "PhotographerID": timeslot_data.PhotographerID,
-                    "PhotographerName": photographer_name,
-                    "Specialty": photographer_specialty,
-                    "AvailableDate": str(timeslot_data.AvailableDate),
-                    "StartTime": str(timeslot_data.StartTime),
-                    "EndTime": str(timeslot_data.EndTime),
-                    "Status": timeslot_data.Status,
-                }
-            return None
+            snapshot = transaction_manager.start_transaction(transaction_id, read_only=True, snapshot=True)
+
+            # Without a snapshot, acquire read lock for the timeslot
+            if snapshot is None:
+                resource = (yield from DaoOperations.timeslot_resources(session, [timeslot_id])).get(timeslot_id)
+                if resource is None:
+                    return None
+                if not (yield io.acquire_lock(transaction_id, resource, "read", deadline)):
+                    raise Exception(f"Lock acquisition failed. Timed out waiting for {resource}.")
+
+            timeslot = yield session.get(Timeslot, timeslot_id)
+            rows = {timeslot_id: DaoOperations.timeslot_row(timeslot)} if timeslot else {}
+            if snapshot is not None:
+                rows = transaction_manager.read_snapshot(snapshot, "Timeslots", rows, [timeslot_id])
+            timeslot = rows.get(timeslot_id)
+            if timeslot is None:
+                return None
+            photographer = yield session.get(Photographer, timeslot["PhotographerID"])
+            return DaoOperations.timeslot_details(timeslot, photographer)
         except SQLAlchemyError as e:
             raise Exception(f"Error fetching timeslot details: {e}")
         finally:
-            session.close()
+            # Read-only transaction: committing only ends the snapshot or releases the read lock
+            yield io.commit_transaction(transaction_id)
+            yield session.close()
 
+    @staticmethod
+    def timeslot_details(timeslot, photographer):
+        """
+        Build the details of a timeslot row (see timeslot_row) and its photographer.
+        """
+        return {
+            "TimeslotID": timeslot["TimeslotID"],
+            "PhotographerID": timeslot["PhotographerID"],
+            "PhotographerName": photographer.Name if photographer else None,
+            "Specialty": photographer.Specialty if photographer else None,
+            "AvailableDate": str(timeslot["AvailableDate"]),
+            "StartTime": str(timeslot["StartTime"]),
+            "EndTime": str(timeslot["EndTime"]),
+            "Status": timeslot["Status"],
+        }
 
 
+# Transactions whose commit reached only some databases are compensated from the log
+transaction_manager.undo_handler = DaoOperations.rollback
@@ -0,0 +1,119 @@
+"""
+The data access operations are written once, as generators of steps, and run either on
+blocking sessions, by DaoOperations, or on asyncio sessions, by AsyncDaoOperations.
+Every call doing I/O is yielded, and the value sent back is its result: a session call
+(get, execute, flush, delete, close) or a call to the io of the operation (lock, log,
+commit, abort, read cache). With the blocking sessions and BlockingIo the calls already
+returned their result, which run() sends back as is; with the asyncio sessions and AsyncIo
+they return awaitables, which run_async() awaits. Steps run other steps with 'yield from'.
+"""
+import asyncio
+import inspect
+
+
+def run(steps):
+    """
+    Run the steps of an operation whose calls block.
+    :return: The value returned by the steps.
+    """
+    value = None
+    try:
+        while True:
+            value = steps.send(value)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def run_async(steps):
+    """
+    Run the steps of an operation whose calls return awaitables, awaiting each of them.
+    An exception raised by an awaited call is raised inside the steps, at the yield of the
+    call, so their except and finally clauses run as they do in run(). So is a cancellation
+    of the task, e.g. when the client disconnects, as a CancelledError, which is not an
+    Exception: the steps of a transaction catch it on their own to abort the transaction.
+    :return: The value returned by the steps.
+    """
+    resume, value = steps.send, None
+    while True:
+        try:
+            step = resume(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value = (await step) if inspect.isawaitable(step) else step
+            resume = steps.send
+        except BaseException as e:
+            resume, value = steps.throw, e
+
+
+async def shielded(awaitable):
+    """
+    Await a call to its end even if the task awaiting it is cancelled meanwhile, once or
+    several times, then raise the cancellation, so that a commit or an abort is never left
+    halfway, with the transaction holding its locks and its log open.
+    """
+    task = asyncio.ensure_future(awaitable)
+    cancelled = False
+    while not task.done():
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            cancelled = True
+    try:
+        return task.result()
+    finally:
+        if cancelled:
+            raise asyncio.CancelledError
+
+
+class BlockingIo:
+    def __init__(self, transaction_manager, read_cache, session1, session2):
+        """
+        I/O of the steps run by run(): the blocking calls of the transaction manager and the
+        read cache, and the session factories of MFCC_db1 and MFCC_db2.
+        """
+        self.transaction_manager = transaction_manager
+        self.read_cache = read_cache
+        self.Session1 = session1
+        self.Session2 = session2
+
+    def acquire_lock(self, transaction_id, resource, lock_type, deadline=None):
+        return self.transaction_manager.acquire_lock(transaction_id, resource, lock_type, deadline)
+
+    def append_log(self, transaction_id, table, record_id, data, operation="update"):
+        return self.transaction_manager.log_manager.append_log(transaction_id, table, record_id, data, operation)
+
+    def commit_transaction(self, transaction_id, participants=()):
+        return self.transaction_manager.commit_transaction(transaction_id, participants)
+
+    def abort_transaction(self, transaction_id, participants=()):
+        return self.transaction_manager.abort_transaction(transaction_id, participants)
+
+    def get_or_load(self, key, tags, load_steps):
+        """
+        Return the cached value of a key, or run the steps returned by load_steps() to read it.
+        """
+        return self.read_cache.get_or_load(key, tags, lambda: run(load_steps()))
+
+
+class AsyncIo(BlockingIo):
+    """
+    I/O of the steps run by run_async(): the asyncio calls of the transaction manager and
+    the read cache, with the asyncio session factories of MFCC_db1 and MFCC_db2. Commits and
+    aborts run to their end when the task is cancelled (see shielded).
+    """
+
+    def acquire_lock(self, transaction_id, resource, lock_type, deadline=None):
+        return self.transaction_manager.acquire_lock_async(transaction_id, resource, lock_type, deadline)
+
+    def append_log(self, transaction_id, table, record_id, data, operation="update"):
+        return self.transaction_manager.log_manager.append_log_async(transaction_id, table, record_id, data, operation)
+
+    def commit_transaction(self, transaction_id, participants=()):
+        return shielded(self.transaction_manager.commit_transaction_async(transaction_id, participants))
+
+    def abort_transaction(self, transaction_id, participants=()):
+        return shielded(self.transaction_manager.abort_transaction_async(transaction_id, participants))
+
+    def get_or_load(self, key, tags, load_steps):
+        return self.read_cache.get_or_load_async(key, tags, lambda: run_async(load_steps()))
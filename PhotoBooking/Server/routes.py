@@ -0,0 +1,70 @@
+"""
+Request parsing and response bodies shared by the routes of app.py (Flask) and
+asgi_app.py (Quart), whose requests expose the same headers and query parameters.
+"""
+import json
+import os
+import time
+
+# Default time budget of a request, in seconds, including the time spent waiting for locks
+REQUEST_TIMEOUT = 30.0
+
+# Largest page a paginated listing returns, whatever the 'limit' asked for
+MAX_PAGE_SIZE = 1000
+
+# Content type of the Prometheus text exposition format served by /metrics
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Interval of the fallback deadlock sweep, in seconds (0 disables it). Deadlocks are
+# already resolved by the TransactionManager when the wait-for edge closing them is added.
+DEADLOCK_SWEEP_INTERVAL = float(os.environ.get("DEADLOCK_SWEEP_INTERVAL", "0"))
+
+
+def request_deadline(request):
+    """
+    Compute the deadline of a request from the optional 'X-Request-Timeout' header
+    (in seconds), falling back to REQUEST_TIMEOUT.
+    """
+    timeout = request.headers.get("X-Request-Timeout", type=float) or REQUEST_TIMEOUT
+    return time.monotonic() + timeout
+
+
+def page_args(request):
+    """
+    Read the keyset pagination parameters of a request: 'after', the last key of the
+    previous page, and 'limit', the page size (capped to MAX_PAGE_SIZE).
+    :return: (after, limit), both None when the request is not paginated.
+    """
+    after = request.args.get("after", type=int)
+    limit = request.args.get("limit", type=int)
+    if after is not None and limit is None:
+        limit = MAX_PAGE_SIZE
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return after, limit
+
+
+def listing_body(name, key, rows, limit):
+    """
+    Build the body of a listing. A paginated listing also returns 'next_after', the key to
+    pass as 'after' to get the next page, or None on the last page.
+    """
+    body = {name: rows}
+    if limit is not None:
+        body["next_after"] = rows[-1][key] if len(rows) == limit else None
+    return body
+
+
+def stream_parts(request, name):
+    """
+    Return the mimetype of a streamed listing, what its body starts and ends with, and the
+    function writing one of its rows, given whether it is the first: with '?stream=ndjson'
+    every row is written on its own line, otherwise the body is the same JSON object as the
+    non-streamed listing.
+    """
+    if request.args.get("stream") == "ndjson":
+        return "application/x-ndjson", "", "", lambda row, first: json.dumps(row, default=str) + "\n"
+    return (
+        "application/json", '{"%s": [' % name, "]}",
+        lambda row, first: ("" if first else ",") + json.dumps(row, default=str)
+    )
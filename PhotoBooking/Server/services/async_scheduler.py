@@ -0,0 +1,186 @@
+import asyncio
+
+from dao.async_operations import AsyncDaoOperations
+from services.scheduler import Scheduler
+
+
+class AsyncScheduler:
+    """
+    Asyncio counterpart of the Scheduler, used by the asyncio server. The request paths
+    run on the event loop through AsyncDaoOperations, the batch and bulk operations included.
+    The reports, the administration and the startup tasks are rare and run the blocking
+    Scheduler in the default executor.
+    """
+
+    def __init__(self):
+        self.scheduler = Scheduler()
+
+    async def run_blocking(self, method, *args):
+        return await asyncio.to_thread(getattr(self.scheduler, method), *args)
+
+    async def recover(self):
+        return await self.run_blocking("recover")
+
+    async def schedule_booking(self, transaction_id, session_data, deadline=None):
+        """
+        Schedule a new photography session.
+        """
+        try:
+            session_id = await AsyncDaoOperations.schedule_booking(transaction_id, session_data, deadline)
+            return f"Session scheduled successfully with ID {session_id}."
+        except Exception as e:
+            raise ValueError(f"Error scheduling session: {e}")
+
+    async def schedule_bookings_batch(self, transaction_id, batch_data, deadline=None):
+        """
+        Schedule several photography sessions in one transaction.
+        """
+        try:
+            return await AsyncDaoOperations.schedule_bookings_batch(transaction_id, batch_data, deadline)
+        except Exception as e:
+            raise ValueError(f"Error scheduling sessions: {e}")
+
+    async def cancel_booking(self, transaction_id, booking_id, deadline=None):
+        """
+        Cancel a photography booking
+        """
+        try:
+            return await AsyncDaoOperations.cancel_booking(transaction_id, booking_id, deadline)
+        except Exception as e:
+            raise ValueError(f"Error canceling session: {e}")
+
+    async def create_availability(self, transaction_id, photographer_id, availability_data, deadline=None):
+        """
+        Create availability slots for a photographer: a single slot, a list of 'Slots'
+        or a 'Recurrence' rule.
+        """
+        try:
+            if "Slots" in availability_data or "Recurrence" in availability_data:
+                timeslot_ids = await AsyncDaoOperations.create_availability_bulk(
+                    transaction_id, photographer_id, availability_data, deadline
+                )
+                return f"Availability created successfully with {len(timeslot_ids)} timeslots."
+            availability_id = await AsyncDaoOperations.create_availability(
+                transaction_id, photographer_id, availability_data, deadline
+            )
+            return f"Availability created successfully with ID {availability_id}."
+        except Exception as e:
+            raise ValueError(f"Error creating availability: {e}")
+
+    async def get_available_photographers(self, date, deadline=None):
+        """
+        Fetch photographers available for a given date.
+        """
+        try:
+            return await AsyncDaoOperations.list_available_photographers(date, deadline)
+        except Exception as e:
+            raise ValueError(f"Error fetching available photographers: {e}")
+
+    async def update_booking(self, transaction_id, session_id, updates, deadline=None):
+        """
+        Update a session's details.
+        """
+        try:
+            return await AsyncDaoOperations.update_booking(transaction_id, session_id, updates, deadline)
+        except Exception as e:
+            raise ValueError(f"Error updating session: {e}")
+
+    async def list_bookings_for_client(self, client_id, after=None, limit=None):
+        """
+        Retrieve the sessions booked by a specific client, optionally one page at a time.
+        """
+        try:
+            return await AsyncDaoOperations.list_bookings_for_client(client_id, after, limit)
+        except Exception as e:
+            raise ValueError(f"Error retrieving sessions for client: {e}")
+
+    async def stream_bookings_for_client(self, client_id):
+        """
+        Generate all sessions booked by a specific client.
+        """
+        try:
+            async for booking in AsyncDaoOperations.stream_bookings_for_client(client_id):
+                yield booking
+        except Exception as e:
+            raise ValueError(f"Error retrieving sessions for client: {e}")
+
+    async def get_all_clients(self, after=None, limit=None):
+        """
+        Fetch all clients, optionally one page at a time.
+        """
+        try:
+            return await AsyncDaoOperations.get_all_clients(after, limit)
+        except Exception as e:
+            raise ValueError(f"Error fetching clients: {e}")
+
+    async def stream_clients(self):
+        """
+        Generate all clients.
+        """
+        try:
+            async for client in AsyncDaoOperations.stream_clients():
+                yield client
+        except Exception as e:
+            raise ValueError(f"Error fetching clients: {e}")
+
+    async def get_all_photographers(self, after=None, limit=None):
+        """
+        Fetch all photographers, optionally one page at a time.
+        """
+        try:
+            return await AsyncDaoOperations.get_all_photographers(after, limit)
+        except Exception as e:
+            raise ValueError(f"Error fetching photographers: {e}")
+
+    async def stream_photographers(self):
+        """
+        Generate all photographers.
+        """
+        try:
+            async for photographer in AsyncDaoOperations.stream_photographers():
+                yield photographer
+        except Exception as e:
+            raise ValueError(f"Error fetching photographers: {e}")
+
+    async def get_available_timeslots_for_photographer(self, photographer_id):
+        """
+        Fetch available timeslots for a specific photographer.
+        """
+        try:
+            return await AsyncDaoOperations.get_available_timeslots_for_photographer(photographer_id)
+        except Exception as e:
+            raise ValueError(f"Error fetching available timeslots for photographer: {e}")
+
+    async def get_timeslot_details(self, timeslot_id, deadline=None):
+        """
+        Fetch details of a specific timeslot.
+        """
+        try:
+            timeslot_details = await AsyncDaoOperations.get_timeslot_details(timeslot_id, deadline)
+            if not timeslot_details:
+                raise ValueError("Timeslot not found.")
+            return timeslot_details
+        except Exception as e:
+            raise ValueError(f"Error fetching timeslot details: {e}")
+
+    async def get_schedule_report(self, date, deadline=None):
+        # A long report runs in the executor rather than on the event loop
+        return await self.run_blocking("get_schedule_report", date, deadline)
+
+    async def get_pool_stats(self):
+        return await self.run_blocking("get_pool_stats")
+
+    async def get_metrics(self):
+        return self.scheduler.get_metrics()
+
+    async def get_concurrency_state(self, part, top=10):
+        return await self.run_blocking("get_concurrency_state", part, top)
+
+    async def get_cache_stats(self):
+        return self.scheduler.get_cache_stats()
+
+    async def build_availability_index(self):
+        return await self.run_blocking("build_availability_index")
+
+    async def verify_availability_index(self, repair=False):
+        return await self.run_blocking("verify_availability_index", repair)
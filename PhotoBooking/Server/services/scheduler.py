@@ -2,86 +2,137 @@ from dao.operations import DaoOperations
 
 
 class Scheduler:
-    def schedule_booking(self, transaction_id, session_data):
+    def recover(self):
+        """
+        Roll back the transactions left in flight by a crash.
+        """
+        try:
+            return DaoOperations.recover()
+        except Exception as e:
+            raise ValueError(f"Error recovering transactions: {e}")
+
+    def schedule_booking(self, transaction_id, session_data, deadline=None):
         """
         Schedule a new photography session.
         """
         try:
-            session_id = DaoOperations.schedule_booking(transaction_id, session_data)
+            session_id = DaoOperations.schedule_booking(transaction_id, session_data, deadline)
             return f"Session scheduled successfully with ID {session_id}."
         except Exception as e:
             raise ValueError(f"Error scheduling session: {e}")
 
-    def cancel_booking(self, transaction_id, booking_id):
+    def schedule_bookings_batch(self, transaction_id, batch_data, deadline=None):
+        """
+        Schedule several photography sessions in one transaction.
+        """
+        try:
+            return DaoOperations.schedule_bookings_batch(transaction_id, batch_data, deadline)
+        except Exception as e:
+            raise ValueError(f"Error scheduling sessions: {e}")
+
+    def cancel_booking(self, transaction_id, booking_id, deadline=None):
         """
         Cancel a photography booking
         """
         try:
-            result = DaoOperations.cancel_booking(transaction_id, booking_id)
+            result = DaoOperations.cancel_booking(transaction_id, booking_id, deadline)
             return result
         except Exception as e:
             raise ValueError(f"Error canceling session: {e}")
 
-    def create_availability(self, transaction_id, photographer_id, availability_data):
+    def create_availability(self, transaction_id, photographer_id, availability_data, deadline=None):
         """
-        Create availability slots for a photographer.
+        Create availability slots for a photographer: a single slot, a list of 'Slots'
+        or a 'Recurrence' rule.
         """
         try:
-            availability_id = DaoOperations.create_availability(transaction_id, photographer_id, availability_data)
+            if "Slots" in availability_data or "Recurrence" in availability_data:
+                timeslot_ids = DaoOperations.create_availability_bulk(
+                    transaction_id, photographer_id, availability_data, deadline
+                )
+                return f"Availability created successfully with {len(timeslot_ids)} timeslots."
+            availability_id = DaoOperations.create_availability(transaction_id, photographer_id, availability_data, deadline)
             return f"Availability created successfully with ID {availability_id}."
         except Exception as e:
             raise ValueError(f"Error creating availability: {e}")
 
-    def get_available_photographers(self, date):
+    def get_available_photographers(self, date, deadline=None):
         """
         Fetch photographers available for a given date.
         """
         try:
-            available_photographers = DaoOperations.list_available_photographers(date)
+            available_photographers = DaoOperations.list_available_photographers(date, deadline)
             return available_photographers
         except Exception as e:
             raise ValueError(f"Error fetching available photographers: {e}")
 
-    def update_booking(self, transaction_id, session_id, updates):
+    def update_booking(self, transaction_id, session_id, updates, deadline=None):
         """
         Update a session's details.
         """
         try:
-            result = DaoOperations.update_booking(transaction_id, session_id, updates)
+            result = DaoOperations.update_booking(transaction_id, session_id, updates, deadline)
             return result
         except Exception as e:
             raise ValueError(f"Error updating session: {e}")
 
-    def list_bookings_for_client(self, client_id):
+    def list_bookings_for_client(self, client_id, after=None, limit=None):
         """
-        Retrieve all sessions booked by a specific client.
+        Retrieve the sessions booked by a specific client, optionally one page at a time.
         """
         try:
-            sessions = DaoOperations.list_bookings_for_client(client_id)
+            sessions = DaoOperations.list_bookings_for_client(client_id, after, limit)
             return sessions
         except Exception as e:
             raise ValueError(f"Error retrieving sessions for client: {e}")
 
-    def get_all_clients(self):
+    def stream_bookings_for_client(self, client_id):
+        """
+        Generate all sessions booked by a specific client.
+        """
+        try:
+            yield from DaoOperations.stream_bookings_for_client(client_id)
+        except Exception as e:
+            raise ValueError(f"Error retrieving sessions for client: {e}")
+
+    def get_all_clients(self, after=None, limit=None):
         """
-        Fetch all clients.
+        Fetch all clients, optionally one page at a time.
         """
         try:
-            clients = DaoOperations.get_all_clients()
+            clients = DaoOperations.get_all_clients(after, limit)
             return clients
         except Exception as e:
             raise ValueError(f"Error fetching clients: {e}")
 
-    def get_all_photographers(self):
+    def stream_clients(self):
         """
-        Fetch all photographers.
+        Generate all clients.
         """
         try:
-            photographers = DaoOperations.get_all_photographers()
+            yield from DaoOperations.stream_clients()
+        except Exception as e:
+            raise ValueError(f"Error fetching clients: {e}")
+
+    def get_all_photographers(self, after=None, limit=None):
+        """
+        Fetch all photographers, optionally one page at a time.
+        """
+        try:
+            photographers = DaoOperations.get_all_photographers(after, limit)
             return photographers
         except Exception as e:
             raise ValueError(f"Error fetching photographers: {e}")
 
+    def stream_photographers(self):
+        """
+        Generate all photographers.
+        """
+        try:
+            yield from DaoOperations.stream_photographers()
+        except Exception as e:
+            raise ValueError(f"Error fetching photographers: {e}")
+
     def get_available_timeslots_for_photographer(self, photographer_id):
         """
         Fetch available timeslots for a specific photographer.
@@ -92,16 +143,78 @@ class Scheduler:
         except Exception as e:
             raise ValueError(f"Error fetching available timeslots for photographer: {e}")
 
-    def get_timeslot_details(self, timeslot_id):
+    def get_timeslot_details(self, timeslot_id, deadline=None):
         """
         Fetch details of a specific timeslot.
         """
         try:
-            timeslot_details = DaoOperations.get_timeslot_details(timeslot_id)
+            timeslot_details = DaoOperations.get_timeslot_details(timeslot_id, deadline)
             if not timeslot_details:
                 raise ValueError("Timeslot not found.")
             return timeslot_details
         except Exception as e:
             raise ValueError(f"Error fetching timeslot details: {e}")
 
+    def get_schedule_report(self, date, deadline=None):
+        """
+        Build the schedule report of a date, read as of a snapshot of both databases.
+        """
+        try:
+            return DaoOperations.get_schedule_report(date, deadline)
+        except Exception as e:
+            raise ValueError(f"Error building schedule report: {e}")
+
+    def get_pool_stats(self):
+        """
+        Fetch connection pool statistics of both databases.
+        """
+        try:
+            return DaoOperations.get_pool_stats()
+        except Exception as e:
+            raise ValueError(f"Error fetching pool statistics: {e}")
+
+    def get_metrics(self):
+        """
+        Fetch the metrics of the transaction layer, the log and the databases.
+        """
+        try:
+            return DaoOperations.get_metrics()
+        except Exception as e:
+            raise ValueError(f"Error fetching metrics: {e}")
+
+    def get_concurrency_state(self, part, top=10):
+        """
+        Fetch a snapshot of the locks, transactions, wait-for edges, most contended resources,
+        recently finished transactions or conflict policy accounting.
+        """
+        try:
+            return DaoOperations.get_concurrency_state(part, top)
+        except Exception as e:
+            raise ValueError(f"Error fetching concurrency state: {e}")
+
+    def get_cache_stats(self):
+        """
+        Fetch the read cache counters.
+        """
+        try:
+            return DaoOperations.get_cache_stats()
+        except Exception as e:
+            raise ValueError(f"Error fetching cache statistics: {e}")
 
+    def build_availability_index(self):
+        """
+        Build the in-memory index of available timeslots.
+        """
+        try:
+            return DaoOperations.build_availability_index()
+        except Exception as e:
+            raise ValueError(f"Error building availability index: {e}")
+
+    def verify_availability_index(self, repair=False):
+        """
+        Compare the availability index with the database, rebuilding it on request.
+        """
+        try:
+            return DaoOperations.verify_availability_index(repair)
+        except Exception as e:
+            raise ValueError(f"Error verifying availability index: {e}")
@@ -0,0 +1,137 @@
+import asyncio
+import datetime
+import time
+
+import pytest
+
+from dao.async_operations import AsyncDaoOperations
+from dao.db import Session1, Session2
+from dao.models import Booking, Timeslot
+from dao.operations import DaoOperations, transaction_manager
+from dao.steps import shielded
+from transactions.ResourceKey import ResourceKey
+
+
+async def cancel_when_waiting(transaction_id, operation):
+    """
+    Run an operation of a transaction until it waits for a lock, then cancel it.
+    """
+    task = asyncio.ensure_future(operation)
+    wait_for_graph = transaction_manager.lock_manager.wait_for_graph
+    while not any(waiting == transaction_id for waiting, _ in wait_for_graph.get_edges()):
+        assert not task.done(), task.result()
+        await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+def assert_aborted(transaction_id):
+    lock_manager = transaction_manager.lock_manager
+    assert lock_manager.get_status(transaction_id) == "aborted"
+    assert not lock_manager.locks.get_held_resources(transaction_id)
+    assert not transaction_manager.log_manager.has_log(transaction_id)
+
+
+def test_cancel_waiting_booking(timeslot):
+    timeslot_id, photographer_id, client_id = timeslot
+    transaction_manager.start_transaction("holder-1")
+    assert transaction_manager.acquire_lock("holder-1", ResourceKey.timeslot(timeslot_id, photographer_id), "write")
+
+    booking = {"TimeslotID": timeslot_id, "ClientID": client_id, "Location": "Paris"}
+    asyncio.run(cancel_when_waiting(
+        "waiter-1", AsyncDaoOperations.schedule_booking("waiter-1", booking, time.monotonic() + 10)
+    ))
+    assert_aborted("waiter-1")
+
+    # The timeslot is still available once the holder is done
+    transaction_manager.commit_transaction("holder-1")
+    assert DaoOperations.schedule_booking("booker-1", booking) is not None
+
+
+def test_cancel_booking_cancellation(timeslot):
+    timeslot_id, photographer_id, client_id = timeslot
+    booking = {"TimeslotID": timeslot_id, "ClientID": client_id, "Location": "Paris"}
+    booking_id = DaoOperations.schedule_booking("booker-2", booking)
+    transaction_manager.start_transaction("holder-2")
+    assert transaction_manager.acquire_lock("holder-2", ResourceKey.timeslot(timeslot_id, photographer_id), "write")
+
+    # Cancelled while it waits for the timeslot, once it deleted the booking and logged it
+    asyncio.run(cancel_when_waiting(
+        "waiter-2", AsyncDaoOperations.cancel_booking("waiter-2", booking_id, time.monotonic() + 10)
+    ))
+    assert_aborted("waiter-2")
+    transaction_manager.commit_transaction("holder-2")
+
+    session = Session2()
+    try:
+        assert session.get(Booking, booking_id) is not None
+    finally:
+        session.close()
+
+
+def test_shielded_call_runs_to_its_end():
+    finished = []
+
+    async def call():
+        await asyncio.sleep(0.05)
+        finished.append(True)
+
+    async def cancel_twice():
+        task = asyncio.ensure_future(shielded(call()))
+        for _ in range(2):
+            await asyncio.sleep(0.01)
+            task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_twice())
+    assert finished
+
+
+def add_timeslot(photographer_id):
+    session = Session1()
+    try:
+        slot = Timeslot(PhotographerID=photographer_id, AvailableDate=datetime.date(2025, 1, 6),
+                        StartTime=datetime.time(11), EndTime=datetime.time(12), Status="Available")
+        session.add(slot)
+        session.commit()
+        return slot.TimeslotID
+    finally:
+        session.close()
+
+
+def test_cancel_waiting_batch(timeslot):
+    timeslot_id, photographer_id, client_id = timeslot
+    other_id = add_timeslot(photographer_id)
+    transaction_manager.start_transaction("holder-3")
+    assert transaction_manager.acquire_lock("holder-3", ResourceKey.timeslot(other_id, photographer_id), "write")
+
+    # Cancelled while it waits for the second timeslot, holding the first one
+    batch = {"TimeslotIDs": [other_id, timeslot_id], "ClientID": client_id, "Location": "Paris"}
+    asyncio.run(cancel_when_waiting(
+        "waiter-3", AsyncDaoOperations.schedule_bookings_batch("waiter-3", batch, time.monotonic() + 10)
+    ))
+    assert_aborted("waiter-3")
+    transaction_manager.commit_transaction("holder-3")
+
+    booking_ids = asyncio.run(AsyncDaoOperations.schedule_bookings_batch("booker-3", batch))
+    assert len(booking_ids) == 2
+
+
+def test_cancel_waiting_bulk_availability(timeslot):
+    timeslot_id, photographer_id, _ = timeslot
+    transaction_manager.start_transaction("holder-4")
+    assert transaction_manager.acquire_lock("holder-4", ResourceKey.timeslot(timeslot_id, photographer_id), "write")
+
+    # Cancelled while it waits for the photographer, locked below by the holder
+    slots = {"Slots": [{"AvailableDate": "2025-01-07", "StartTime": "09:00", "EndTime": "10:00"},
+                       {"AvailableDate": "2025-01-07", "StartTime": "10:00", "EndTime": "11:00"}]}
+    asyncio.run(cancel_when_waiting("waiter-4", AsyncDaoOperations.create_availability_bulk(
+        "waiter-4", photographer_id, slots, time.monotonic() + 10
+    )))
+    assert_aborted("waiter-4")
+    transaction_manager.commit_transaction("holder-4")
+
+    timeslot_ids = asyncio.run(AsyncDaoOperations.create_availability_bulk("creator-4", photographer_id, slots))
+    assert len(timeslot_ids) == 2
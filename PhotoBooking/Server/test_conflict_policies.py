@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+from transactions.LockManager import LockManager
+from transactions.Metrics import metrics
+from transactions.ResourceKey import ResourceKey
+from transactions.TransactionManager import TransactionManager
+
+FIRST, SECOND = ResourceKey.timeslot(1, 1), ResourceKey.timeslot(2, 2)
+
+
+def start_in_order(lock_manager, *transaction_ids):
+    """
+    Start transactions from the oldest to the youngest.
+    """
+    for transaction_id in transaction_ids:
+        lock_manager.start_transaction(transaction_id)
+        time.sleep(0.01)
+
+
+def in_thread(function, *args):
+    """
+    Call a function on a new thread.
+    :return: The thread and the list its result is appended to.
+    """
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function(*args)))
+    thread.start()
+    return thread, result
+
+
+def wait_until(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "Timed out"
+        time.sleep(0.01)
+
+
+def counter(name):
+    for line in metrics.render().splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[1])
+    return 0.0
+
+
+def test_wounded_transaction_keeps_its_locks():
+    lock_manager = LockManager("wound-wait")
+    start_in_order(lock_manager, "old", "young")
+    assert lock_manager.acquire_lock("young", FIRST, "write")
+
+    thread, granted = in_thread(lock_manager.acquire_lock, "old", FIRST, "write", 5)
+    wait_until(lambda: lock_manager.get_status("young") == "wounded")
+    # Still running, the wounded transaction keeps the lock until it aborts
+    assert FIRST in lock_manager.locks.get_held_resources("young")
+    assert lock_manager.snapshot(("conflicts",))["conflicts"]["aborts"]["wound"] == 1
+    assert not granted
+
+    # Its next lock request fails, then its abort releases its locks
+    assert not lock_manager.acquire_lock("young", SECOND, "write")
+    lock_manager.update_status("young", "aborted")
+    lock_manager.release_locks("young")
+    thread.join()
+    assert granted == [True]
+
+
+def test_wounded_transaction_waiting_is_refused():
+    lock_manager = LockManager("wound-wait")
+    start_in_order(lock_manager, "old", "young")
+    assert lock_manager.acquire_lock("old", SECOND, "write")
+    assert lock_manager.acquire_lock("young", FIRST, "write")
+
+    # The younger transaction waits for the older one, which then wounds it
+    young, young_granted = in_thread(lock_manager.acquire_lock, "young", SECOND, "write", 5)
+    wait_until(lambda: lock_manager.locks.get_locks()[SECOND]["waiting"])
+    old, old_granted = in_thread(lock_manager.acquire_lock, "old", FIRST, "write", 5)
+    young.join(2)
+    assert young_granted == [False]
+    assert FIRST in lock_manager.locks.get_held_resources("young")
+
+    lock_manager.update_status("young", "aborted")
+    lock_manager.release_locks("young")
+    old.join()
+    assert old_granted == [True]
+
+
+def test_wound_is_not_counted_as_deadlock(tmp_path, monkeypatch):
+    monkeypatch.setenv("PHOTOBOOKING_LOG_DIR", str(tmp_path))
+    transaction_manager = TransactionManager(lock_timeout=5, conflict_policy="wound-wait")
+    start_in_order(transaction_manager, "old", "young")
+    assert transaction_manager.acquire_lock("young", FIRST, "write")
+    wounded = counter("photobooking_wounded_transactions_total")
+    deadlocks = counter("photobooking_deadlock_victims_total")
+
+    thread, granted = in_thread(transaction_manager.acquire_lock, "old", FIRST, "write")
+    wait_until(lambda: transaction_manager.lock_manager.get_status("young") == "wounded")
+    with pytest.raises(Exception, match="was aborted"):
+        transaction_manager.commit_transaction("young")
+    transaction_manager.abort_transaction("young")
+    thread.join()
+
+    assert granted == [True]
+    assert transaction_manager.lock_manager.get_status("young") == "aborted"
+    assert counter("photobooking_wounded_transactions_total") == wounded + 1
+    assert counter("photobooking_deadlock_victims_total") == deadlocks
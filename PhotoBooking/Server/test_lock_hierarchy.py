@@ -0,0 +1,136 @@
+import threading
+import time
+
+from transactions.LockManager import LockManager
+from transactions.Locks import COMPATIBILITY, LOCK_MODES, SUPREMUM
+from transactions.ResourceKey import BOOKINGS_TABLE, TIMESLOTS_TABLE, ResourceKey
+
+
+def start(lock_manager, *transaction_ids):
+    for transaction_id in transaction_ids:
+        lock_manager.start_transaction(transaction_id)
+
+
+def test_hierarchy():
+    timeslots, bookings = ResourceKey.table_of(TIMESLOTS_TABLE), ResourceKey.table_of(BOOKINGS_TABLE)
+    assert ResourceKey.timeslot(7, 3).ancestors() == [timeslots, ResourceKey.photographer(3)]
+    assert ResourceKey.booking(4, 2).ancestors() == [bookings, ResourceKey.client(2)]
+    assert timeslots.parent() is None and bookings.parent() is None
+    # A photographer and a timeslot with the same ID are different resources
+    assert ResourceKey.photographer(5) != ResourceKey.timeslot(5, 9)
+
+
+def test_compatibility():
+    assert COMPATIBILITY["IS", "SIX"] and COMPATIBILITY["IX", "IX"] and COMPATIBILITY["read", "read"]
+    assert not COMPATIBILITY["IX", "read"] and not COMPATIBILITY["SIX", "IX"]
+    assert not any(COMPATIBILITY["write", mode] for mode in LOCK_MODES)
+    # The matrix is symmetric
+    assert all(COMPATIBILITY[a, b] == COMPATIBILITY[b, a] for a in LOCK_MODES for b in LOCK_MODES)
+
+
+def test_supremum():
+    assert SUPREMUM["IX", "read"] == SUPREMUM["read", "IX"] == "SIX"
+    assert SUPREMUM["IS", "read"] == "read"
+    assert SUPREMUM["IS", "IX"] == "IX"
+    assert SUPREMUM["SIX", "IX"] == SUPREMUM["SIX", "read"] == "SIX"
+    assert all(SUPREMUM[mode, "write"] == "write" for mode in LOCK_MODES)
+    assert all(SUPREMUM[mode, mode] == mode for mode in LOCK_MODES)
+
+
+def test_intention_locks():
+    lock_manager = LockManager()
+    start(lock_manager, "writer", "reader")
+    assert lock_manager.acquire_lock("writer", ResourceKey.timeslot(1, 1), "write")
+    assert lock_manager.locks.held_mode("writer", ResourceKey.table_of(TIMESLOTS_TABLE)) == "IX"
+    assert lock_manager.locks.held_mode("writer", ResourceKey.photographer(1)) == "IX"
+
+    # Another photographer's timeslots can be read, the whole table cannot
+    assert lock_manager.acquire_lock("reader", ResourceKey.timeslot(2, 2), "read")
+    assert lock_manager.locks.held_mode("reader", ResourceKey.table_of(TIMESLOTS_TABLE)) == "IS"
+    assert not lock_manager.acquire_lock("reader", ResourceKey.table_of(TIMESLOTS_TABLE), "read", 0.1)
+
+
+def test_photographer_write_lock_covers_its_timeslots():
+    lock_manager = LockManager()
+    start(lock_manager, "bulk", "booking")
+    assert lock_manager.acquire_lock("bulk", ResourceKey.photographer(3), "write")
+    assert not lock_manager.acquire_lock("booking", ResourceKey.timeslot(30, 3), "write", 0.1)
+    assert lock_manager.acquire_lock("booking", ResourceKey.timeslot(40, 4), "write", 0.1)
+
+    # Nothing more is locked below a covering lock
+    held = lock_manager.locks.get_held_resources("bulk")
+    assert lock_manager.acquire_lock("bulk", ResourceKey.timeslot(31, 3), "write")
+    assert lock_manager.locks.get_held_resources("bulk") == held
+
+
+def test_read_table_then_write_gives_six():
+    lock_manager = LockManager()
+    start(lock_manager, "report", "reader", "writer")
+    table = ResourceKey.table_of(TIMESLOTS_TABLE)
+    assert lock_manager.acquire_lock("report", table, "read")
+    assert lock_manager.acquire_lock("report", ResourceKey.timeslot(1, 1), "write")
+    assert lock_manager.locks.held_mode("report", table) == "SIX"
+
+    # SIX lets other transactions read below the table, not write
+    assert lock_manager.acquire_lock("reader", ResourceKey.timeslot(2, 2), "read", 0.1)
+    assert not lock_manager.acquire_lock("writer", ResourceKey.timeslot(3, 3), "write", 0.1)
+
+
+def test_escalation_to_photographer():
+    lock_manager = LockManager(escalation_threshold=10)
+    start(lock_manager, "bulk", "other")
+    for timeslot_id in range(25):
+        assert lock_manager.acquire_lock("bulk", ResourceKey.timeslot(timeslot_id, 1), "write")
+
+    # The timeslots were released, and the later ones not locked, under the photographer's lock
+    held = lock_manager.locks.get_held_resources("bulk")
+    assert held == {ResourceKey.table_of(TIMESLOTS_TABLE), ResourceKey.photographer(1)}
+    assert lock_manager.locks.held_mode("bulk", ResourceKey.photographer(1)) == "write"
+    assert not lock_manager.acquire_lock("other", ResourceKey.timeslot(0, 1), "read", 0.1)
+    assert lock_manager.snapshot(["conflicts"])["conflicts"]["escalations"] == 1
+
+
+def test_escalation_retried_when_blocked():
+    lock_manager = LockManager(escalation_threshold=10)
+    start(lock_manager, "bulk", "reader")
+    assert lock_manager.acquire_lock("reader", ResourceKey.timeslot(999, 2), "read")
+    for timeslot_id in range(15):
+        assert lock_manager.acquire_lock("bulk", ResourceKey.timeslot(timeslot_id, 2), "write")
+    assert lock_manager.locks.held_mode("bulk", ResourceKey.photographer(2)) == "IX"
+
+    # Tried again at the next multiple of the threshold
+    lock_manager.release_locks("reader")
+    for timeslot_id in range(15, 20):
+        assert lock_manager.acquire_lock("bulk", ResourceKey.timeslot(timeslot_id, 2), "write")
+    assert lock_manager.locks.held_mode("bulk", ResourceKey.photographer(2)) == "write"
+
+
+def test_escalation_to_table():
+    lock_manager = LockManager(escalation_threshold=10)
+    start(lock_manager, "reader")
+    for photographer_id in range(12):
+        assert lock_manager.acquire_lock("reader", ResourceKey.timeslot(photographer_id, photographer_id), "read")
+    assert lock_manager.locks.held_mode("reader", ResourceKey.table_of(TIMESLOTS_TABLE)) == "read"
+
+
+def test_deadlock_through_intention_locks():
+    lock_manager = LockManager()
+    start(lock_manager, "T1")
+    time.sleep(0.01)
+    start(lock_manager, "T2")
+    assert lock_manager.acquire_lock("T1", ResourceKey.photographer(1), "read")
+    assert lock_manager.acquire_lock("T2", ResourceKey.photographer(2), "read")
+
+    results = {}
+
+    def lock_other_timeslot():
+        results["T1"] = lock_manager.acquire_lock("T1", ResourceKey.timeslot(20, 2), "write", 3)
+
+    thread = threading.Thread(target=lock_other_timeslot)
+    thread.start()
+    time.sleep(0.1)
+    results["T2"] = lock_manager.acquire_lock("T2", ResourceKey.timeslot(10, 1), "write", 3)
+    if not results["T2"]:
+        lock_manager.release_locks("T2")
+    thread.join()
+    assert results["T1"] != results["T2"]
@@ -0,0 +1,85 @@
+import io
+import os
+import threading
+import time
+
+import pytest
+
+from transactions.LogManager import LogManager
+
+RECORD = {"type": "update", "transaction_id": "T1", "operation": "update", "table": "Timeslots",
+          "record_id": 7, "data": {"Status": "Available"}}
+
+
+@pytest.fixture
+def log_manager(tmp_path):
+    log_manager = LogManager(str(tmp_path))
+    yield log_manager
+    log_manager.close()
+
+
+def test_record_format():
+    encoded = LogManager.encode_record(RECORD)
+    length, checksum, payload = encoded.split(b" ", 2)
+    assert int(length, 16) == len(payload) - 1 and payload.endswith(b"\n")
+    assert len(checksum) == 8
+
+    f = io.BytesIO(encoded * 2)
+    assert LogManager.read_record(f) == RECORD
+    assert LogManager.read_record(f) == RECORD
+    assert LogManager.read_record(f) is None
+
+
+def test_torn_and_corrupt_records():
+    encoded = LogManager.encode_record(RECORD)
+    # Torn within the header, then within the payload
+    assert LogManager.read_record(io.BytesIO(encoded[:10])) is None
+    assert LogManager.read_record(io.BytesIO(encoded[:-5])) is None
+    # A flipped byte of the payload fails the checksum
+    corrupt = encoded.replace(b"Available", b"Availablf")
+    assert LogManager.read_record(io.BytesIO(corrupt)) is None
+    # Garbage instead of a header
+    assert LogManager.read_record(io.BytesIO(b"not a log record at all\n")) is None
+
+
+def test_get_log_reports_corrupt_record(log_manager):
+    log_manager.create_log("T1")
+    log_manager.append_log("T1", "Timeslots", 7, {"Status": "Available"})
+    log_manager.append_log("T1", "Bookings", 3, {"Status": "Scheduled"}, operation="delete")
+    assert [entry["table"] for entry in log_manager.get_log("T1")["logs"]] == ["Timeslots", "Bookings"]
+
+    # Overwrite the checksum of the second record
+    segment, offset = log_manager.index["T1"][1]
+    with open(log_manager.segment_path(segment), "r+b") as f:
+        f.seek(offset + 9)
+        f.write(b"00000000")
+    with pytest.raises(Exception, match="is corrupt"):
+        log_manager.get_log("T1")
+
+
+def test_group_commit(log_manager, monkeypatch):
+    fsyncs = []
+    fsync = os.fsync
+
+    def slow_fsync(fd):
+        fsyncs.append(fd)
+        time.sleep(0.02)
+        fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", slow_fsync)
+    appenders = 20
+    for transaction_id in range(appenders):
+        log_manager.create_log(transaction_id)
+    threads = [
+        threading.Thread(target=log_manager.append_log, args=(transaction_id, "Timeslots", transaction_id, {}))
+        for transaction_id in range(appenders)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # The appenders waiting during an fsync share the next one, and every append is durable
+    assert len(fsyncs) < appenders
+    assert log_manager.durable_lsn == log_manager.written_lsn
+    assert all(len(log_manager.get_log(transaction_id)["logs"]) == 1 for transaction_id in range(appenders))
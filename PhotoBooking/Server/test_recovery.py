@@ -0,0 +1,127 @@
+import os
+
+import pytest
+
+from dao.db import Session1
+from dao.models import Timeslot
+from dao.operations import DaoOperations, transaction_manager
+from transactions.LogManager import LogManager
+
+BEFORE_IMAGE = {"table": "Timeslots", "record_id": 1, "data": {"Status": "Available"}, "operation": "update"}
+
+
+def crash(log_dir, write):
+    """
+    Write records to the log in log_dir, then close it without ending the transactions, as
+    if the process had crashed.
+    """
+    log_manager = LogManager(log_dir)
+    write(log_manager)
+    log_manager.close()
+
+
+def set_status(timeslot_id, status):
+    session = Session1()
+    try:
+        session.get(Timeslot, timeslot_id).Status = status
+        session.commit()
+    finally:
+        session.close()
+
+
+def get_status(timeslot_id):
+    session = Session1()
+    try:
+        return session.get(Timeslot, timeslot_id).Status
+    finally:
+        session.close()
+
+
+def test_recover_decided_transactions(tmp_path):
+    def write(log_manager):
+        for transaction_id in ("undecided", "decided", "committed", "ended"):
+            log_manager.create_log(transaction_id)
+            log_manager.append_log(transaction_id, "Timeslots", 1, {"Status": "Available"})
+        log_manager.log_decision("decided", 2)
+        log_manager.log_decision("committed", 2)
+        log_manager.commit_log("committed")
+        log_manager.delete_log("ended")
+
+    crash(str(tmp_path), write)
+    log_manager = LogManager(str(tmp_path))
+    in_flight = log_manager.recover()
+    assert in_flight == {"decided": [BEFORE_IMAGE]}
+    assert log_manager.get_log("decided")["logs"] == [BEFORE_IMAGE]
+    assert not log_manager.has_log("undecided")
+    log_manager.close()
+
+    # The log of the undecided transaction was ended, the decided one is recovered until its log is
+    log_manager = LogManager(str(tmp_path))
+    assert list(log_manager.recover()) == ["decided"]
+    log_manager.delete_log("decided")
+    log_manager.close()
+    log_manager = LogManager(str(tmp_path))
+    assert log_manager.recover() == {}
+    log_manager.close()
+
+
+def test_recover_stops_at_torn_record(tmp_path):
+    def write(log_manager):
+        for transaction_id in ("first", "second"):
+            log_manager.create_log(transaction_id)
+            log_manager.append_log(transaction_id, "Timeslots", 1, {"Status": "Available"})
+            log_manager.log_decision(transaction_id, 2)
+
+    crash(str(tmp_path), write)
+    # The crash tore the last record written, the decision of the second transaction
+    log_manager = LogManager(str(tmp_path))
+    path = log_manager.segment_path(log_manager.list_segments()[0])
+    os.truncate(path, os.path.getsize(path) - 5)
+    assert log_manager.recover() == {"first": [BEFORE_IMAGE]}
+    log_manager.close()
+
+
+def test_checkpoint_truncates_finished_segments(tmp_path):
+    log_manager = LogManager(str(tmp_path), segment_size=256)
+    log_manager.create_log("long")
+    for transaction_id in range(10):
+        log_manager.create_log(transaction_id)
+        log_manager.append_log(transaction_id, "Timeslots", transaction_id, {"Status": "Available"})
+        log_manager.commit_log(transaction_id)
+
+    # The segments are kept from the one where the oldest active transaction began
+    segments = log_manager.list_segments()
+    assert len(segments) > 2 and segments[0] == 1
+    log_manager.delete_log("long")
+    log_manager.checkpoint()
+    assert log_manager.list_segments() == [log_manager.segment]
+    log_manager.close()
+
+    log_manager = LogManager(str(tmp_path))
+    assert log_manager.recover() == {}
+    log_manager.close()
+
+
+@pytest.mark.parametrize("decided", [False, True])
+def test_recover_after_crash(timeslot, tmp_path, monkeypatch, decided):
+    timeslot_id = timeslot[0]
+
+    # A transaction booking the timeslot crashed before or after its commit decision
+    def write(log_manager):
+        log_manager.create_log("crashed")
+        log_manager.append_log("crashed", "Timeslots", timeslot_id, {"Status": "Available"})
+        if decided:
+            log_manager.log_decision("crashed", 2)
+
+    crash(str(tmp_path), write)
+    # Without a decision, the booking never committed and the timeslot was booked since by
+    # another transaction; with it, the booking committed on MFCC_db1
+    set_status(timeslot_id, "Booked")
+
+    monkeypatch.setattr(transaction_manager, "log_manager", LogManager(str(tmp_path)))
+    try:
+        assert DaoOperations.recover() == (["crashed"] if decided else [])
+        assert not transaction_manager.log_manager.has_log("crashed")
+    finally:
+        transaction_manager.log_manager.close()
+    assert get_status(timeslot_id) == ("Available" if decided else "Booked")
@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+
+from transactions.ResourceKey import ResourceKey
+from transactions.TransactionManager import TransactionManager
+
+TIMESLOT = ResourceKey.timeslot(1, 1)
+
+
+class Participant:
+    def __init__(self, fail_flush=False, fail_commit=False):
+        """
+        Database session of a participant, failing its flush or its commit on demand.
+        """
+        self.fail_flush = fail_flush
+        self.fail_commit = fail_commit
+        self.committed = False
+        self.rolled_back = False
+
+    def flush(self):
+        if self.fail_flush:
+            raise Exception("Constraint violated")
+
+    def commit(self):
+        if self.fail_commit:
+            raise Exception("Connection lost")
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+@pytest.fixture
+def transaction_manager(tmp_path, monkeypatch):
+    monkeypatch.setenv("PHOTOBOOKING_LOG_DIR", str(tmp_path))
+    transaction_manager = TransactionManager(lock_timeout=1)
+    yield transaction_manager
+    transaction_manager.log_manager.close()
+
+
+def start_writer(transaction_manager, transaction_id):
+    transaction_manager.start_transaction(transaction_id)
+    assert transaction_manager.acquire_lock(transaction_id, TIMESLOT, "write")
+    transaction_manager.log_manager.append_log(transaction_id, "Timeslots", 1, {"Status": "Available"})
+
+
+def test_commit(transaction_manager):
+    start_writer(transaction_manager, "T1")
+    participants = [Participant(), Participant()]
+    transaction_manager.commit_transaction("T1", participants)
+
+    assert all(participant.committed for participant in participants)
+    assert transaction_manager.lock_manager.get_status("T1") == "committed"
+    assert not transaction_manager.lock_manager.locks.get_held_resources("T1")
+    assert not transaction_manager.log_manager.has_log("T1")
+
+
+def test_in_doubt_compensation(transaction_manager):
+    compensating, compensated = threading.Event(), []
+
+    def undo(transaction_id):
+        compensating.wait(2)
+        compensated.append(transaction_manager.log_manager.get_log(transaction_id)["logs"])
+        transaction_manager.log_manager.delete_log(transaction_id)
+
+    transaction_manager.undo_handler = undo
+    start_writer(transaction_manager, "T1")
+    participants = [Participant(), Participant(fail_commit=True)]
+    with pytest.raises(Exception, match="Commit failed on 1 of 2 participants"):
+        transaction_manager.commit_transaction("T1", participants)
+    assert participants[0].committed
+    assert transaction_manager.lock_manager.get_status("T1") == "in-doubt"
+
+    # The abort returns at once, the transaction keeps its locks until it is compensated
+    transaction_manager.abort_transaction("T1", participants)
+    assert transaction_manager.lock_manager.locks.get_held_resources("T1")
+    compensating.set()
+    transaction_manager.rollback_worker.flush()
+
+    assert compensated == [[{"table": "Timeslots", "record_id": 1, "data": {"Status": "Available"},
+                             "operation": "update"}]]
+    assert transaction_manager.lock_manager.get_status("T1") == "aborted"
+    assert not transaction_manager.lock_manager.locks.get_held_resources("T1")
+    assert not transaction_manager.log_manager.has_log("T1")
+
+
+def test_prepare_failure_is_not_compensated(transaction_manager):
+    compensated = []
+    transaction_manager.undo_handler = compensated.append
+    start_writer(transaction_manager, "T1")
+    participants = [Participant(), Participant(fail_flush=True)]
+    with pytest.raises(Exception, match="Constraint violated"):
+        transaction_manager.commit_transaction("T1", participants)
+
+    # Nothing committed, so rolling the participants back is enough
+    transaction_manager.abort_transaction("T1", participants)
+    transaction_manager.rollback_worker.flush()
+    assert not compensated
+    assert all(participant.rolled_back and not participant.committed for participant in participants)
+    assert transaction_manager.lock_manager.get_status("T1") == "aborted"
+    assert not transaction_manager.log_manager.has_log("T1")
@@ -0,0 +1,70 @@
+from transactions.VersionStore import VersionStore
+
+AVAILABLE, BOOKED = {"Status": "Available"}, {"Status": "Booked"}
+
+
+def test_snapshot_across_commit():
+    version_store = VersionStore()
+    before = version_store.begin_snapshot("reader-before")
+
+    # A writer booking the timeslot hides its change until it commits, then from older snapshots only
+    version_store.record("writer", "Timeslots", 1, AVAILABLE)
+    assert version_store.as_of("Timeslots", before) == {1: AVAILABLE}
+    assert version_store.commit("writer") == 1
+    after = version_store.begin_snapshot("reader-after")
+    assert version_store.as_of("Timeslots", before) == {1: AVAILABLE}
+    assert version_store.as_of("Timeslots", after) == {}
+
+    # The version is dropped once no snapshot needs it
+    version_store.end_snapshot("reader-before")
+    assert version_store.stats()["versions"] == 0
+    version_store.end_snapshot("reader-after")
+
+
+def test_snapshot_across_abort():
+    version_store = VersionStore()
+    snapshot = version_store.begin_snapshot("reader")
+    version_store.record("writer", "Timeslots", 1, AVAILABLE)
+    version_store.record("writer", "Bookings", 5, None)
+    assert version_store.as_of("Bookings", snapshot) == {5: None}
+
+    # Rolled back, the changes are not in the databases any more
+    version_store.discard("writer")
+    assert version_store.as_of("Timeslots", snapshot) == {}
+    assert version_store.as_of("Bookings", snapshot) == {}
+    assert version_store.commit("writer") is None
+
+
+def test_successive_writers():
+    version_store = VersionStore()
+    first = version_store.begin_snapshot("reader-1")
+    version_store.record("booker", "Timeslots", 1, AVAILABLE)
+    version_store.commit("booker")
+    second = version_store.begin_snapshot("reader-2")
+
+    # The next writer of the row commits on its databases but is not stamped yet
+    version_store.record("canceler", "Timeslots", 1, BOOKED)
+    assert version_store.as_of("Timeslots", first) == {1: AVAILABLE}
+    assert version_store.as_of("Timeslots", second) == {1: BOOKED}
+    version_store.commit("canceler")
+    assert version_store.as_of("Timeslots", second) == {1: BOOKED}
+    assert version_store.as_of("Timeslots", version_store.begin_snapshot("reader-3")) == {}
+    assert version_store.as_of("Timeslots", first, record_ids=[1, 2]) == {1: AVAILABLE}
+
+
+def test_aborted_writer_is_not_read():
+    aborted = set()
+    version_store = VersionStore(lambda transaction_id: transaction_id in aborted)
+    before = version_store.begin_snapshot("reader-before")
+
+    # A deadlock victim loses its locks before it rolls back and discards its versions,
+    # and the next writer of the row commits meanwhile
+    version_store.record("victim", "Timeslots", 1, AVAILABLE)
+    aborted.add("victim")
+    version_store.record("booker", "Timeslots", 1, AVAILABLE)
+    version_store.commit("booker")
+    assert version_store.as_of("Timeslots", version_store.begin_snapshot("reader-after")) == {}
+    assert version_store.as_of("Timeslots", before) == {1: AVAILABLE}
+
+    version_store.discard("victim")
+    assert version_store.stats()["versions"] == 1
@@ -0,0 +1,152 @@
+import asyncio
+import itertools
+import socket
+from concurrent.futures import Future
+from threading import Lock, Thread
+
+from transactions import LockProtocol as protocol
+
+
+class LockConnection:
+    def __init__(self, address):
+        """
+        A connection to the lock server, shared by any number of threads. Requests are
+        pipelined: a caller sends its frame and waits on a future, while a reader thread
+        resolves the futures as responses arrive, in any order.
+        """
+        family, location = protocol.parse_address(address)
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.connect(location)
+        if family == socket.AF_INET:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_lock = Lock()
+        self.pending = {}  # Request ID -> Future of the response
+        self.request_ids = itertools.count(1)
+        self.closed = False
+        Thread(target=self._read_responses, daemon=True, name="lock-client").start()
+
+    def request(self, code, args, wait=True):
+        """
+        Send a request.
+        :param wait: Whether the response is wanted. Without it the request is sent and
+                     forgotten; it still takes effect before any later request of the connection.
+        :return: The Future of the result, or None if the response is not wanted.
+        """
+        future = None
+        with self.send_lock:
+            if self.closed:
+                raise ConnectionError("Lock server connection is closed.")
+            request_id = 0
+            if wait:
+                request_id = next(self.request_ids)
+                future = Future()
+                self.pending[request_id] = future
+            self.socket.sendall(protocol.encode_frame(request_id, code, args))
+        return future
+
+    def _receive(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Lock server closed the connection.")
+            data += chunk
+        return data
+
+    def _read_responses(self):
+        try:
+            while True:
+                length, request_id, status = protocol.HEADER.unpack(self._receive(protocol.HEADER.size))
+                value, _ = protocol.decode_value(self._receive(length))
+                with self.send_lock:
+                    future = self.pending.pop(request_id, None)
+                if future is None:
+                    continue
+                if status == protocol.OK:
+                    future.set_result(value)
+                else:
+                    future.set_exception(Exception(f"Lock server error: {value}"))
+        except (ConnectionError, OSError) as e:
+            with self.send_lock:
+                self.closed = True
+                pending, self.pending = self.pending, {}
+            for future in pending.values():
+                future.set_exception(ConnectionError(f"Lock server connection lost: {e}"))
+
+    def close(self):
+        with self.send_lock:
+            self.closed = True
+        self.socket.close()
+
+
+class LockClient:
+    def __init__(self, address, pool_size=4, response_timeout=60.0):
+        """
+        Client of the lock server, with the interface of a LockManager. Requests are spread over
+        a pool of pipelined connections, and every request of a transaction goes through the same
+        connection, so they take effect in order. Status updates and the start of a transaction
+        do not wait for a response.
+        :param response_timeout: Extra time allowed to the server beyond a lock request's own
+                                 timeout before the request is reported as failed.
+        """
+        self.address = address
+        self.response_timeout = response_timeout
+        self.connections = [LockConnection(address) for _ in range(pool_size)]
+
+    def _connection(self, transaction_id):
+        return self.connections[hash(transaction_id) % len(self.connections)]
+
+    def _call(self, transaction_id, code, args, timeout=None):
+        future = self._connection(transaction_id).request(code, args)
+        return future.result(None if timeout is None else timeout + self.response_timeout)
+
+    async def _call_async(self, transaction_id, code, args, timeout=None):
+        future = self._connection(transaction_id).request(code, args)
+        wait = None if timeout is None else timeout + self.response_timeout
+        return await asyncio.wait_for(asyncio.wrap_future(future), wait)
+
+    def start_transaction(self, transaction_id):
+        self._connection(transaction_id).request(protocol.BEGIN, [transaction_id], wait=False)
+
+    def get_status(self, transaction_id):
+        return self._call(transaction_id, protocol.GET_STATUS, [transaction_id], 0)
+
+    async def get_status_async(self, transaction_id):
+        return await self._call_async(transaction_id, protocol.GET_STATUS, [transaction_id], 0)
+
+    def update_status(self, transaction_id, status):
+        self._connection(transaction_id).request(protocol.SET_STATUS, [transaction_id, status], wait=False)
+
+    def transition_status(self, transaction_id, expected, status):
+        return self._call(transaction_id, protocol.TRANSITION_STATUS, [transaction_id, list(expected), status], 0)
+
+    async def transition_status_async(self, transaction_id, expected, status):
+        return await self._call_async(
+            transaction_id, protocol.TRANSITION_STATUS, [transaction_id, list(expected), status], 0
+        )
+
+    def acquire_lock(self, transaction_id, resource, lock_type, timeout=0, log_records=0):
+        return self._call(
+            transaction_id, protocol.ACQUIRE, [transaction_id, resource, lock_type, timeout, log_records], timeout
+        )
+
+    async def acquire_lock_async(self, transaction_id, resource, lock_type, timeout=0, log_records=0):
+        return await self._call_async(
+            transaction_id, protocol.ACQUIRE, [transaction_id, resource, lock_type, timeout, log_records], timeout
+        )
+
+    def release_locks(self, transaction_id):
+        self._call(transaction_id, protocol.RELEASE, [transaction_id], 0)
+
+    async def release_locks_async(self, transaction_id):
+        await self._call_async(transaction_id, protocol.RELEASE, [transaction_id], 0)
+
+    def check_deadlock(self):
+        return self._call(None, protocol.CHECK_DEADLOCK, [], 0)
+
+    def snapshot(self, parts=("locks", "transactions", "wait_for", "contended"), top=10):
+        return self._call(None, protocol.SNAPSHOT, [list(parts), top], 0)
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
@@ -0,0 +1,369 @@
+import logging
+import time
+from threading import Lock
+
+from transactions.Locks import IMPLIED_MODES, LOCK_MODES, Locks, SUPREMUM
+from transactions.Transactions import Transactions
+from transactions.WaitForGraph import WaitForGraph
+
+logger = logging.getLogger(__name__)
+
+# How a lock request blocked by other transactions is handled:
+#   detection   wait, and abort the transaction cheapest to undo of any cycle in the wait-for graph
+#   wait-die    wait only for younger transactions, otherwise fail (the requester dies)
+#   wound-wait  mark the younger transactions in the way as "wounded", so they abort, and wait for the older ones
+#   no-wait     fail at once
+CONFLICT_POLICIES = ("detection", "wait-die", "wound-wait", "no-wait")
+
+# Reasons for which a conflict policy aborts a transaction
+ABORT_REASONS = ("deadlock", "die", "wound", "no-wait")
+
+# Lock mode -> intention mode taken on the ancestors of the resource
+INTENTION_MODES = {"IS": "IS", "IX": "IX", "read": "IS", "SIX": "IX", "write": "IX"}
+
+# Mode held on an ancestor -> modes of the requests on its descendants it makes unnecessary
+COVERED_MODES = {"read": {"IS", "read"}, "SIX": {"IS", "read"}, "write": set(LOCK_MODES)}
+
+
+class LockManager:
+    def __init__(self, conflict_policy="detection", escalation_threshold=200):
+        """
+        Owner of the concurrency control state shared by all transactions: the lock table,
+        the wait-for graph and the transaction metadata (status and timestamp). It runs in
+        the process of the TransactionManager, or in the lock server daemon, which serves the
+        same methods to every worker process through a LockClient.
+        Lock conflicts are handled by the conflict policy (see CONFLICT_POLICIES). Only the
+        detection policy maintains the wait-for graph: the timestamp-based policies prevent
+        deadlocks by letting transactions wait for older ones only (wait-die) or for younger
+        ones only (wound-wait), and no-wait never waits.
+        Locks are taken down the lock hierarchy (see ResourceKey). When a transaction has taken
+        escalation_threshold locks below a photographer, client or table, they are replaced by
+        a single read or write lock on it, if it can be granted at once; 0 disables escalation.
+        """
+        if conflict_policy not in CONFLICT_POLICIES:
+            raise ValueError(f"Unknown conflict policy '{conflict_policy}', expected one of {CONFLICT_POLICIES}.")
+        self.conflict_policy = conflict_policy
+        self.escalation_threshold = escalation_threshold
+        self.transactions = Transactions()
+        self.locks = Locks()
+        self.wait_for_graph = WaitForGraph()
+
+        # Accounting of the conflict policy: lock waits, aborts by reason and restarts, and lock escalations
+        self.conflicts = {"waits": 0, "restarts": 0, "escalations": 0, "aborts": dict.fromkeys(ABORT_REASONS, 0)}
+        self.conflicts_lock = Lock()
+
+    def start_transaction(self, transaction_id):
+        """
+        Register a new transaction. The ID of a finished transaction may be reused, e.g. by
+        another worker or after a restart of the API, and then starts a new transaction.
+        Reusing the ID of an aborted transaction restarts it: the restart is counted and keeps
+        the original timestamp, so that a transaction aborted by wait-die or wound-wait
+        eventually becomes the oldest and cannot starve.
+        """
+        timestamp = None
+        transaction = self.transactions.get_transaction(transaction_id)
+        if transaction is not None and transaction.status in ("committed", "aborted"):
+            self.transactions.remove_transaction(transaction_id)
+            if transaction.status == "aborted":
+                timestamp = transaction.timestamp
+                self._count("restarts")
+        self.transactions.add_transaction(transaction_id, timestamp)
+
+    def _count(self, key, reason=None):
+        with self.conflicts_lock:
+            if reason is None:
+                self.conflicts[key] += 1
+            else:
+                self.conflicts[key][reason] += 1
+
+    def get_status(self, transaction_id):
+        """
+        Return the status of a transaction, or None if it is unknown.
+        """
+        transaction = self.transactions.get_transaction(transaction_id)
+        return transaction.status if transaction else None
+
+    async def get_status_async(self, transaction_id):
+        return self.get_status(transaction_id)
+
+    def update_status(self, transaction_id, status):
+        self.transactions.update_status(transaction_id, status)
+
+    def transition_status(self, transaction_id, expected, status):
+        """
+        Update the status of a transaction only if it is one of the expected statuses.
+        :return: True if the status was updated.
+        """
+        return self.transactions.transition(transaction_id, tuple(expected), status)
+
+    async def transition_status_async(self, transaction_id, expected, status):
+        return self.transition_status(transaction_id, expected, status)
+
+    def acquire_lock(self, transaction_id, resource, lock_type, timeout=0, log_records=0):
+        """
+        Acquire a lock on a resource, in one of the LOCK_MODES, blocking for at most timeout
+        seconds. The ancestors of the resource are locked first, from the root down, in the
+        matching intention mode. Nothing is locked below an ancestor held in a mode covering
+        the request, e.g. after a lock escalation.
+        While a request is queued, the transaction has an edge to every blocking transaction
+        in the wait-for graph, and a deadlock closed by these edges is resolved at once.
+        :param log_records: Number of records in the log of the transaction, which cannot grow
+                            while it waits, for the choice of deadlock victims.
+        :return: True if the lock was acquired, False on timeout or if the transaction was aborted.
+        """
+        start = time.monotonic()
+        request = self._start_request(transaction_id, resource, lock_type, log_records)
+        if request is None:
+            return False
+        transaction, plan, new_lock = request
+        for node, mode in plan:
+            on_wait, waits = self._wait_callback(transaction_id, node)
+            granted = self.locks.acquire_lock(transaction_id, node, mode, self._timeout(timeout, start), on_wait)
+            if not self._finish_request(transaction_id, granted, waits):
+                return False
+        if new_lock:
+            self._escalate(transaction, resource)
+        return True
+
+    async def acquire_lock_async(self, transaction_id, resource, lock_type, timeout=0, log_records=0):
+        """
+        Asyncio version of acquire_lock, suspending the calling coroutine instead of its thread.
+        """
+        start = time.monotonic()
+        request = self._start_request(transaction_id, resource, lock_type, log_records)
+        if request is None:
+            return False
+        transaction, plan, new_lock = request
+        for node, mode in plan:
+            on_wait, waits = self._wait_callback(transaction_id, node)
+            granted = await self.locks.acquire_lock_async(
+                transaction_id, node, mode, self._timeout(timeout, start), on_wait
+            )
+            if not self._finish_request(transaction_id, granted, waits):
+                return False
+        if new_lock:
+            self._escalate(transaction, resource)
+        return True
+
+    def _start_request(self, transaction_id, resource, lock_type, log_records):
+        """
+        Record the log length of a transaction making a lock request, and plan the request:
+        the intention locks on the ancestors of the resource and the lock on the resource,
+        leaving out the locks the transaction already holds in a mode at least as strong.
+        :return: The transaction (None if unknown), the (resource, mode) locks to acquire in
+                 order and whether the resource is newly locked, or None if the transaction
+                 was aborted, so the request must fail.
+        """
+        if lock_type not in LOCK_MODES:
+            raise ValueError(f"Unknown lock mode '{lock_type}', expected one of {LOCK_MODES}.")
+        transaction = self.transactions.get_transaction(transaction_id)
+        if transaction is not None:
+            if transaction.status in ("aborted", "wounded"):
+                return None
+            transaction.log_records = log_records
+
+        plan = []
+        intention = INTENTION_MODES[lock_type]
+        ancestors = resource.ancestors()
+        *held_modes, held = self.locks.held_modes(transaction_id, ancestors + [resource])
+        for node, held_mode in zip(ancestors, held_modes):
+            if held_mode is None:
+                plan.append((node, intention))
+            elif lock_type in COVERED_MODES.get(held_mode, ()):
+                return transaction, [], False
+            elif SUPREMUM[held_mode, intention] != held_mode:
+                plan.append((node, intention))
+        if held is None or lock_type not in IMPLIED_MODES[held]:
+            plan.append((resource, lock_type))
+        return transaction, plan, held is None
+
+    def _timeout(self, timeout, start):
+        """
+        Return the time left for the next lock of a request started at start (a time.monotonic() value).
+        """
+        # Under no-wait a conflicting request fails instead of queueing
+        if self.conflict_policy == "no-wait":
+            return 0
+        if timeout is None:
+            return None
+        return max(0.0, timeout - (time.monotonic() - start))
+
+    def _escalate(self, transaction, resource):
+        """
+        Count a new lock of a transaction below each ancestor of the resource, up to its table,
+        and escalate the locks below the nearest ancestor reaching a multiple of the threshold:
+        the ancestor is locked in write mode if the transaction writes below it, in read mode
+        otherwise, without waiting, and the locks below it are released. If the lock cannot be
+        granted at once, the transaction keeps its locks and escalation is tried again at the
+        next multiple of the threshold.
+        """
+        if not self.escalation_threshold or transaction is None:
+            return
+        if transaction.fine_locks is None:
+            transaction.fine_locks = {}
+        transaction_id = transaction.transaction_id
+        candidates = []
+        for ancestor in reversed(resource.ancestors()):
+            count = transaction.fine_locks[ancestor] = transaction.fine_locks.get(ancestor, 0) + 1
+            if count % self.escalation_threshold == 0:
+                candidates.append(ancestor)
+        for ancestor in candidates:
+            mode = "write" if self.locks.held_mode(transaction_id, ancestor) in ("IX", "SIX") else "read"
+            if not self.locks.acquire_lock(transaction_id, ancestor, mode):
+                logger.debug("Transaction %s could not escalate its locks to %s.", transaction_id, ancestor)
+                continue
+            covered = [held for held in self.locks.get_held_resources(transaction_id)
+                       if ancestor in held.ancestors()]
+            self.locks.release_lock(transaction_id, covered)
+            self._count("escalations")
+            logger.debug("Transaction %s escalated %d locks to a %s lock on %s.",
+                         transaction_id, len(covered), mode, ancestor)
+            return
+
+    def _finish_request(self, transaction_id, granted, waits):
+        if waits and self.conflict_policy == "detection":
+            self.wait_for_graph.remove_waits(transaction_id)
+        if not granted and not waits and self.conflict_policy == "no-wait":
+            self._count("aborts", "no-wait")
+        return granted
+
+    def _age(self, transaction_id):
+        """
+        Key ordering transactions from the oldest to the youngest, ties broken by ID.
+        """
+        return self._start_timestamp(transaction_id), str(transaction_id)
+
+    def _wait_callback(self, transaction_id, resource):
+        """
+        Build the callback applying the conflict policy to a queued lock request, called
+        with the transactions it waits for.
+        :return: The callback and a list recording whether it was called.
+        """
+        waits = []
+
+        def detect(blockers):
+            # Add to wait-for graph while the lock cannot be granted, resolving at once
+            # any deadlock closed by the new edges
+            for holder in blockers:
+                logger.debug("Transaction %s waiting for %s on resource %s.", transaction_id, holder, resource)
+                cycle = self.wait_for_graph.add_edge(transaction_id, holder)
+                if cycle and self.resolve_deadlock(cycle) == transaction_id:
+                    break
+
+        def wait_die(blockers):
+            # An older transaction waits for younger ones, a younger one dies
+            age = self._age(transaction_id)
+            if any(self._age(blocker) < age for blocker in blockers):
+                logger.debug("Transaction %s dies on resource %s.", transaction_id, resource)
+                self._count("aborts", "die")
+                self.locks.cancel_wait(transaction_id)
+
+        def wound_wait(blockers):
+            # An older transaction wounds the younger ones in its way, a younger one waits.
+            # A wounded transaction may still be reading and writing under its locks, so it keeps
+            # them until it aborts, at its next lock request or its commit; a queued request of
+            # it is refused at once.
+            age = self._age(transaction_id)
+            for blocker in blockers:
+                # A transaction that already prepared its commit is not wounded
+                if self._age(blocker) > age and self.transactions.transition(blocker, ("active",), "wounded"):
+                    logger.debug("Transaction %s wounds %s on resource %s.", transaction_id, blocker, resource)
+                    self._count("aborts", "wound")
+                    self.locks.cancel_wait(blocker)
+
+        apply_policy = {"detection": detect, "wait-die": wait_die, "wound-wait": wound_wait}.get(self.conflict_policy)
+
+        def on_wait(blockers):
+            waits.append(blockers)
+            self._count("waits")
+            if apply_policy is not None:
+                apply_policy(blockers)
+
+        return on_wait, waits
+
+    def release_locks(self, transaction_id):
+        """
+        Cancel the pending request of a transaction, release all its locks and remove it
+        from the wait-for graph.
+        """
+        self.locks.cancel_wait(transaction_id)
+        self.locks.release_locks(transaction_id)
+        self.wait_for_graph.remove_transaction(transaction_id)
+
+    async def release_locks_async(self, transaction_id):
+        self.release_locks(transaction_id)
+
+    def resolve_deadlock(self, transactions):
+        """
+        Resolve a deadlock by aborting the transaction of the cycle, or of the strongly connected
+        component, that is cheapest to undo (see _undo_cost). Its pending lock request is
+        cancelled and all its locks are released, which lets the rest of the cycle proceed.
+        The transaction rolls itself back once its lock request fails.
+        :return: The ID of the aborted transaction.
+        """
+        transaction_to_abort = min(transactions, key=self._undo_cost)
+        logger.warning("Deadlock detected among %s, aborting transaction %s.", list(transactions), transaction_to_abort)
+        self._count("aborts", "deadlock")
+        self.transactions.update_status(transaction_to_abort, "aborted")
+        self.release_locks(transaction_to_abort)
+        return transaction_to_abort
+
+    def _undo_cost(self, transaction_id):
+        """
+        Key ordering deadlocked transactions by the estimated cost of aborting them: the log
+        records to undo first, then the locks to give up, then the age, the youngest being
+        the cheapest to redo.
+        """
+        transaction = self.transactions.get_transaction(transaction_id)
+        held = len(self.locks.get_held_resources(transaction_id))
+        if transaction is None:
+            return 0, held, 0
+        return transaction.log_records, held, -transaction.timestamp
+
+    def _start_timestamp(self, transaction_id):
+        transaction = self.transactions.get_transaction(transaction_id)
+        return transaction.timestamp if transaction else 0
+
+    def check_deadlock(self):
+        """
+        Resolve every deadlock of the whole wait-for graph in one pass: each strongly connected
+        component loses its cheapest transaction, then the rest of the component is searched
+        again, until no cycle is left.
+        :return: The IDs of the aborted transactions, empty if there was no deadlock.
+        """
+        victims = []
+        components = self.wait_for_graph.find_deadlocks()
+        while components:
+            component = components.pop()
+            victim = self.resolve_deadlock(component)
+            victims.append(victim)
+            components.extend(self.wait_for_graph.find_deadlocks(component - {victim}))
+        return victims
+
+    def snapshot(self, parts=("locks", "transactions", "wait_for", "contended"), top=10):
+        """
+        Return copies of the concurrency control state, for introspection: the lock table
+        ("locks"), the transactions with their age and status ("transactions"), the edges of
+        the wait-for graph ("wait_for"), the top most contended resources ("contended"), the
+        most recently finished transactions ("history") and the accounting of the conflict
+        policy ("conflicts").
+        Each part is consistent on its own, copied under its own locks, which are held only
+        while copying. The parts are copied one after the other, so they may not match: e.g.
+        a transaction may appear in the lock table but have finished in "transactions".
+        """
+        snapshot = {}
+        if "locks" in parts:
+            snapshot["locks"] = self.locks.get_locks()
+        if "transactions" in parts:
+            snapshot["transactions"] = self.transactions.get_transactions()
+        if "wait_for" in parts:
+            snapshot["wait_for"] = self.wait_for_graph.get_edges()
+        if "contended" in parts:
+            snapshot["contended"] = self.locks.get_contended_resources(top)
+        if "history" in parts:
+            snapshot["history"] = self.transactions.get_history()
+        if "conflicts" in parts:
+            with self.conflicts_lock:
+                snapshot["conflicts"] = dict(self.conflicts, policy=self.conflict_policy,
+                                             aborts=dict(self.conflicts["aborts"]))
+        return snapshot
@@ -0,0 +1,128 @@
+import socket
+import struct
+
+from transactions.ResourceKey import ResourceKey
+
+# Every frame is a header followed by a payload of header.length bytes. Requests carry the
+# operation in the code field, responses carry a status. Responses are matched to their
+# requests by request ID, so a client can pipeline requests on a connection and receive the
+# responses out of order. Request ID 0 marks a request whose response is not wanted.
+HEADER = struct.Struct("!IIB")  # length, request ID, code
+
+# Operations
+BEGIN = 1
+ACQUIRE = 2
+RELEASE = 3
+GET_STATUS = 4
+SET_STATUS = 5
+CHECK_DEADLOCK = 6
+PING = 7
+SNAPSHOT = 8
+TRANSITION_STATUS = 9
+
+# Response statuses
+OK = 0
+ERROR = 1
+
+_INT = struct.Struct("!q")
+_FLOAT = struct.Struct("!d")
+_LENGTH = struct.Struct("!I")
+
+
+def encode_value(value, out):
+    """
+    Append the binary encoding of a value to a bytearray. Supported values are None, booleans,
+    integers, floats, strings, resource keys, lists, tuples, sets and dictionaries of them.
+    """
+    if value is None:
+        out += b"N"
+    elif value is True:
+        out += b"T"
+    elif value is False:
+        out += b"F"
+    elif isinstance(value, int):
+        out += b"i" + _INT.pack(value)
+    elif isinstance(value, float):
+        out += b"f" + _FLOAT.pack(value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out += b"s" + _LENGTH.pack(len(data)) + data
+    elif isinstance(value, ResourceKey):
+        out += b"r"
+        encode_value(value.table, out)
+        encode_value(value.record_id, out)
+    elif isinstance(value, dict):
+        out += b"d" + _LENGTH.pack(len(value))
+        for key, item in value.items():
+            encode_value(key, out)
+            encode_value(item, out)
+    elif isinstance(value, (list, tuple, set)):
+        out += {list: b"l", tuple: b"t"}.get(type(value), b"l") + _LENGTH.pack(len(value))
+        for item in value:
+            encode_value(item, out)
+    else:
+        raise TypeError(f"Cannot encode {type(value).__name__} in a lock server frame.")
+
+
+def decode_value(data, offset=0):
+    """
+    Decode the value encoded at an offset of a buffer.
+    :return: The value and the offset following it.
+    """
+    tag = data[offset:offset + 1]
+    offset += 1
+    if tag == b"N":
+        return None, offset
+    if tag == b"T":
+        return True, offset
+    if tag == b"F":
+        return False, offset
+    if tag == b"i":
+        return _INT.unpack_from(data, offset)[0], offset + _INT.size
+    if tag == b"f":
+        return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+    if tag == b"s":
+        length = _LENGTH.unpack_from(data, offset)[0]
+        offset += _LENGTH.size
+        return bytes(data[offset:offset + length]).decode("utf-8"), offset + length
+    if tag == b"r":
+        table, offset = decode_value(data, offset)
+        record_id, offset = decode_value(data, offset)
+        return ResourceKey(table, record_id), offset
+    if tag == b"d":
+        count = _LENGTH.unpack_from(data, offset)[0]
+        offset += _LENGTH.size
+        value = {}
+        for _ in range(count):
+            key, offset = decode_value(data, offset)
+            value[key], offset = decode_value(data, offset)
+        return value, offset
+    if tag in (b"l", b"t"):
+        count = _LENGTH.unpack_from(data, offset)[0]
+        offset += _LENGTH.size
+        items = []
+        for _ in range(count):
+            item, offset = decode_value(data, offset)
+            items.append(item)
+        return (tuple(items) if tag == b"t" else items), offset
+    raise ValueError(f"Unknown value tag {tag!r} in a lock server frame.")
+
+
+def encode_frame(request_id, code, value):
+    """
+    Encode a request or response frame carrying a value.
+    """
+    payload = bytearray()
+    encode_value(value, payload)
+    return HEADER.pack(len(payload), request_id, code) + payload
+
+
+def parse_address(address):
+    """
+    Parse a lock server address: 'unix:/path/to/socket' or 'host:port'.
+    :return: The socket family and the address in the form the socket module expects.
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
@@ -0,0 +1,128 @@
+"""
+Lock server daemon: a single LockManager shared by every worker process of the API, so
+strict two-phase locking and deadlock detection hold across processes. Run with:
+
+    python -m transactions.LockServer unix:/tmp/photobooking-locks.sock
+    python -m transactions.LockServer 127.0.0.1:7070 --policy wait-die
+
+and start the API workers with PHOTOBOOKING_LOCK_SERVER set to the same address.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+
+from transactions import LockProtocol as protocol
+from transactions.LockManager import CONFLICT_POLICIES, LockManager
+from transactions.Tracing import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+class LockServer:
+    def __init__(self, lock_manager=None):
+        """
+        Serve a LockManager over the lock server protocol. All requests run on one event
+        loop: lock waits are coroutines, every other operation completes without waiting.
+        The transactions begun on a connection are aborted when the connection closes
+        without ending them, so a crashed worker cannot leave its locks behind.
+        """
+        self.lock_manager = lock_manager or LockManager()
+
+    def handle(self, code, args, owned):
+        """
+        Run a non-blocking operation.
+        :return: The result sent back to the client.
+        """
+        if code == protocol.BEGIN:
+            owned.add(args[0])
+            return self.lock_manager.start_transaction(args[0])
+        if code == protocol.RELEASE:
+            owned.discard(args[0])
+            return self.lock_manager.release_locks(args[0])
+        if code == protocol.GET_STATUS:
+            return self.lock_manager.get_status(args[0])
+        if code == protocol.SET_STATUS:
+            return self.lock_manager.update_status(args[0], args[1])
+        if code == protocol.TRANSITION_STATUS:
+            return self.lock_manager.transition_status(args[0], args[1], args[2])
+        if code == protocol.CHECK_DEADLOCK:
+            return self.lock_manager.check_deadlock()
+        if code == protocol.SNAPSHOT:
+            return self.lock_manager.snapshot(*args)
+        if code == protocol.PING:
+            return "pong"
+        raise ValueError(f"Unknown operation {code}.")
+
+    async def acquire(self, request_id, args, writer):
+        try:
+            granted = await self.lock_manager.acquire_lock_async(*args)
+            response = protocol.encode_frame(request_id, protocol.OK, granted)
+        except Exception as e:
+            response = protocol.encode_frame(request_id, protocol.ERROR, str(e))
+        if not writer.is_closing():
+            writer.write(response)
+
+    async def handle_connection(self, reader, writer):
+        owned = set()  # Transactions begun on this connection and not yet released
+        waits = set()
+        try:
+            while True:
+                length, request_id, code = protocol.HEADER.unpack(await reader.readexactly(protocol.HEADER.size))
+                args, _ = protocol.decode_value(await reader.readexactly(length))
+
+                if code == protocol.ACQUIRE:
+                    task = asyncio.create_task(self.acquire(request_id, args, writer))
+                    waits.add(task)
+                    task.add_done_callback(waits.discard)
+                    # Let the request queue up before reading the next frame, so the operations
+                    # of a connection take effect in the order they were sent
+                    await asyncio.sleep(0)
+                    continue
+
+                try:
+                    response = protocol.encode_frame(request_id, protocol.OK, self.handle(code, args, owned))
+                except Exception as e:
+                    response = protocol.encode_frame(request_id, protocol.ERROR, str(e))
+                if request_id:
+                    writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in list(waits):
+                task.cancel()
+            for transaction_id in owned:
+                if self.lock_manager.get_status(transaction_id) not in ("committed", "aborted"):
+                    self.lock_manager.update_status(transaction_id, "aborted")
+                self.lock_manager.release_locks(transaction_id)
+            writer.close()
+
+    async def serve(self, address):
+        family, location = protocol.parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(location):
+                os.remove(location)
+            server = await asyncio.start_unix_server(self.handle_connection, location)
+        else:
+            server = await asyncio.start_server(self.handle_connection, *location)
+        logger.info("Lock server listening on %s.", address)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lock server shared by the API worker processes.")
+    parser.add_argument("address", nargs="?", default=os.environ.get("PHOTOBOOKING_LOCK_SERVER", "127.0.0.1:7070"),
+                        help="unix:/path/to/socket or host:port")
+    parser.add_argument("--policy", choices=CONFLICT_POLICIES,
+                        default=os.environ.get("PHOTOBOOKING_CONFLICT_POLICY", "detection"),
+                        help="How lock conflicts are handled (default detection).")
+    parser.add_argument("--escalation-threshold", type=int,
+                        default=int(os.environ.get("PHOTOBOOKING_LOCK_ESCALATION_THRESHOLD", "200")),
+                        help="Locks of a transaction below one resource escalated to a lock on it (default 200, "
+                             "0 disables escalation).")
+    args = parser.parse_args()
+    configure_logging()
+    asyncio.run(LockServer(LockManager(args.policy, args.escalation_threshold)).serve(args.address))
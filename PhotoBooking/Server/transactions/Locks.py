@@ -1,46 +1,528 @@
-from threading import Lock
+import asyncio
+import heapq
+from collections import deque
+from threading import Condition, Lock
+import time
+
+# Lock modes, from the weakest: intention shared, intention exclusive, shared (read), shared
+# with intention exclusive and exclusive (write). The intention modes are taken on the
+# ancestors of a resource in the lock hierarchy (see ResourceKey) before the resource itself.
+LOCK_MODES = ("IS", "IX", "read", "SIX", "write")
+
+# Lock compatibility matrix: (held mode, requested mode) -> can both be held at the same time
+COMPATIBILITY = {
+    (held, requested): requested in compatible
+    for held, compatible in {
+        "IS": ("IS", "IX", "read", "SIX"),
+        "IX": ("IS", "IX"),
+        "read": ("IS", "read"),
+        "SIX": ("IS",),
+        "write": (),
+    }.items()
+    for requested in LOCK_MODES
+}
+
+# Rights granted by each mode, as the modes it implies
+IMPLIED_MODES = {
+    "IS": {"IS"},
+    "IX": {"IS", "IX"},
+    "read": {"IS", "read"},
+    "SIX": {"IS", "IX", "read", "SIX"},
+    "write": set(LOCK_MODES),
+}
+
+# (held mode, requested mode) -> weakest mode implying both, which a transaction asking for a
+# second mode on a resource ends up holding (e.g. IX and read give SIX)
+SUPREMUM = {
+    (held, requested): next(
+        mode for mode in LOCK_MODES if IMPLIED_MODES[held] | IMPLIED_MODES[requested] <= IMPLIED_MODES[mode]
+    )
+    for held in LOCK_MODES
+    for requested in LOCK_MODES
+}
+
+
+# Resources whose waits are kept in the contention statistics of a shard. Past it, the
+# resource that waited the least is forgotten, so the statistics keep the most contended
+# resources without growing with every resource ever waited on.
+CONTENTION_ENTRIES_PER_SHARD = 64
+
+
+class LockShard:
+    __slots__ = ("entries", "lock", "contention")
 
-class Locks:
     def __init__(self):
         """
-        Locks are stored in a dictionary with resources as keys, and each value is
-        a dictionary containing the transaction ID and lock type (read/write)
+        One stripe of a table striped by hash, guarded by its own mutex.
         """
-        self.locks = {}  # Resource -> {transaction_id, lock_type}
+        self.entries = {}
         self.lock = Lock()
+        self.contention = {}  # Resource -> [number of queued requests, total seconds waited]
+
 
-    def acquire_lock(self, transaction_id, resource, lock_type):
+class LockRequest:
+    __slots__ = ("transaction_id", "resource", "lock_type", "granted", "cancelled", "condition", "waker", "since")
+
+    def __init__(self, transaction_id, resource, lock_type, shard_lock, waker=None):
         """
-        Attempt to acquire a lock on a resource for a specific transaction.
-        If the resource is not currently locked, grant the lock.
-        If the resource is already locked by the same transaction, check if the lock type is compatible.
-        Deny the lock if the resource is held by another transaction.
+        A pending lock request queued on a resource. The condition shares the mutex of
+        the resource's shard, so the waiting thread can be woken on its own when the
+        request is granted or cancelled. A request made from an event loop has no waiting
+        thread: it passes a waker instead, called with the shard lock held.
         """
-        with self.lock:
-            if resource not in self.locks:
-                # Grant the lock
-                self.locks[resource] = {"transaction_id": transaction_id, "lock_type": lock_type}
-                return True
+        self.transaction_id = transaction_id
+        self.resource = resource
+        self.lock_type = lock_type
+        self.granted = False
+        self.cancelled = False
+        self.condition = Condition(shard_lock) if waker is None else None
+        self.waker = waker
+        self.since = time.monotonic()
+
+    def wake(self):
+        if self.waker is None:
+            self.condition.notify()
+        else:
+            self.waker()
+
+
+class Locks:
+    def __init__(self, shard_count=64):
+        """
+        Locks are stored in a table striped across independently locked shards, keyed by
+        the hash of the resource. Each value is a dictionary containing the transactions
+        holding it with their mode (see LOCK_MODES), the number of holders of each mode and
+        a FIFO queue of waiting requests. A mode can be held next to the modes it is
+        compatible with: a read (shared) lock by several transactions at once, a write
+        (exclusive) lock by a single transaction.
+        A reverse index, striped by transaction, maps each transaction to the resources it
+        holds, with their mode, and to the request it is waiting on, so a commit releases its
+        locks without scanning the whole table. A resource shard may be locked before an
+        index shard, never the other way round.
+        """
+        self.shards = [LockShard() for _ in range(shard_count)]  # Resource -> {holders, modes, queue}
+        self.index_shards = [LockShard() for _ in range(shard_count)]  # TransactionID -> {held, waiting}
+
+    def _shard(self, resource):
+        return self.shards[hash(resource) % len(self.shards)]
+
+    def _index_shard(self, transaction_id):
+        return self.index_shards[hash(transaction_id) % len(self.index_shards)]
+
+    @staticmethod
+    def is_compatible(held_type, requested_type):
+        """
+        Check the compatibility matrix for a held and a requested lock type.
+        """
+        return COMPATIBILITY[(held_type, requested_type)]
+
+    @staticmethod
+    def group_mode(current_lock):
+        """
+        Return the weakest mode implying the modes of all holders of a lock, or None if it
+        has no holders.
+        """
+        group = None
+        for mode, count in current_lock["modes"].items():
+            if count:
+                group = mode if group is None else SUPREMUM[group, mode]
+        return group
 
-            # Check if the lock is compatible
-            current_lock = self.locks[resource]
-            if current_lock["transaction_id"] == transaction_id:
-                # Transaction already holds the lock
+    def _can_grant(self, current_lock, transaction_id, lock_type):
+        """
+        Decide whether a lock of the given type can be granted next to the current holders.
+        A holder asking for a mode it already has (or a weaker one) is always granted. Otherwise
+        a holder converts its lock to the weakest mode implying both, e.g. a read lock upgraded
+        to a write lock, which is only granted once it is compatible with the other holders.
+        """
+        held = current_lock["holders"].get(transaction_id)
+        if held is not None:
+            lock_type = SUPREMUM[held, lock_type]
+            if lock_type == held:
                 return True
+        for mode, count in current_lock["modes"].items():
+            others = count - 1 if mode == held else count
+            if others and not COMPATIBILITY[mode, lock_type]:
+                return False
+        return True
+
+    @staticmethod
+    def _grant(current_lock, transaction_id, lock_type):
+        """
+        Add a transaction to the holders of a lock, or convert the mode it holds.
+        Must be called with the resource's shard lock held.
+        :return: The mode now held by the transaction.
+        """
+        holders, modes = current_lock["holders"], current_lock["modes"]
+        held = holders.get(transaction_id)
+        if held is not None:
+            lock_type = SUPREMUM[held, lock_type]
+            if lock_type == held:
+                return held
+            modes[held] -= 1
+        holders[transaction_id] = lock_type
+        modes[lock_type] = modes.get(lock_type, 0) + 1
+        return lock_type
+
+    @staticmethod
+    def _remove_holder(current_lock, transaction_id):
+        """
+        Remove a transaction from the holders of a lock. Must be called with the resource's
+        shard lock held.
+        """
+        mode = current_lock["holders"].pop(transaction_id, None)
+        if mode is not None:
+            current_lock["modes"][mode] -= 1
+
+    def _index(self, transaction_id, resource=None, waiting=None, mode=None):
+        """
+        Record a granted resource and its mode, or the request being waited on, in the reverse index.
+        """
+        index_shard = self._index_shard(transaction_id)
+        with index_shard.lock:
+            entry = index_shard.entries.setdefault(transaction_id, {"held": {}, "waiting": None})
+            if resource is not None:
+                entry["held"][resource] = mode
+            if waiting is not None:
+                entry["waiting"] = waiting
 
-            # Lock is held by another transaction
-            return False
+    def _clear_waiting(self, transaction_id):
+        """
+        Forget the request a transaction was waiting on once the wait is over.
+        """
+        index_shard = self._index_shard(transaction_id)
+        with index_shard.lock:
+            entry = index_shard.entries.get(transaction_id)
+            if entry is None:
+                return
+            entry["waiting"] = None
+            if not entry["held"]:
+                del index_shard.entries[transaction_id]
+
+    def _grant_waiters(self, resource, current_lock):
+        """
+        Grant queued requests in FIFO order for as long as the head of the queue is
+        compatible with the holders, and wake every granted waiter.
+        Must be called with the resource's shard lock held.
+        """
+        queue = current_lock["queue"]
+        while queue and self._can_grant(current_lock, queue[0].transaction_id, queue[0].lock_type):
+            request = queue.popleft()
+            mode = self._grant(current_lock, request.transaction_id, request.lock_type)
+            self._index(request.transaction_id, resource, mode=mode)
+            request.granted = True
+            request.wake()
+
+    def _request(self, transaction_id, resource, lock_type, queue, waker=None):
+        """
+        Grant a lock at once if possible, otherwise queue the request if 'queue' is set.
+        :return: (granted, request, blockers), where request is the queued request and
+                 blockers the transactions it waits for, both None if it was not queued.
+        """
+        shard = self._shard(resource)
+        with shard.lock:
+            current_lock = shard.entries.get(resource)
+            if current_lock is None:
+                current_lock = {"holders": {}, "modes": {}, "queue": deque()}
+                shard.entries[resource] = current_lock
+
+            is_holder = transaction_id in current_lock["holders"]
+            if (is_holder or not current_lock["queue"]) and self._can_grant(current_lock, transaction_id, lock_type):
+                # Grant the lock
+                mode = self._grant(current_lock, transaction_id, lock_type)
+                self._index(transaction_id, resource, mode=mode)
+                return True, None, None
+
+            if not queue:
+                if not current_lock["holders"] and not current_lock["queue"]:
+                    del shard.entries[resource]
+                return False, None, None
+
+            # Queue the request, upgrades ahead of the other waiters
+            request = LockRequest(transaction_id, resource, lock_type, shard.lock, waker)
+            blockers = self._blockers(current_lock, transaction_id, lock_type)
+            if is_holder:
+                current_lock["queue"].appendleft(request)
+            else:
+                current_lock["queue"].append(request)
+            self._index(transaction_id, waiting=request)
+            return False, request, blockers
+
+    def acquire_lock(self, transaction_id, resource, lock_type, timeout=0, on_wait=None):
+        """
+        Attempt to acquire a lock on a resource for a specific transaction.
+        The lock is granted at once if it is compatible with the current holders and no other
+        transaction is queued ahead. A transaction that already holds the resource ends up with
+        the weakest mode implying both; a conversion to a stronger mode, e.g. a shared ->
+        exclusive upgrade, goes to the front of the queue and is granted once the conflicting
+        holders are gone.
+        Otherwise the request is appended to the resource's FIFO queue and the caller blocks
+        until the request is granted, cancelled, or the timeout (in seconds) expires.
+        With a timeout of 0 the call fails fast instead of queueing.
+        :param on_wait: Optional callback invoked with the blocking transactions before waiting.
+        :return: True if the lock was granted, False otherwise.
+        """
+        granted, request, blockers = self._request(transaction_id, resource, lock_type, timeout is None or timeout > 0)
+        if request is None:
+            return granted
+
+        if on_wait is not None:
+            on_wait(blockers)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        shard = self._shard(resource)
+        with shard.lock:
+            while not request.granted and not request.cancelled:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                request.condition.wait(remaining)
+
+            if not request.granted:
+                # Timed out or cancelled: leave the queue and let the requests behind proceed
+                self._dequeue(resource, request)
+            self._record_wait(shard, request)
+
+        self._clear_waiting(transaction_id)
+        return request.granted
+
+    async def acquire_lock_async(self, transaction_id, resource, lock_type, timeout=0, on_wait=None):
+        """
+        Asyncio version of acquire_lock, with the same queueing and timeout semantics.
+        A queued request suspends the calling coroutine instead of blocking its thread, so
+        any number of requests can wait on a single event loop. The thread granting or
+        cancelling the request wakes the coroutine through the loop.
+        :return: True if the lock was granted, False otherwise.
+        """
+        loop = asyncio.get_running_loop()
+        woken = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: woken.done() or woken.set_result(None))
+
+        granted, request, blockers = self._request(
+            transaction_id, resource, lock_type, timeout is None or timeout > 0, wake
+        )
+        if request is None:
+            return granted
+
+        if on_wait is not None:
+            on_wait(blockers)
+
+        try:
+            await asyncio.wait_for(woken, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # Also runs if the coroutine is cancelled while it waits
+            shard = self._shard(resource)
+            with shard.lock:
+                if not request.granted:
+                    self._dequeue(resource, request)
+                self._record_wait(shard, request)
+            self._clear_waiting(transaction_id)
+        return request.granted
+
+    @staticmethod
+    def _record_wait(shard, request):
+        """
+        Count a finished wait in the contention statistics of its resource.
+        Must be called with the shard lock held.
+        """
+        contention = shard.contention.get(request.resource)
+        if contention is None:
+            if len(shard.contention) >= CONTENTION_ENTRIES_PER_SHARD:
+                del shard.contention[min(shard.contention, key=lambda resource: shard.contention[resource][1])]
+            contention = shard.contention[request.resource] = [0, 0.0]
+        contention[0] += 1
+        contention[1] += time.monotonic() - request.since
+
+    @staticmethod
+    def _blockers(current_lock, transaction_id, lock_type):
+        """
+        Return the transactions a new request would wait for: the incompatible holders and,
+        unless the request converts a lock the transaction holds, by FIFO order the
+        transactions already queued on the resource.
+        """
+        held = current_lock["holders"].get(transaction_id)
+        wanted = lock_type if held is None else SUPREMUM[held, lock_type]
+        blockers = [tid for tid, mode in current_lock["holders"].items()
+                    if tid != transaction_id and not COMPATIBILITY[mode, wanted]]
+        if held is None:
+            blockers.extend(request.transaction_id for request in current_lock["queue"]
+                            if request.transaction_id != transaction_id)
+        return list(dict.fromkeys(blockers))
+
+    def _dequeue(self, resource, request):
+        """
+        Remove a request that will not be granted from its queue. Must be called with the
+        resource's shard lock held.
+        """
+        shard = self._shard(resource)
+        current_lock = shard.entries.get(resource)
+        if current_lock is None:
+            return
+        if request in current_lock["queue"]:
+            current_lock["queue"].remove(request)
+        self._grant_waiters(resource, current_lock)
+        if not current_lock["holders"] and not current_lock["queue"]:
+            del shard.entries[resource]
+
+    def cancel_wait(self, transaction_id):
+        """
+        Cancel the request a transaction is blocked on, waking its thread with a refusal.
+        """
+        index_shard = self._index_shard(transaction_id)
+        with index_shard.lock:
+            entry = index_shard.entries.get(transaction_id)
+            request = entry["waiting"] if entry else None
+        if request is None:
+            return
+
+        shard = self._shard(request.resource)
+        with shard.lock:
+            if request.granted or request.cancelled:
+                return
+            request.cancelled = True
+            self._dequeue(request.resource, request)
+            request.wake()
+
+    def get_conflicting_holders(self, transaction_id, resource, lock_type):
+        """
+        Return the transactions that prevent the given transaction from obtaining
+        a lock of the requested type on a resource.
+        """
+        shard = self._shard(resource)
+        with shard.lock:
+            current_lock = shard.entries.get(resource)
+            if not current_lock:
+                return []
+            return self._blockers(current_lock, transaction_id, lock_type)
+
+    def get_held_resources(self, transaction_id):
+        """
+        Return the resources currently locked by a transaction.
+        """
+        index_shard = self._index_shard(transaction_id)
+        with index_shard.lock:
+            entry = index_shard.entries.get(transaction_id)
+            return set(entry["held"]) if entry else set()
+
+    def held_mode(self, transaction_id, resource):
+        """
+        Return the mode in which a transaction holds a resource, or None.
+        """
+        index_shard = self._index_shard(transaction_id)
+        with index_shard.lock:
+            entry = index_shard.entries.get(transaction_id)
+            return entry["held"].get(resource) if entry else None
+
+    def held_modes(self, transaction_id, resources):
+        """
+        Return the modes in which a transaction holds each of the resources, None for those it
+        does not hold, looked up under a single lock of the reverse index.
+        """
+        index_shard = self._index_shard(transaction_id)
+        with index_shard.lock:
+            entry = index_shard.entries.get(transaction_id)
+            if entry is None:
+                return [None] * len(resources)
+            held = entry["held"]
+            return [held.get(resource) for resource in resources]
+
+    def release_lock(self, transaction_id, resources):
+        """
+        Release some of the locks held by a transaction before it ends, which is only safe
+        under two-phase locking when another lock of the transaction covers them, as after
+        a lock escalation.
+        """
+        index_shard = self._index_shard(transaction_id)
+        with index_shard.lock:
+            entry = index_shard.entries.get(transaction_id)
+            if entry is None:
+                return
+            for resource in resources:
+                entry["held"].pop(resource, None)
+        for resource in resources:
+            self._release(transaction_id, resource)
+
+    def _release(self, transaction_id, resource):
+        """
+        Remove a transaction from the holders of a resource, grant the waiters it was blocking
+        and drop the resource from the table once it has neither holders nor waiters.
+        """
+        shard = self._shard(resource)
+        with shard.lock:
+            current_lock = shard.entries.get(resource)
+            if current_lock is None:
+                return
+            self._remove_holder(current_lock, transaction_id)
+            self._grant_waiters(resource, current_lock)
+            if not current_lock["holders"] and not current_lock["queue"]:
+                del shard.entries[resource]
 
     def release_locks(self, transaction_id):
         """
-        Release all locks held by a specific transaction. Iterate through the lock
-        dictionary to find and remove all resources locked by the transaction.
+        Release all locks held by a specific transaction. The reverse index gives the
+        resources to release, so the cost depends only on the number of locks held by
+        the transaction. Waiters queued on a released resource are granted in FIFO order,
+        and a resource without holders or waiters is removed from the table.
         """
-        with self.lock:
-            resources_to_release = [res for res, lock in self.locks.items() if lock["transaction_id"] == transaction_id]
-            for resource in resources_to_release:
-                del self.locks[resource]
+        index_shard = self._index_shard(transaction_id)
+        with index_shard.lock:
+            entry = index_shard.entries.pop(transaction_id, None)
+        if entry is None:
+            return
+
+        for resource in entry["held"]:
+            self._release(transaction_id, resource)
 
     def get_locks(self):
-        with self.lock:
-            return self.locks
+        """
+        Return a copy of the lock table, with the queued requests in FIFO order and the
+        number of seconds each has been waiting. All shards are locked, in order, while the
+        entries are copied, so the copy is a consistent state of the whole table. No shard
+        lock is ever taken while another one is held, so this cannot deadlock.
+        """
+        for shard in self.shards:
+            shard.lock.acquire()
+        try:
+            entries = [
+                (resource, self.group_mode(lock), list(lock["holders"].items()),
+                 [(request.transaction_id, request.lock_type, request.since) for request in lock["queue"]])
+                for shard in self.shards
+                for resource, lock in shard.entries.items()
+            ]
+        finally:
+            for shard in reversed(self.shards):
+                shard.lock.release()
+        now = time.monotonic()
+        return {
+            resource: {
+                "lock_type": lock_type,
+                "holders": [
+                    {"transaction_id": transaction_id, "lock_type": held} for transaction_id, held in holders
+                ],
+                "waiting": [
+                    {"transaction_id": transaction_id, "lock_type": requested, "waiting_seconds": now - since}
+                    for transaction_id, requested, since in queue
+                ],
+            }
+            for resource, lock_type, holders, queue in entries
+        }
+
+    def get_contended_resources(self, top=10):
+        """
+        Return the resources whose lock requests waited the most, ordered by total waiting time.
+        Requests still waiting are counted once they are granted, cancelled or timed out. Every
+        shard keeps at most CONTENTION_ENTRIES_PER_SHARD resources, so a resource that waited
+        little may have been forgotten.
+        """
+        contention = []
+        for shard in self.shards:
+            with shard.lock:
+                contention.extend((resource, waits, seconds) for resource, (waits, seconds) in shard.contention.items())
+        return [
+            {"resource": resource, "waits": waits, "total_wait_seconds": seconds}
+            for resource, waits, seconds in heapq.nlargest(top, contention, key=lambda item: item[2])
+        ]
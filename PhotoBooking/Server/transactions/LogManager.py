@@ -1,56 +1,393 @@
+import asyncio
+import itertools
 import os
 import json
+import logging
+import time
+import zlib
+from threading import Condition, Lock
+
+from transactions.Metrics import metrics
+from transactions.Tracing import tracer
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+LOG_APPEND_SECONDS = metrics.histogram(
+    "photobooking_log_append_seconds", "Time to append a log entry, until it is durable."
+)
+LOG_FSYNC_SECONDS = metrics.histogram("photobooking_log_fsync_seconds", "Duration of the fsync of a log segment.")
+
 
 class LogManager:
-    def __init__(self, log_dir="logs"):
+    def __init__(self, log_dir="logs", segment_size=16 * 1024 * 1024):
         """
         Initialize the LogManager to handle transaction logs.
-        Logs are stored in JSON files, one per transaction, within the specified directory.
+        All transactions share a single append-only write-ahead log, split into segment files
+        of about segment_size bytes within the specified directory. Every record is a JSON line
+        prefixed with its length and CRC32 checksum, so a torn write at the end of a segment
+        can be told apart from a valid record.
+        The records of a transaction are found through an in-memory index of their offsets.
+        Segments older than the oldest active transaction are deleted at every checkpoint,
+        which is taken whenever a segment fills up and after recovery.
+        A log directory belongs to a single process, which holds an exclusive lock on its
+        owner.lock file. When the directory is held by another live process, e.g. another
+        worker of the API, the first free directory among log_dir.1, log_dir.2, ... is used
+        instead. A worker replacing a crashed one thus takes over, and recovers, its log.
         """
         project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-        self.log_dir = os.path.join(project_root, log_dir)
-        os.makedirs(self.log_dir, exist_ok=True)
+        self.log_dir, self.owner_file = self.claim_directory(os.path.join(project_root, log_dir))
+        self.segment_size = segment_size
+
+        self.index = {}  # TransactionID -> list of (segment, offset) of its update records
+        self.begin_segments = {}  # TransactionID -> segment holding its begin record
+        self.lock = Lock()  # Guards the active segment, the index and the sequence numbers
+
+        # Group commit: the first appender needing durability flushes and fsyncs for everyone
+        # whose records were written before it, the others wait for that fsync to complete
+        self.sync_condition = Condition()
+        self.syncing = False
+        self.written_lsn = 0  # Sequence number of the last record written
+        self.durable_lsn = 0  # Sequence number of the last record known to be on disk
+
+        segments = self.list_segments()
+        self.segment = (segments[-1] + 1) if segments else 1
+        self.file = open(self.segment_path(self.segment), "ab")
+
+    @staticmethod
+    def claim_directory(log_dir):
+        """
+        Lock the first log directory not held by another process, creating it if needed.
+        The lock is released by the operating system when the process exits.
+        :return: The path of the directory and the open owner.lock file holding the lock.
+        """
+        for slot in itertools.count():
+            directory = log_dir if slot == 0 else f"{log_dir}.{slot}"
+            os.makedirs(directory, exist_ok=True)
+            owner_file = open(os.path.join(directory, "owner.lock"), "a+b")
+            try:
+                if fcntl is not None:
+                    fcntl.flock(owner_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(owner_file.fileno(), msvcrt.LK_NBLCK, 1)
+            except OSError:
+                owner_file.close()
+                continue
+            if slot:
+                logger.info("Log directory %s is held by another process, using %s.", log_dir, directory)
+            return directory, owner_file
+
+    def segment_path(self, segment):
+        return os.path.join(self.log_dir, f"wal_{segment:08d}.log")
+
+    def list_segments(self):
+        """
+        Return the numbers of the existing log segments, in order.
+        """
+        segments = []
+        for name in os.listdir(self.log_dir):
+            if name.startswith("wal_") and name.endswith(".log"):
+                segments.append(int(name[4:-4]))
+        return sorted(segments)
+
+    @staticmethod
+    def encode_record(record):
+        """
+        Encode a record as '<length> <crc32> <json>\\n', with length and checksum in hex.
+        """
+        payload = json.dumps(record, separators=(",", ":"), default=str).encode("utf-8")
+        return b"%08x %08x " % (len(payload), zlib.crc32(payload)) + payload + b"\n"
+
+    @staticmethod
+    def read_record(f):
+        """
+        Read the record at the current position of a segment file.
+        :return: The decoded record, or None at the end of the segment or on a torn or corrupt record.
+        """
+        header = f.read(18)
+        if len(header) < 18:
+            return None
+        try:
+            length, checksum = int(header[:8], 16), int(header[9:17], 16)
+        except ValueError:
+            return None
+        payload = f.read(length + 1)
+        if len(payload) < length + 1 or zlib.crc32(payload[:length]) != checksum:
+            return None
+        return json.loads(payload[:length])
+
+    def _write(self, record):
+        """
+        Append a record to the active segment, rolling over to a new segment when the
+        active one is full. Must be called with the lock held.
+        :return: The (segment, offset) of the record and its sequence number.
+        """
+        if self.file.tell() >= self.segment_size:
+            self._roll_segment()
+        position = (self.segment, self.file.tell())
+        self.file.write(self.encode_record(record))
+        self.written_lsn += 1
+        return position, self.written_lsn
+
+    def _roll_segment(self):
+        """
+        Make the active segment durable, start a new one and take a checkpoint.
+        Must be called with the lock held.
+        """
+        self.file.flush()
+        start = time.perf_counter()
+        os.fsync(self.file.fileno())
+        LOG_FSYNC_SECONDS.observe(time.perf_counter() - start)
+        self.file.close()
+        with self.sync_condition:
+            self.durable_lsn = max(self.durable_lsn, self.written_lsn)
+            self.sync_condition.notify_all()
+        self.segment += 1
+        self.file = open(self.segment_path(self.segment), "ab")
+        self._checkpoint()
+
+    def _checkpoint(self):
+        """
+        Append a checkpoint record listing the active transactions and delete the segments
+        that only hold records of finished transactions. Must be called with the lock held.
+        """
+        self._write({"type": "checkpoint", "active": list(self.begin_segments)})
+        oldest = min(self.begin_segments.values(), default=self.segment)
+        for segment in self.list_segments():
+            if segment >= oldest:
+                break
+            os.remove(self.segment_path(segment))
+
+    def checkpoint(self):
+        """
+        Take a checkpoint and truncate the log up to the oldest active transaction.
+        The checkpoint record is durable when the call returns.
+        """
+        with self.lock:
+            self._checkpoint()
+            lsn = self.written_lsn
+        self._sync(lsn)
+
+    def _sync(self, lsn):
+        """
+        Wait until the record with the given sequence number is on disk. Appenders arriving
+        while an fsync is in progress are batched into the next one.
+        """
+        with self.sync_condition:
+            while self.durable_lsn < lsn:
+                if not self.syncing:
+                    self.syncing = True
+                    break
+                self.sync_condition.wait()
+            else:
+                return
+
+        target = self.durable_lsn
+        try:
+            with self.lock:
+                self.file.flush()
+                target = self.written_lsn
+                fd = os.dup(self.file.fileno())
+            try:
+                start = time.perf_counter()
+                os.fsync(fd)
+                LOG_FSYNC_SECONDS.observe(time.perf_counter() - start)
+            finally:
+                os.close(fd)
+        finally:
+            with self.sync_condition:
+                self.durable_lsn = max(self.durable_lsn, target)
+                self.syncing = False
+                self.sync_condition.notify_all()
+
     def create_log(self, transaction_id):
         """
-        Create a new log file for a transaction. The log file is initialized with the
-        transaction ID and an empty list of logs.
+        Start the log of a new transaction by appending its begin record.
         """
         try:
-            log_file = os.path.join(self.log_dir, f"transaction_{transaction_id}.json")
-            with open(log_file, "w") as f:
-                json.dump({"transaction_id": transaction_id, "logs": []}, f)
+            with self.lock:
+                position, _ = self._write({"type": "begin", "transaction_id": transaction_id})
+                self.index[transaction_id] = []
+                self.begin_segments[transaction_id] = position[0]
         except Exception as e:
-            print(f"Error creating log file: {e}")
+            logger.error("Error creating log: %s", e)
             raise
 
-    def append_log(self, transaction_id, table, record_id, data):
+    def append_log(self, transaction_id, table, record_id, data, operation="update"):
         """
-        Append an entry to the log file of a transaction. Each entry contains information
-        about the table, record ID, and the state of the data.
+        Append an entry to the log of a transaction. Each entry contains information
+        about the table, record ID, the state of the data before the change and the
+        operation (insert/update/delete) that changed it. The call returns once the
+        entry is durable, so it is safe to change the database afterwards.
         """
+        start = time.perf_counter()
         try:
-            log_file = os.path.join(self.log_dir, f"transaction_{transaction_id}.json")
-            with open(log_file, "r+") as f:
-                log_data = json.load(f)
-                log_data["logs"].append({"table": table, "record_id": record_id, "data": data})
-                f.seek(0)
-                json.dump(log_data, f, indent=4)
+            record = {"type": "update", "transaction_id": transaction_id, "operation": operation,
+                      "table": table, "record_id": record_id, "data": data}
+            with self.lock:
+                position, lsn = self._write(record)
+                self.index.setdefault(transaction_id, []).append(position)
+            self._sync(lsn)
+            end = time.perf_counter()
+            LOG_APPEND_SECONDS.observe(end - start)
+            tracer.record(transaction_id, "log_append", start, end, table=table)
         except Exception as e:
-            print(f"Error appending to log file: {e}")
+            logger.error("Error appending to log: %s", e)
             raise
 
+    async def append_log_async(self, transaction_id, table, record_id, data, operation="update"):
+        """
+        Asyncio version of append_log: the write and the wait for its fsync run in the
+        default executor, so the event loop keeps serving other requests meanwhile.
+        """
+        await asyncio.to_thread(self.append_log, transaction_id, table, record_id, data, operation)
+
     def get_log(self, transaction_id):
         """
-                Retrieve the contents of a transaction log file.
+        Retrieve the log entries of a transaction, read at the offsets recorded in the index.
+        An exception is raised if one of the records is torn or corrupt, as the transaction
+        could then not be undone completely.
+        """
+        with self.lock:
+            positions = list(self.index.get(transaction_id, []))
+            self.file.flush()
+
+        logs = []
+        files = {}
+        try:
+            for segment, offset in positions:
+                if segment not in files:
+                    files[segment] = open(self.segment_path(segment), "rb")
+                f = files[segment]
+                f.seek(offset)
+                record = self.read_record(f)
+                if record is None:
+                    raise Exception(
+                        f"Log of transaction {transaction_id} is corrupt: no valid record at offset "
+                        f"{offset} of {self.segment_path(segment)}."
+                    )
+                logs.append(self.log_entry(record))
+        finally:
+            for f in files.values():
+                f.close()
+        return {"transaction_id": transaction_id, "logs": logs}
+
+    @staticmethod
+    def log_entry(record):
+        return {"table": record["table"], "record_id": record["record_id"],
+                "data": record["data"], "operation": record.get("operation", "update")}
+
+    def has_log(self, transaction_id):
+        """
+        Check whether a transaction has an open log, i.e. it is neither read-only nor finished.
         """
-        log_file = os.path.join(self.log_dir, f"transaction_{transaction_id}.json")
-        with open(log_file, "r") as f:
-            return json.load(f)
+        with self.lock:
+            return transaction_id in self.index
+
+    def log_length(self, transaction_id):
+        """
+        Return the number of update records in the open log of a transaction, i.e. the number
+        of changes its rollback has to undo.
+        """
+        with self.lock:
+            return len(self.index.get(transaction_id, ()))
+
+    def log_decision(self, transaction_id, participants):
+        """
+        Append the commit decision of a transaction, taken once all its participants are
+        prepared. The call returns once the record is durable.
+        """
+        with self.lock:
+            _, lsn = self._write({"type": "decision", "transaction_id": transaction_id,
+                                  "participants": participants})
+        self._sync(lsn)
+
+    def commit_log(self, transaction_id):
+        """
+        Append the commit record of a transaction and drop it from the index. The call
+        returns once the record is durable, after which recovery no longer undoes the transaction.
+        """
+        with self.lock:
+            if self.index.pop(transaction_id, None) is None:
+                return
+            self.begin_segments.pop(transaction_id, None)
+            _, lsn = self._write({"type": "commit", "transaction_id": transaction_id})
+        self._sync(lsn)
 
     def delete_log(self, transaction_id):
         """
-        Delete the log file of a transaction, after the transaction has been committed or rolled back.
+        End the log of a transaction, after the transaction has been rolled back,
+        by appending its end record and dropping it from the index.
+        """
+        with self.lock:
+            if self.index.pop(transaction_id, None) is not None:
+                self.begin_segments.pop(transaction_id, None)
+                self._write({"type": "end", "transaction_id": transaction_id})
+
+    def recover(self):
+        """
+        Scan the whole log for the transactions that were still in flight at the time of a
+        crash: begun but never committed nor ended.
+        Only those that reached their commit decision may have committed on some participants,
+        so they are returned to be compensated: they are put back in the index, so their
+        entries can be read with get_log and undone before their log is ended with delete_log.
+        The others never committed anywhere, so the databases already discarded their changes.
+        Their locks may also have been released before their log was ended, e.g. a deadlock
+        victim's, and rows they changed written again since by committed transactions, which
+        undoing them would overwrite: their log is only ended.
+        The scan of a segment stops at the first torn or corrupt record.
+        :return: A dictionary of TransactionID -> list of log entries, in log order, of the
+                 transactions to compensate.
+        """
+        in_flight = {}
+        for segment in self.list_segments():
+            if segment == self.segment:
+                continue
+            with open(self.segment_path(segment), "rb") as f:
+                while True:
+                    offset = f.tell()
+                    record = self.read_record(f)
+                    if record is None:
+                        break
+                    transaction_id = record.get("transaction_id")
+                    if record["type"] == "begin":
+                        in_flight[transaction_id] = {"segment": segment, "positions": [], "logs": [],
+                                                     "decided": False}
+                    elif transaction_id not in in_flight:
+                        continue
+                    elif record["type"] == "update":
+                        in_flight[transaction_id]["positions"].append((segment, offset))
+                        in_flight[transaction_id]["logs"].append(self.log_entry(record))
+                    elif record["type"] == "decision":
+                        in_flight[transaction_id]["decided"] = True
+                    elif record["type"] in ("commit", "end"):
+                        del in_flight[transaction_id]
+
+        undecided = [transaction_id for transaction_id, state in in_flight.items() if not state["decided"]]
+        with self.lock:
+            for transaction_id in undecided:
+                self._write({"type": "end", "transaction_id": transaction_id})
+                del in_flight[transaction_id]
+            for transaction_id, state in in_flight.items():
+                self.index[transaction_id] = state["positions"]
+                self.begin_segments[transaction_id] = state["segment"]
+            lsn = self.written_lsn
+        self._sync(lsn)
+        if undecided:
+            logger.info("Recovery: ended the log of the undecided transactions %s.", undecided)
+        return {transaction_id: state["logs"] for transaction_id, state in in_flight.items()}
+
+    def close(self):
+        """
+        Flush the active segment to disk, close it and release the log directory.
         """
-        log_file = os.path.join(self.log_dir, f"transaction_{transaction_id}.json")
-        if os.path.exists(log_file):
-            os.remove(log_file)
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.owner_file.close()
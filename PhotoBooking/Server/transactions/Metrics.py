@@ -0,0 +1,203 @@
+import threading
+from bisect import bisect_left
+from threading import Lock
+
+# Upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class ThreadCells:
+    def __init__(self, size):
+        """
+        A vector of size numbers aggregated per thread: every thread updates its own cell
+        without taking a lock, and the cells are only summed when the metrics are collected.
+        The cells of finished threads are folded into a single retired cell.
+        """
+        self.size = size
+        self.local = threading.local()
+        self.cells = []  # (thread, cell) of every thread that updated the vector
+        self.retired = [0] * size
+        self.lock = Lock()  # Guards the list of cells, taken once per thread and when collecting
+
+    def cell(self):
+        """
+        Return the cell of the calling thread, creating it on its first update.
+        """
+        try:
+            return self.local.cell
+        except AttributeError:
+            cell = [0] * self.size
+            with self.lock:
+                self.cells.append((threading.current_thread(), cell))
+            self.local.cell = cell
+            return cell
+
+    def totals(self):
+        """
+        Return the sum of the cells of all threads.
+        """
+        with self.lock:
+            totals = list(self.retired)
+            live = []
+            for thread, cell in self.cells:
+                alive = thread.is_alive()
+                for i, value in enumerate(cell):
+                    totals[i] += value
+                    if not alive:
+                        self.retired[i] += value
+                if alive:
+                    live.append((thread, cell))
+            self.cells = live
+        return totals
+
+
+class CounterValue:
+    __slots__ = ("cells",)
+
+    def __init__(self):
+        self.cells = ThreadCells(1)
+
+    def inc(self, amount=1):
+        self.cells.cell()[0] += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.cells.totals()[0]
+
+
+class HistogramValue:
+    __slots__ = ("buckets", "cells")
+
+    def __init__(self, buckets):
+        # One count per bucket, one for the values above the last bucket, and the sum
+        self.buckets = buckets
+        self.cells = ThreadCells(len(buckets) + 2)
+
+    def observe(self, value):
+        cell = self.cells.cell()
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def samples(self, name, labels):
+        totals = self.cells.totals()
+        count = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), totals):
+            count += bucket_count
+            yield f"{name}_bucket", labels + (("le", format_bound(bound)),), count
+        yield f"{name}_sum", labels, totals[-1]
+        yield f"{name}_count", labels, count
+
+
+class Metric:
+    def __init__(self, kind, name, documentation, labelnames, factory):
+        """
+        A counter or histogram, optionally split by labels. Each combination of label values
+        has its own value, created on first use; a metric without labels has a single value,
+        updated through the metric itself.
+        """
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self.values = {}  # Tuple of label values -> CounterValue or HistogramValue
+        self.lock = Lock()
+        if not self.labelnames:
+            self.default = self.labels()
+
+    def labels(self, *values):
+        """
+        Return the value of a combination of label values. Callers on a hot path should
+        keep the returned value rather than look it up on every update.
+        """
+        values = tuple(str(value) for value in values)
+        value = self.values.get(values)
+        if value is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}.")
+            with self.lock:
+                value = self.values.setdefault(values, self.factory())
+        return value
+
+    def inc(self, amount=1):
+        self.default.inc(amount)
+
+    def observe(self, value):
+        self.default.observe(value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            values = list(self.values.items())
+        for label_values, value in values:
+            labels = tuple(zip(self.labelnames, label_values))
+            for sample_name, sample_labels, sample in value.samples(self.name, labels):
+                lines.append(f"{sample_name}{format_labels(sample_labels)} {format_number(sample)}")
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Registry of the counters and histograms of the process, rendered in the Prometheus
+        text exposition format. Registering a name twice returns the existing metric.
+        """
+        self.metrics = {}  # Name -> Metric
+        self.lock = Lock()
+
+    def _register(self, kind, name, documentation, labelnames, factory):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = Metric(kind, name, documentation, labelnames, factory)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register("counter", name, documentation, labelnames, CounterValue)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        buckets = tuple(sorted(buckets))
+        return self._register("histogram", name, documentation, labelnames, lambda: HistogramValue(buckets))
+
+    def render(self):
+        """
+        Return the current value of every metric in the Prometheus text format.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def render_family(name, documentation, kind, samples):
+    """
+    Render values kept outside the registry, e.g. by the lock server, as a metric family.
+    :param samples: (labels, value) pairs, labels being a tuple of (name, value) pairs.
+    """
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(labels)} {format_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def format_number(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+# Metrics of the process, exposed by the /metrics endpoint
+metrics = Metrics()
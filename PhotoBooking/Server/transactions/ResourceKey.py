@@ -0,0 +1,72 @@
+from collections import namedtuple
+
+# Tables of the lock hierarchy, one per database
+TIMESLOTS_TABLE = "Timeslots"
+BOOKINGS_TABLE = "Bookings"
+
+
+class ResourceKey(namedtuple("ResourceKey", ["table", "record_id"])):
+    """
+    Typed, hashable identifier of a lockable resource: the kind of node it is and its ID.
+    Keys are plain tuples, so they are compact and cheap to hash.
+    Resources form a hierarchy, locked from the root down with intention modes:
+        table Timeslots (MFCC_db1) -> photographer -> timeslot
+        table Bookings (MFCC_db2) -> client -> booking
+    Each database holds a single table, so the tables are the roots: a database level
+    would only add an intention lock that every writer takes on the same key.
+    The key of a timeslot or booking holds the ID of its photographer or client, which never
+    changes, so that its ancestors are known from the key alone.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def table_of(cls, name):
+        return cls("Table", name)
+
+    @classmethod
+    def photographer(cls, photographer_id):
+        return cls("Photographer", int(photographer_id))
+
+    @classmethod
+    def timeslot(cls, timeslot_id, photographer_id):
+        return cls("Timeslot", (int(photographer_id), int(timeslot_id)))
+
+    @classmethod
+    def client(cls, client_id):
+        return cls("Client", int(client_id))
+
+    @classmethod
+    def booking(cls, booking_id, client_id):
+        return cls("Booking", (int(client_id), int(booking_id)))
+
+    def parent(self):
+        """
+        Return the key of the parent resource, or None for a table.
+        """
+        kind = self.table
+        if kind == "Timeslot":
+            return ResourceKey.photographer(self.record_id[0])
+        if kind == "Booking":
+            return ResourceKey.client(self.record_id[0])
+        if kind == "Photographer":
+            return ResourceKey.table_of(TIMESLOTS_TABLE)
+        if kind == "Client":
+            return ResourceKey.table_of(BOOKINGS_TABLE)
+        return None
+
+    def ancestors(self):
+        """
+        Return the keys of the ancestors of the resource, from the root down.
+        """
+        ancestors = []
+        parent = self.parent()
+        while parent is not None:
+            ancestors.append(parent)
+            parent = parent.parent()
+        ancestors.reverse()
+        return ancestors
+
+    def __str__(self):
+        # Timeslot and booking IDs are unique on their own
+        record_id = self.record_id[-1] if isinstance(self.record_id, tuple) else self.record_id
+        return f"{self.table}_{record_id}"
@@ -0,0 +1,75 @@
+import logging
+import queue
+import time
+from threading import Lock, Thread
+
+from transactions.Metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ROLLBACKS = metrics.counter(
+    "photobooking_background_rollbacks_total", "Rollbacks run by the rollback worker, by outcome.", ("result",)
+)
+ROLLBACK_SECONDS = metrics.histogram(
+    "photobooking_background_rollback_seconds", "Duration of the rollbacks run by the rollback worker."
+)
+
+
+class RollbackWorker:
+    def __init__(self):
+        """
+        Background thread undoing aborted transactions from their log, so that the request
+        which aborted a transaction does not wait for its compensation. Rollbacks run one at a
+        time, in the order they were submitted. The thread is started on the first rollback.
+        """
+        self.queue = queue.Queue()
+        self.thread = None
+        self.thread_lock = Lock()
+
+    def submit(self, transaction_id, rollback, done):
+        """
+        Queue the rollback of a transaction.
+        :param rollback: Callback undoing the transaction, called with its ID.
+        :param done: Callback called with the ID once the rollback has run, whether or not
+                     it succeeded, e.g. to release the locks of the transaction.
+        """
+        self.queue.put((transaction_id, rollback, done))
+        if self.thread is None:
+            self._start()
+
+    def _start(self):
+        with self.thread_lock:
+            if self.thread is None:
+                self.thread = Thread(target=self._run, daemon=True, name="rollback")
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            transaction_id, rollback, done = self.queue.get()
+            start = time.perf_counter()
+            try:
+                rollback(transaction_id)
+                ROLLBACKS.labels("done").inc()
+            except Exception as e:
+                # The log is kept, so crash recovery undoes the transaction at the next restart
+                ROLLBACKS.labels("failed").inc()
+                logger.error("Rollback of transaction %s failed: %s", transaction_id, e)
+            finally:
+                ROLLBACK_SECONDS.observe(time.perf_counter() - start)
+                try:
+                    done(transaction_id)
+                except Exception as e:
+                    logger.error("Rollback of transaction %s could not complete: %s", transaction_id, e)
+                self.queue.task_done()
+
+    def pending(self):
+        """
+        Return the number of rollbacks queued or running.
+        """
+        return self.queue.unfinished_tasks
+
+    def flush(self):
+        """
+        Wait until every queued rollback has run.
+        """
+        self.queue.join()
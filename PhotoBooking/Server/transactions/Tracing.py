@@ -0,0 +1,193 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from contextlib import contextmanager
+from threading import Lock, Thread
+
+from transactions.Metrics import metrics
+
+TRACES_WRITTEN = metrics.counter("photobooking_traces_written_total", "Sampled transaction traces written.")
+TRACES_DROPPED = metrics.counter(
+    "photobooking_traces_dropped_total", "Sampled transaction traces dropped because the writer fell behind."
+)
+
+# Trace of the transaction run by the current thread or asyncio task, if it is sampled
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    __slots__ = ("transaction_id", "trace_id", "start", "start_counter", "spans")
+
+    def __init__(self, transaction_id):
+        """
+        The spans recorded for one sampled transaction, as (name, start, end, attributes)
+        with start and end measured by time.perf_counter().
+        """
+        self.transaction_id = transaction_id
+        self.trace_id = os.urandom(8).hex()
+        self.start = time.time()
+        self.start_counter = time.perf_counter()
+        self.spans = []
+
+    def to_record(self, status):
+        return {
+            "trace_id": self.trace_id,
+            "transaction_id": self.transaction_id,
+            "status": status,
+            "start": self.start,
+            "duration_seconds": time.perf_counter() - self.start_counter,
+            "spans": [
+                dict(attributes, name=name, offset_seconds=start - self.start_counter, duration_seconds=end - start)
+                for name, start, end, attributes in self.spans
+            ],
+        }
+
+
+class Tracer:
+    def __init__(self, sample_rate=0.0, path="traces/traces.jsonl", max_open=10000, max_queued=10000):
+        """
+        Per-transaction tracing with head-based sampling: whether a transaction is traced is
+        decided once, when it starts, with probability sample_rate. The phases of a sampled
+        transaction (lock waits, database reads and writes, log appends, commit, rollback) are
+        recorded as spans, and the whole trace is handed to a background thread when the
+        transaction ends, which appends it as a JSON line to the trace file. Unsampled
+        transactions cost a dictionary lookup per phase.
+        :param path: Trace file, relative to the server directory unless absolute.
+        :param max_open: Maximum number of sampled transactions in progress; no new transaction
+                         is sampled beyond it.
+        :param max_queued: Maximum number of finished traces waiting for the writer; further
+                           traces are dropped and counted.
+        """
+        project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+        self.path = os.path.join(project_root, path)
+        self.sample_rate = sample_rate
+        self.max_open = max_open
+        self.traces = {}  # TransactionID -> Trace of the sampled transactions in progress
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.writer = None
+        self.writer_lock = Lock()
+
+    def start_trace(self, transaction_id):
+        """
+        Decide whether a new transaction is sampled and make its trace, or None, the trace
+        of the current thread or task.
+        :return: The trace, or None if the transaction is not sampled.
+        """
+        trace = None
+        if self.sample_rate > 0 and len(self.traces) < self.max_open and random.random() < self.sample_rate:
+            trace = self.traces[transaction_id] = Trace(transaction_id)
+        current_trace.set(trace)
+        return trace
+
+    def record(self, transaction_id, name, start, end=None, **attributes):
+        """
+        Record a span of a transaction, from start to end (time.perf_counter() values, end
+        defaulting to now), if the transaction is sampled.
+        """
+        trace = self.traces.get(transaction_id)
+        if trace is not None:
+            trace.spans.append((name, start, time.perf_counter() if end is None else end, attributes))
+
+    def record_current(self, name, start, end=None, **attributes):
+        """
+        Record a span of the transaction of the current thread or task, if it is sampled.
+        """
+        trace = current_trace.get()
+        if trace is not None:
+            trace.spans.append((name, start, time.perf_counter() if end is None else end, attributes))
+
+    @contextmanager
+    def span(self, transaction_id, name, **attributes):
+        """
+        Record the block of a with statement as a span of a transaction.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(transaction_id, name, start, **attributes)
+
+    def end_trace(self, transaction_id, status):
+        """
+        End the trace of a transaction, if it is sampled, and queue it for writing.
+        """
+        trace = self.traces.pop(transaction_id, None)
+        if current_trace.get() is trace:
+            current_trace.set(None)
+        if trace is None:
+            return
+        try:
+            self.queue.put_nowait(trace.to_record(status))
+        except queue.Full:
+            TRACES_DROPPED.inc()
+            return
+        if self.writer is None:
+            self._start_writer()
+
+    def _start_writer(self):
+        with self.writer_lock:
+            if self.writer is None:
+                self.writer = Thread(target=self._write_traces, daemon=True, name="trace-writer")
+                self.writer.start()
+
+    def _write_traces(self):
+        """
+        Append the queued traces to the trace file, in batches.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                records = [self.queue.get()]
+                while True:
+                    try:
+                        records.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                f.writelines(json.dumps(record, default=str) + "\n" for record in records)
+                f.flush()
+                TRACES_WRITTEN.inc(len(records))
+                for _ in records:
+                    self.queue.task_done()
+
+    def flush(self):
+        """
+        Wait until every queued trace is written.
+        """
+        self.queue.join()
+
+
+def configure_logging(level=None):
+    """
+    Send the log records of the process through a queue to a background thread writing them
+    to stderr, so that logging never blocks the caller on the stream. The level defaults to
+    PHOTOBOOKING_LOG_LEVEL, or INFO; the per-lock and per-edge messages are DEBUG.
+    :return: The started QueueListener.
+    """
+    level = level or os.environ.get("PHOTOBOOKING_LOG_LEVEL", "INFO")
+    records = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(records, stream_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+# Tracer of the process, sampling PHOTOBOOKING_TRACE_SAMPLE_RATE of the transactions (none by default)
+tracer = Tracer(
+    float(os.environ.get("PHOTOBOOKING_TRACE_SAMPLE_RATE", "0")),
+    os.environ.get("PHOTOBOOKING_TRACE_FILE", "traces/traces.jsonl"),
+)
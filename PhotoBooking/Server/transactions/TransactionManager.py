@@ -1,72 +1,415 @@
-from transactions.Locks import Locks
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from transactions.LockClient import LockClient
+from transactions.LockManager import LockManager
 from transactions.LogManager import LogManager
-from transactions.Transactions import Transactions
-from transactions.WaitForGraph import WaitForGraph
+from transactions.Metrics import metrics
+from transactions.RollbackWorker import RollbackWorker
+from transactions.Tracing import tracer
+from transactions.VersionStore import VersionStore
+
+logger = logging.getLogger(__name__)
+
+TRANSACTIONS_STARTED = metrics.counter("photobooking_transactions_started_total", "Transactions started.")
+TRANSACTIONS_COMMITTED = metrics.counter("photobooking_transactions_committed_total", "Transactions committed.")
+TRANSACTIONS_ABORTED = metrics.counter("photobooking_transactions_aborted_total", "Transactions aborted.")
+DEADLOCK_VICTIMS = metrics.counter(
+    "photobooking_deadlock_victims_total", "Transactions aborted to resolve a deadlock."
+)
+WOUNDED_TRANSACTIONS = metrics.counter(
+    "photobooking_wounded_transactions_total", "Transactions aborted for an older one under the wound-wait policy."
+)
+LOCK_REQUESTS = metrics.counter(
+    "photobooking_lock_requests_total", "Lock requests, by lock type and outcome.", ("lock_type", "result")
+)
+LOCK_WAIT_SECONDS = metrics.histogram(
+    "photobooking_lock_wait_seconds", "Time spent acquiring a lock, including the wait in its queue."
+)
+COMMIT_SECONDS = metrics.histogram(
+    "photobooking_commit_seconds", "Duration of the commit protocol, from prepare to the commit record."
+)
+SNAPSHOT_SECONDS = metrics.histogram(
+    "photobooking_snapshot_seconds", "Duration of the read-only transactions reading a snapshot."
+)
 
 
 class TransactionManager:
-    def __init__(self):
+    def __init__(self, lock_timeout=10.0, lock_server=None, conflict_policy=None, commit_threads=8):
         """
         Initialize the Transaction Manager to handle distributed transactions.
         It manages transactions, locks, the wait-for graph, and logging.
+        The transactions, locks and wait-for graph are owned by a LockManager: an in-process
+        one, or the lock server daemon when an address is given or set in PHOTOBOOKING_LOCK_SERVER,
+        so that all worker processes of the API share them. The log is local to the process, in
+        the directory named by PHOTOBOOKING_LOG_DIR, or a numbered sibling of it when another
+        worker holds that directory (see LogManager).
+        :param lock_timeout: Maximum number of seconds a transaction waits for a single lock.
+        :param lock_server: Address of the lock server, 'unix:/path' or 'host:port'.
+        :param conflict_policy: How lock conflicts are handled by the in-process LockManager:
+                                "detection" (default), "wait-die", "wound-wait" or "no-wait",
+                                also set by PHOTOBOOKING_CONFLICT_POLICY. The lock server has
+                                its own, set when it is started.
+        :param commit_threads: Number of threads committing the participants of transactions
+                               other than the first one, which is committed by the caller.
+        The in-process LockManager escalates the locks of a transaction past the threshold
+        set by PHOTOBOOKING_LOCK_ESCALATION_THRESHOLD (default 200, 0 disables escalation).
+        With the in-process LockManager, the old versions of the rows changed by transactions
+        are kept in a VersionStore, for the read-only transactions reading a snapshot. With the
+        lock server, other processes change the rows too, so there is no version store.
         """
-        self.transactions = Transactions()
-        self.locks = Locks()
-        self.wait_for_graph = WaitForGraph()
-        self.log_manager = LogManager()
+        self.lock_timeout = lock_timeout
+        lock_server = lock_server or os.environ.get("PHOTOBOOKING_LOCK_SERVER")
+        conflict_policy = conflict_policy or os.environ.get("PHOTOBOOKING_CONFLICT_POLICY", "detection")
+        escalation_threshold = int(os.environ.get("PHOTOBOOKING_LOCK_ESCALATION_THRESHOLD", "200"))
+        self.lock_manager = (
+            LockClient(lock_server) if lock_server else LockManager(conflict_policy, escalation_threshold)
+        )
+        self.log_manager = LogManager(os.environ.get("PHOTOBOOKING_LOG_DIR", "logs"))
+        self.lock_server = lock_server
+        self.version_store = None if lock_server else VersionStore(
+            lambda transaction_id: self.lock_manager.get_status(transaction_id) == "aborted"
+        )
+
+        # Phase two of the commit protocol commits the participants in parallel
+        self.commit_executor = ThreadPoolExecutor(max_workers=commit_threads, thread_name_prefix="commit")
 
-    def start_transaction(self, transaction_id):
+        # Callback compensating, from the log, a transaction whose commit reached only some
+        # participants. Registered by the data access layer, which knows the tables.
+        self.undo_handler = None
+        self.rollback_worker = RollbackWorker()
+
+        self.commit_hooks = {}  # TransactionID -> callbacks to run once the transaction has committed
+        self.hooks_lock = Lock()
+
+    def start_transaction(self, transaction_id, read_only=False, snapshot=False):
         """
         Start a new transaction by adding it to the transaction manager and creating
-        a corresponding log file for tracking changes.
+        a corresponding log file for tracking changes. Read-only transactions never
+        write, so they do not get a log file.
+        A snapshot transaction is read-only and takes no locks: it reads the rows as of the
+        last commit through the version store (see read_snapshot), so it never blocks writers
+        nor waits for them. It is only known to the version store and ends at its commit.
+        :return: The snapshot timestamp of a snapshot transaction, or None if there is no
+                 version store, in which case the transaction is an ordinary read-only one
+                 and has to lock what it reads.
         """
-        self.transactions.add_transaction(transaction_id)
-        self.log_manager.create_log(transaction_id)
-        print(f"Transaction {transaction_id} started.")
+        if snapshot and self.version_store is not None:
+            timestamp = self.version_store.begin_snapshot(transaction_id)
+            tracer.start_trace(transaction_id)
+            logger.debug("Transaction %s started reading snapshot %d.", transaction_id, timestamp)
+            return timestamp
+        self.lock_manager.start_transaction(transaction_id)
+        TRANSACTIONS_STARTED.inc()
+        tracer.start_trace(transaction_id)
+        if not (read_only or snapshot):
+            self.log_manager.create_log(transaction_id)
+        logger.debug("Transaction %s started.", transaction_id)
+        return None
 
-    def acquire_lock(self, transaction_id, resource, lock_type):
+    def acquire_lock(self, transaction_id, resource, lock_type, deadline=None):
         """
-        Attempt to acquire a lock on a resource for the specified transaction. If the lock
-        cannot be acquired, add the transaction to the wait-for graph and return False.
+        Acquire a read (shared) or write (exclusive) lock on a resource for the specified
+        transaction, or a lock in another of the LOCK_MODES, after the intention locks on its
+        ancestors in the lock hierarchy. If a lock is not available, the transaction is queued
+        on its resource and blocks until the lock is granted. While it waits, it has an edge to every blocking
+        transaction in the wait-for graph. The wait is bounded by the lock timeout and by the
+        request's deadline (a time.monotonic() value), whichever comes first.
+        :return: True if the lock was acquired, False on timeout or if the transaction was aborted.
         """
-        if not self.locks.acquire_lock(transaction_id, resource, lock_type):
-            # Add to wait-for graph if lock cannot be granted
-            current_lock = self.locks.get_locks().get(resource)
-            if current_lock:
-                self.wait_for_graph.add_edge(transaction_id, current_lock["transaction_id"])
-                print(f"Transaction {transaction_id} waiting for {current_lock['transaction_id']} on resource {resource}.")
+        start = time.perf_counter()
+        granted = self.lock_manager.acquire_lock(
+            transaction_id, resource, lock_type, self._lock_wait(deadline), self.log_manager.log_length(transaction_id)
+        )
+        return self._report_lock_request(transaction_id, resource, lock_type, granted, start)
+
+    async def acquire_lock_async(self, transaction_id, resource, lock_type, deadline=None):
+        """
+        Asyncio version of acquire_lock: while the lock is not available the calling
+        coroutine is suspended, instead of its thread, under the same wait-for graph,
+        deadlock resolution, lock timeout and deadline as the blocking version.
+        :return: True if the lock was acquired, False on timeout or if the transaction was aborted.
+        """
+        start = time.perf_counter()
+        granted = await self.lock_manager.acquire_lock_async(
+            transaction_id, resource, lock_type, self._lock_wait(deadline), self.log_manager.log_length(transaction_id)
+        )
+        return self._report_lock_request(transaction_id, resource, lock_type, granted, start)
+
+    def _lock_wait(self, deadline):
+        """
+        Return the number of seconds a lock request may wait: the lock timeout, capped by the
+        request's deadline.
+        """
+        if deadline is None:
+            return self.lock_timeout
+        return max(0.0, min(self.lock_timeout, deadline - time.monotonic()))
+
+    @staticmethod
+    def _report_lock_request(transaction_id, resource, lock_type, granted, start):
+        end = time.perf_counter()
+        LOCK_WAIT_SECONDS.observe(end - start)
+        LOCK_REQUESTS.labels(lock_type, "granted" if granted else "failed").inc()
+        tracer.record(transaction_id, "lock_wait", start, end, resource=str(resource), lock_type=lock_type,
+                      granted=granted)
+        if not granted:
+            logger.info("Transaction %s could not acquire %s lock on %s.", transaction_id, lock_type, resource)
             return False
-        print(f"Transaction {transaction_id} acquired {lock_type} lock on {resource}.")
+        logger.debug("Transaction %s acquired %s lock on %s.", transaction_id, lock_type, resource)
         return True
 
+    def record_version(self, transaction_id, table, record_id, row):
+        """
+        Keep the committed state of a Timeslots or Bookings row a transaction is about to change
+        under its write lock, for the snapshots that must not see the change: the row's columns,
+        or None for a row it inserts.
+        """
+        if self.version_store is not None:
+            self.version_store.record(transaction_id, table, record_id, row)
+
+    def read_snapshot(self, timestamp, table, rows, record_ids=None):
+        """
+        Return the rows of a table as of a snapshot, given the rows just read from the database,
+        a dict of record ID -> row. Rows changed since the snapshot are replaced by their version
+        at the snapshot, added if they were deleted, or removed if they did not exist yet.
+        :param record_ids: The rows the database read was restricted to, if it was not a scan of
+                           the table. A scan gets back every row versioned at the snapshot,
+                           which the caller filters again.
+        """
+        rows = dict(rows)
+        for record_id, row in self.version_store.as_of(table, timestamp, record_ids).items():
+            if row is None:
+                rows.pop(record_id, None)
+            else:
+                rows[record_id] = row
+        return rows
+
     def release_locks(self, transaction_id):
         """
         Release all locks held by a transaction and remove the transaction from
         the wait-for graph. Ensures the transaction lifecycle ends properly.
         """
-        self.locks.release_locks(transaction_id)
-        self.wait_for_graph.remove_transaction(transaction_id)
-        print(f"Transaction {transaction_id} released all locks.")
+        self.lock_manager.release_locks(transaction_id)
+        logger.debug("Transaction %s released all locks.", transaction_id)
 
     def check_deadlock(self):
         """
-        Check for deadlocks in the wait-for graph. If a cycle is detected, resolve it by
-        aborting the youngest transaction in the cycle (the transaction with the latest timestamp).
-        """
-        cycle = self.wait_for_graph.detect_cycle()
-        if cycle:
-            print(f"Deadlock detected! Cycle: {cycle}")
-            transaction_to_abort = max(cycle, key=lambda tid: self.transactions.get_transaction(tid)["timestamp"])
-            print(f"Aborting transaction {transaction_to_abort} to resolve deadlock.")
-            self.transactions.update_status(transaction_to_abort, "aborted")
-            self.release_locks(transaction_to_abort)
-            return transaction_to_abort
-        return None
+        Check the whole wait-for graph for deadlocks and resolve all of them, by aborting the
+        transaction of each cycle that is cheapest to undo. Deadlocks are normally resolved as
+        soon as the closing edge is added, so this is only a periodic fallback.
+        :return: The IDs of the aborted transactions.
+        """
+        return self.lock_manager.check_deadlock()
+
+    def snapshot(self, parts=("locks", "transactions", "wait_for", "contended"), top=10):
+        """
+        Return copies of the lock table, the transactions, the wait-for edges, the most
+        contended resources, the recently finished transactions and the conflict policy
+        accounting (see LockManager.snapshot).
+        """
+        return self.lock_manager.snapshot(parts, top)
+
+    def on_commit(self, transaction_id, callback):
+        """
+        Register a callback to run when the transaction commits, after its changes reached
+        every database and before its locks are released. Callbacks are dropped on abort.
+        """
+        with self.hooks_lock:
+            self.commit_hooks.setdefault(transaction_id, []).append(callback)
+
+    def run_commit_hooks(self, transaction_id):
+        """
+        Run and forget the commit callbacks of a transaction. A failing callback does not
+        undo the commit, it is only reported.
+        """
+        with self.hooks_lock:
+            callbacks = self.commit_hooks.pop(transaction_id, [])
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error("Transaction %s: commit hook failed - %s", transaction_id, e)
+
+    def commit_transaction(self, transaction_id, participants=()):
+        """
+        Commit a transaction with a two-phase commit across its participants (the database
+        sessions it wrote through), then update its status to "committed" and release all
+        locks held by it.
+        The status of the transaction first changes from "active" to "prepared", atomically, so
+        a transaction wounded or chosen as a deadlock victim meanwhile is not committed, and a
+        prepared one is no longer wounded.
+        Phase one prepares every participant by flushing its pending changes, so all SQL has run
+        inside the open database transactions. If any participant fails, all of them are rolled
+        back and nothing needs compensating.
+        The durable decision record is written next. Phase two commits all participants
+        concurrently and writes the commit record once every one of them has succeeded. A
+        transaction with a decision but no commit record is undone by crash recovery, because
+        participants cannot be re-committed after a crash.
+        If a participant fails during phase two, the transaction is marked "in-doubt" and the
+        exception is raised, so that abort_transaction compensates the participants that committed.
+        The versions the transaction recorded get its commit timestamp once all participants
+        committed, before its commit callbacks run. A snapshot transaction only ends its snapshot.
+        """
+        if self._end_snapshot(transaction_id):
+            return
+        if not self.lock_manager.transition_status(transaction_id, ("active",), "prepared"):
+            raise Exception(f"Transaction {transaction_id} was aborted.")
+
+        start = time.perf_counter()
+        if participants:
+            # Phase one: prepare
+            for session in participants:
+                session.flush()
+            self.log_manager.log_decision(transaction_id, len(participants))
+
+            # Phase two: commit every participant concurrently, the first one on this thread
+            futures = [self.commit_executor.submit(session.commit) for session in participants[1:]]
+            errors = []
+            try:
+                participants[0].commit()
+            except Exception as e:
+                errors.append(e)
+            errors += [future.exception() for future in futures if future.exception() is not None]
+            if errors:
+                self.lock_manager.update_status(transaction_id, "in-doubt")
+                raise Exception(f"Commit failed on {len(errors)} of {len(participants)} participants: {errors[0]}")
+
+        self._commit_versions(transaction_id)
+        self.log_manager.commit_log(transaction_id)
+        self.lock_manager.update_status(transaction_id, "committed")
+        self._report_commit(transaction_id, start, len(participants))
+        self.run_commit_hooks(transaction_id)
+        self.release_locks(transaction_id)
+        logger.debug("Transaction %s committed.", transaction_id)
+
+    async def commit_transaction_async(self, transaction_id, participants=()):
+        """
+        Asyncio version of commit_transaction, for participants that are asyncio sessions.
+        The participants are flushed and committed concurrently on the event loop, the log
+        records are written and made durable in the default executor.
+        """
+        if self._end_snapshot(transaction_id):
+            return
+        if not await self.lock_manager.transition_status_async(transaction_id, ("active",), "prepared"):
+            raise Exception(f"Transaction {transaction_id} was aborted.")
+
+        start = time.perf_counter()
+        if participants:
+            # Phase one: prepare
+            for session in participants:
+                await session.flush()
+            await asyncio.to_thread(self.log_manager.log_decision, transaction_id, len(participants))
+
+            # Phase two: commit every participant concurrently
+            results = await asyncio.gather(*(session.commit() for session in participants), return_exceptions=True)
+            errors = [result for result in results if isinstance(result, Exception)]
+            if errors:
+                self.lock_manager.update_status(transaction_id, "in-doubt")
+                raise Exception(f"Commit failed on {len(errors)} of {len(participants)} participants: {errors[0]}")
+
+        self._commit_versions(transaction_id)
+        if self.log_manager.has_log(transaction_id):
+            await asyncio.to_thread(self.log_manager.commit_log, transaction_id)
+        self.lock_manager.update_status(transaction_id, "committed")
+        self._report_commit(transaction_id, start, len(participants))
+        self.run_commit_hooks(transaction_id)
+        await self.lock_manager.release_locks_async(transaction_id)
+        logger.debug("Transaction %s committed.", transaction_id)
+
+    def _end_snapshot(self, transaction_id):
+        """
+        End the snapshot of a snapshot transaction.
+        :return: False if the transaction is not a snapshot transaction.
+        """
+        duration = None if self.version_store is None else self.version_store.end_snapshot(transaction_id)
+        if duration is None:
+            return False
+        SNAPSHOT_SECONDS.observe(duration)
+        tracer.end_trace(transaction_id, "committed")
+        logger.debug("Transaction %s ended its snapshot.", transaction_id)
+        return True
+
+    def _commit_versions(self, transaction_id):
+        if self.version_store is not None:
+            self.version_store.commit(transaction_id)
+
+    @staticmethod
+    def _report_commit(transaction_id, start, participants):
+        end = time.perf_counter()
+        COMMIT_SECONDS.observe(end - start)
+        TRANSACTIONS_COMMITTED.inc()
+        tracer.record(transaction_id, "commit", start, end, participants=participants)
+        tracer.end_trace(transaction_id, "committed")
+
+    async def abort_transaction_async(self, transaction_id, participants=()):
+        """
+        Asyncio version of abort_transaction, for participants that are asyncio sessions.
+        The compensation of an "in-doubt" transaction runs in the default executor.
+        """
+        start = time.perf_counter()
+        for session in participants:
+            await session.rollback()
+        await asyncio.to_thread(self._abort, transaction_id, start)
+
+    def abort_transaction(self, transaction_id, participants=()):
+        """
+        Abort a transaction: roll back its participants and release all its locks. Changes that
+        never reached a database commit are discarded by the rollback alone, and the log is ended.
+        Only an "in-doubt" transaction, whose commit reached some participants, is compensated
+        from the log through the undo handler, by the rollback worker: the call returns at once
+        and the transaction keeps its locks until its compensation has run. A transaction
+        already marked "aborted" was chosen as a deadlock victim, one marked "wounded" was
+        wounded by an older transaction. A committed transaction is left as it is.
+        """
+        start = time.perf_counter()
+        for session in participants:
+            session.rollback()
+        self._abort(transaction_id, start)
+
+    def _abort(self, transaction_id, start):
+        """
+        Abort a transaction whose participants are rolled back, from start (a time.perf_counter()
+        value) on: drop its commit callbacks, compensate or end its log and release its locks.
+        """
+        if self._end_snapshot(transaction_id):
+            return
+        with self.hooks_lock:
+            self.commit_hooks.pop(transaction_id, None)
+
+        status = self.lock_manager.get_status(transaction_id)
+        if status == "committed":
+            # The caller was cancelled once the commit was under way, which then ran to its end
+            logger.debug("Transaction %s committed, nothing to abort.", transaction_id)
+            return
+        if self.undo_handler and status == "in-doubt":
+            self.rollback_worker.submit(
+                transaction_id, self.undo_handler, lambda transaction_id: self._end_abort(transaction_id, status, start)
+            )
+            return
+        try:
+            self.log_manager.delete_log(transaction_id)
+        finally:
+            self._end_abort(transaction_id, status, start)
 
-    def commit_transaction(self, transaction_id):
+    def _end_abort(self, transaction_id, status, start):
         """
-        Commit a transaction by updating its status to "committed" and releasing all
-        locks held by it
+        Mark a rolled back transaction "aborted", drop the versions it recorded and release its locks.
+        :param status: Status of the transaction when it was aborted.
         """
-        self.transactions.update_status(transaction_id, "committed")
-        self.release_locks(transaction_id)
\ No newline at end of file
+        if self.version_store is not None:
+            self.version_store.discard(transaction_id)
+        self.lock_manager.update_status(transaction_id, "aborted")
+        TRANSACTIONS_ABORTED.inc()
+        if status == "aborted":
+            DEADLOCK_VICTIMS.inc()
+        elif status == "wounded":
+            WOUNDED_TRANSACTIONS.inc()
+        self.release_locks(transaction_id)
+        tracer.record(transaction_id, "rollback", start, deadlock_victim=status == "aborted",
+                      wounded=status == "wounded", compensated=status == "in-doubt")
+        tracer.end_trace(transaction_id, "aborted")
+        logger.info("Transaction %s aborted.", transaction_id)
@@ -1,35 +1,99 @@
+from collections import deque
 from threading import Lock
 import time
 
+FINISHED_STATUSES = ("committed", "aborted")
+
+
+class TransactionRecord:
+    __slots__ = ("transaction_id", "timestamp", "status", "finished_at", "log_records", "fine_locks")
+
+    def __init__(self, transaction_id, timestamp=None):
+        """
+        Metadata of a transaction: its start timestamp, used by the timestamp-based conflict
+        policies, its status, the time.monotonic() at which it finished, if it did, and the
+        number of records in its log at its last lock request, which with its age and locks
+        estimates the cost of aborting it when it is in a deadlock, and the number of locks it
+        took below each resource of the lock hierarchy, for lock escalation.
+        """
+        self.transaction_id = transaction_id
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.status = "active"
+        self.finished_at = None
+        self.log_records = 0
+        self.fine_locks = None  # Resource -> number of locks taken below it, created on first use
+
 
 class Transactions:
-    def __init__(self):
+    def __init__(self, grace_period=300.0, history_size=1000):
         """
         Initialize a structure to manage transaction metadata.
+        A committed or aborted transaction is kept for grace_period seconds, during which a
+        deadlock victim still running learns that it was aborted, then reclaimed. Reclaiming
+        follows the order in which transactions finished, a little at a time whenever another
+        one finishes, so the registry only holds the active transactions and those of the last
+        grace period. The last history_size finished transactions are kept in a ring buffer
+        for diagnostics.
         """
-        self.transactions = {}  # TransactionID -> {timestamp, status, operations}
+        self.transactions = {}  # TransactionID -> TransactionRecord
+        self.finished = deque()  # Finished records, in the order they finished
+        self.history = deque(maxlen=history_size)  # (TransactionID, status, duration in seconds)
+        self.grace_period = grace_period
         self.lock = Lock()
 
-    def add_transaction(self, transaction_id):
+    def add_transaction(self, transaction_id, timestamp=None):
         """
         Add a new transaction to the transaction manager. The transaction is initialized with the
-        current timestamp, an active status, and an empty list of operations.
+        given timestamp, by default the current one, and an active status.
         """
         with self.lock:
             if transaction_id not in self.transactions:
-                self.transactions[transaction_id] = {
-                    "timestamp": time.time(),
-                    "status": "active",
-                    "operations": []
-                }
+                self.transactions[transaction_id] = TransactionRecord(transaction_id, timestamp)
 
     def update_status(self, transaction_id, status):
         """
         Update the status of a transaction (e.g., active, committed, aborted)
         """
         with self.lock:
-            if transaction_id in self.transactions:
-                self.transactions[transaction_id]["status"] = status
+            record = self.transactions.get(transaction_id)
+            if record is not None:
+                self._set_status(record, status)
+
+    def transition(self, transaction_id, expected, status):
+        """
+        Atomically update the status of a transaction if it is one of the expected statuses,
+        e.g. prepare a transaction only if it was not aborted meanwhile.
+        :return: True if the status was updated, False if the transaction is unknown or its
+                 status was not expected.
+        """
+        with self.lock:
+            record = self.transactions.get(transaction_id)
+            if record is None or record.status not in expected:
+                return False
+            self._set_status(record, status)
+            return True
+
+    def _set_status(self, record, status):
+        """
+        Set the status of a transaction, recording when it finished. Must be called with the lock held.
+        """
+        record.status = status
+        if status in FINISHED_STATUSES and record.finished_at is None:
+            record.finished_at = time.monotonic()
+            self.finished.append(record)
+            self.history.append((record.transaction_id, status, time.time() - record.timestamp))
+            self._evict(record.finished_at)
+
+    def _evict(self, now):
+        """
+        Reclaim the transactions that finished more than grace_period seconds ago.
+        Must be called with the lock held.
+        """
+        while self.finished and self.finished[0].finished_at + self.grace_period <= now:
+            record = self.finished.popleft()
+            # The ID may have been reused by a newer transaction since
+            if self.transactions.get(record.transaction_id) is record:
+                del self.transactions[record.transaction_id]
 
     def get_transaction(self, transaction_id):
         """
@@ -38,6 +102,30 @@ class Transactions:
         with self.lock:
             return self.transactions.get(transaction_id)
 
+    def get_transactions(self):
+        """
+        Return a copy of the metadata of all transactions, with their age in seconds.
+        """
+        with self.lock:
+            transactions = [(record.transaction_id, record.timestamp, record.status)
+                            for record in self.transactions.values()]
+        now = time.time()
+        return {
+            transaction_id: {"timestamp": timestamp, "age_seconds": now - timestamp, "status": status}
+            for transaction_id, timestamp, status in transactions
+        }
+
+    def get_history(self):
+        """
+        Return the most recently finished transactions, latest first.
+        """
+        with self.lock:
+            history = list(self.history)
+        return [
+            {"transaction_id": transaction_id, "status": status, "duration_seconds": duration}
+            for transaction_id, status, duration in reversed(history)
+        ]
+
     def remove_transaction(self, transaction_id):
         """
         Remove a transaction from the transaction manager, when the transaction is completed or aborted.
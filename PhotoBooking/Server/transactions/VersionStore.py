@@ -0,0 +1,159 @@
+import time
+from collections import deque
+from threading import Lock
+
+
+class VersionStore:
+    def __init__(self, is_aborted=None):
+        """
+        Old versions of the Timeslot and Booking rows, so that read-only transactions read
+        both databases as of a snapshot without taking locks.
+        Every committing transaction gets a commit timestamp from a counter, and a snapshot is
+        the timestamp of the last commit when it was taken. A writer records the state of every
+        row before changing it (None for a row it inserts), while it holds the row's write lock.
+        At commit, the recorded versions are stamped with the commit timestamp, which ends their
+        validity. A row's stamped versions are kept in the order their writers committed,
+        followed by the unstamped ones of the writers still running. The versions of a row are
+        found by transaction ID and end timestamp rather than by position, since writers do not
+        always end in the order they recorded, e.g. a deadlock victim rolls back after its
+        locks were released.
+        Meanwhile, another transaction may have changed the victim's rows and committed, so the
+        unstamped versions of the writers for which is_aborted(TransactionID) is true are not
+        read: an aborted writer never committed, and the databases hold the state to read.
+        The store holds only the versions that snapshots may still need, which are dropped once
+        no snapshot is older than their end. It only knows the writes of its own process.
+        """
+        self.versions = {}  # Table -> record ID -> list of [end timestamp or None, row or None, TransactionID]
+        self.pending = {}  # TransactionID -> (table, record ID) of the rows it recorded, until it commits
+        self.ended = deque()  # (end timestamp, table, record ID) of the stamped versions, in commit order
+        self.snapshots = {}  # TransactionID -> (snapshot timestamp, time.monotonic() it started)
+        self.clock = 0  # Timestamp of the last commit
+        self.is_aborted = is_aborted or (lambda transaction_id: False)
+        self.lock = Lock()
+
+    def record(self, transaction_id, table, record_id, row):
+        """
+        Record the committed state of a row a transaction is about to change: a dict of its
+        columns, or None for a row it inserts. Only the first state recorded by the transaction
+        for a row is kept.
+        """
+        key = (table, record_id)
+        with self.lock:
+            keys = self.pending.setdefault(transaction_id, set())
+            if key in keys:
+                return
+            keys.add(key)
+            self.versions.setdefault(table, {}).setdefault(record_id, []).append([None, row, transaction_id])
+
+    def commit(self, transaction_id):
+        """
+        Stamp the versions recorded by a transaction, once its changes reached every database.
+        :return: The commit timestamp, or None if the transaction recorded nothing.
+        """
+        with self.lock:
+            keys = self.pending.pop(transaction_id, None)
+            if not keys:
+                return None
+            self.clock += 1
+            for table, record_id in keys:
+                chain = self.versions[table][record_id]
+                version = chain.pop(self._find(chain, transaction_id))
+                version[0] = self.clock
+                # The newest stamped version goes after the other stamped ones
+                chain.insert(sum(1 for end, _, _ in chain if end is not None), version)
+                self.ended.append((self.clock, table, record_id))
+            self._prune()
+            return self.clock
+
+    def discard(self, transaction_id):
+        """
+        Drop the versions recorded by an aborted transaction, once its changes were rolled back.
+        """
+        with self.lock:
+            for table, record_id in self.pending.pop(transaction_id, ()):
+                chain = self.versions[table][record_id]
+                chain.pop(self._find(chain, transaction_id))
+                if not chain:
+                    del self.versions[table][record_id]
+
+    @staticmethod
+    def _find(chain, transaction_id):
+        """
+        Return the position of the unstamped version a transaction recorded in a chain.
+        """
+        return next(
+            position for position, (end, _, writer) in enumerate(chain) if end is None and writer == transaction_id
+        )
+
+    def begin_snapshot(self, transaction_id):
+        """
+        Start a snapshot of the last committed state for a read-only transaction.
+        :return: The snapshot timestamp.
+        """
+        with self.lock:
+            self.snapshots[transaction_id] = (self.clock, time.monotonic())
+            return self.clock
+
+    def end_snapshot(self, transaction_id):
+        """
+        End the snapshot of a transaction and drop the versions only it needed.
+        :return: The number of seconds the snapshot was open, or None if the transaction had no snapshot.
+        """
+        with self.lock:
+            snapshot = self.snapshots.pop(transaction_id, None)
+            if snapshot is None:
+                return None
+            self._prune()
+        return time.monotonic() - snapshot[1]
+
+    def _prune(self):
+        """
+        Drop the versions that ended before the oldest snapshot. Must be called with the lock held.
+        """
+        horizon = min((timestamp for timestamp, _ in self.snapshots.values()), default=self.clock)
+        while self.ended and self.ended[0][0] <= horizon:
+            end, table, record_id = self.ended.popleft()
+            chain = self.versions[table][record_id]
+            chain.pop(next(position for position, version in enumerate(chain) if version[0] == end))
+            if not chain:
+                del self.versions[table][record_id]
+
+    def as_of(self, table, timestamp, record_ids=None):
+        """
+        Return the rows of a table whose state at the snapshot timestamp may differ from their
+        state in the database, with that state: the first version ending after the timestamp,
+        or still unstamped, unless its writer was aborted. The caller reads the database first,
+        then replaces the returned rows, so a write committing in between cannot be missed.
+        :param record_ids: Only look these rows up, instead of every versioned row of the table.
+        :return: Record ID -> row at the snapshot, None if the row did not exist.
+        """
+        rows = {}
+        with self.lock:
+            versions = self.versions.get(table, {})
+            if record_ids is None:
+                chains = list(versions.items())
+            else:
+                chains = [(record_id, versions.get(record_id)) for record_id in record_ids]
+            for record_id, chain in chains:
+                for end, row, writer in chain or ():
+                    if end is None and self.is_aborted(writer):
+                        continue
+                    if end is None or end > timestamp:
+                        rows[record_id] = row
+                        break
+        return rows
+
+    def stats(self):
+        """
+        Return the number of versioned rows and kept versions, the number of open snapshots
+        and the age in seconds of the oldest one, and the last commit timestamp.
+        """
+        with self.lock:
+            now = time.monotonic()
+            return {
+                "rows": sum(len(versions) for versions in self.versions.values()),
+                "versions": sum(len(chain) for versions in self.versions.values() for chain in versions.values()),
+                "snapshots": len(self.snapshots),
+                "oldest_snapshot_seconds": max((now - started for _, started in self.snapshots.values()), default=0.0),
+                "clock": self.clock,
+            }
@@ -1,24 +1,66 @@
+import logging
 from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+_EXHAUSTED = object()
+
+
 class WaitForGraph:
-    def __init__(self):
+    def __init__(self, search_limit=1000):
         """
         Initialize the Wait-For Graph and a threading lock.
         The graph stores transaction dependencies as a dictionary where keys
-        are transaction IDs and values are lists of transactions they are waiting for.
+        are transaction IDs and values are sets of transactions they are waiting for.
+        :param search_limit: Maximum number of transactions visited by the cycle search
+                             run when an edge is added.
         """
-        self.graph = {}  # TransactionID -> List of transactions it's waiting for
+        self.graph = {}  # TransactionID -> Set of transactions it's waiting for
+        self.search_limit = search_limit
         self.lock = Lock()
 
     def add_edge(self, from_transaction, to_transaction):
         """
         Add a directed edge from one transaction to another, indicating that
         the first transaction is waiting for the second transaction to release a resource.
+        A new cycle has to go through the new edge, so it is detected right away by searching
+        for a path from the second transaction back to the first one.
+        :return: The transactions on the cycle closed by the edge, or None.
         """
         with self.lock:
-            if from_transaction not in self.graph:
-                self.graph[from_transaction] = []
-            self.graph[from_transaction].append(to_transaction)
-            print(f"Edge added: {from_transaction} -> {to_transaction}")
+            self.graph.setdefault(from_transaction, set()).add(to_transaction)
+            logger.debug("Edge added: %s -> %s", from_transaction, to_transaction)
+            path = self._find_path(to_transaction, from_transaction)
+            if path is not None:
+                return [from_transaction] + path
+            return None
+
+    def _find_path(self, source, target):
+        """
+        Depth-first search for a path from source to target, visiting at most
+        search_limit transactions. Must be called with the lock held.
+        :return: The transactions on the path, starting with source and excluding target, or None.
+        """
+        if source == target:
+            return []
+        parents = {source: None}
+        stack = [source]
+        while stack:
+            current = stack.pop()
+            for waited_for in self.graph.get(current, ()):
+                if waited_for in parents:
+                    continue
+                parents[waited_for] = current
+                if waited_for == target:
+                    path = [waited_for]
+                    while parents[path[-1]] is not None:
+                        path.append(parents[path[-1]])
+                    path.reverse()
+                    return path[:-1]
+                if len(parents) >= self.search_limit:
+                    return None
+                stack.append(waited_for)
+        return None
 
     def remove_edge(self, from_transaction, to_transaction):
         """
@@ -27,7 +69,15 @@ class WaitForGraph:
         """
         with self.lock:
             if from_transaction in self.graph:
-                self.graph[from_transaction].remove(to_transaction)
+                self.graph[from_transaction].discard(to_transaction)
+
+    def remove_waits(self, transaction_id):
+        """
+        Remove all outgoing edges of a transaction, when it stops waiting because
+        its lock request was granted, timed out or was cancelled.
+        """
+        with self.lock:
+            self.graph.pop(transaction_id, None)
 
     def remove_transaction(self, transaction_id):
         """
@@ -38,35 +88,69 @@ class WaitForGraph:
             if transaction_id in self.graph:
                 del self.graph[transaction_id]
             for waiters in self.graph.values():
-                if transaction_id in waiters:
-                    waiters.remove(transaction_id)
+                waiters.discard(transaction_id)
 
-    def detect_cycle(self):
+    def get_edges(self):
         """
-        Detect cycles in the wait-for graph using topological sorting.
-        :return: A list of transactions involved in the cycle if a deadlock is detected,
-                 or None if no cycle is found.
+        Return a copy of the edges of the graph, as (waiting transaction, waited-for transaction) pairs.
         """
         with self.lock:
-            print(f"Current Wait-For Graph: {self.graph}")
-            in_degree = {tid: 0 for tid in self.graph}
-            for tid, waiters in self.graph.items():
-                for waiter in waiters:
-                    in_degree[waiter] += 1
+            return [(waiting, waited_for) for waiting, waited in self.graph.items() for waited_for in waited]
 
-            queue = [tid for tid, degree in in_degree.items() if degree == 0]
-            visited = 0
+    def find_deadlocks(self, transactions=None):
+        """
+        Find every deadlock of the wait-for graph in a single pass, as the strongly connected
+        components of more than one transaction (Tarjan's algorithm, iterative): each cycle
+        lies within one component, and aborting a transaction of a component may leave
+        smaller cycles among the others. Used as a periodic fallback to the detection done
+        when edges are added.
+        :param transactions: Only search the subgraph of these transactions, e.g. the rest of
+                             a component whose victim was aborted.
+        :return: A list of sets of deadlocked transactions, empty if there is no deadlock.
+        """
+        members = None if transactions is None else set(transactions)
 
-            while queue:
-                current = queue.pop(0)
-                visited += 1
-                for waiter in self.graph.get(current, []):
-                    in_degree[waiter] -= 1
-                    if in_degree[waiter] == 0:
-                        queue.append(waiter)
+        def waited(transaction_id):
+            waited_for = self.graph.get(transaction_id, ())
+            return iter(waited_for if members is None else members.intersection(waited_for))
 
-            # If not all transactions are visited, there's a cycle
-            if visited != len(in_degree):
-                cycle = [tid for tid, degree in in_degree.items() if degree > 0]
-                return cycle
-            return None
+        with self.lock:
+            order = {}  # Transaction -> order in which the search reached it
+            low = {}  # Transaction -> lowest order reachable from it within the search stack
+            stack = []
+            on_stack = set()
+            components = []
+            for root in list(self.graph) if members is None else members & self.graph.keys():
+                if root in order:
+                    continue
+                low[root] = order[root] = len(order)
+                stack.append(root)
+                on_stack.add(root)
+                iterators = [(root, waited(root))]
+                while iterators:
+                    current, successors = iterators[-1]
+                    waited_for = next(successors, _EXHAUSTED)
+                    if waited_for is _EXHAUSTED:
+                        iterators.pop()
+                        if iterators:
+                            parent = iterators[-1][0]
+                            low[parent] = min(low[parent], low[current])
+                        if low[current] == order[current]:
+                            # current is the root of a component, made of the stack above it
+                            component = set()
+                            while True:
+                                member = stack.pop()
+                                on_stack.discard(member)
+                                component.add(member)
+                                if member == current:
+                                    break
+                            if len(component) > 1:
+                                components.append(component)
+                    elif waited_for not in order:
+                        low[waited_for] = order[waited_for] = len(order)
+                        stack.append(waited_for)
+                        on_stack.add(waited_for)
+                        iterators.append((waited_for, waited(waited_for)))
+                    elif waited_for in on_stack:
+                        low[current] = min(low[current], order[waited_for])
+            return components